@@ -0,0 +1,149 @@
+"""Compare the generated (de)serializers with ``dataclasses_json``.
+
+The reference classes are built from the fields of the classes in
+``paprikasync.paprika``, so both sides always have exactly the same
+fields.  For each class, decoding from dicts (as returned by the API) and
+encoding to JSON (as done for uploads) is timed, and the memory allocated
+for the decoded objects is measured.
+
+Example::
+
+    python benchmarks/bench_codec.py --count 10000
+"""
+
+import argparse
+import dataclasses
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from dataclasses_json import dataclass_json
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from mock_paprika import _hash, _make_recipe, _uid  # noqa: E402
+
+from paprikasync import paprika  # noqa: E402
+
+
+def reference_class(cls):
+    """Create a ``dataclasses_json`` class with the same fields as `cls`."""
+    ns = {
+        '__annotations__': {f.name: f.type for f in dataclasses.fields(cls)},
+        '__module__': cls.__module__,
+    }
+    for f in dataclasses.fields(cls):
+        if f.default is not dataclasses.MISSING:
+            ns[f.name] = f.default
+        elif f.default_factory is not dataclasses.MISSING:
+            ns[f.name] = dataclasses.field(default_factory=f.default_factory)
+    return dataclass_json(dataclasses.dataclass(type(cls.__name__, (), ns)))
+
+
+def make_data(count):
+    rng = random.Random(0)
+    recipes = [_make_recipe(_uid(rng), f'Recipe {i}', rng) for i in range(count)]
+    photos = []
+    for i, recipe in enumerate(recipes):
+        uid = _uid(rng)
+        photos.append(
+            {
+                'uid': uid,
+                'filename': f'{uid}.jpg',
+                'name': f'Photo {i}',
+                'order_flag': 0,
+                'recipe_uid': recipe['uid'],
+                'hash': _hash(uid),
+                'photo_url': None,
+                'deleted': False,
+            }
+        )
+    categories = [
+        {
+            'uid': _uid(rng),
+            'name': f'Category {i}',
+            'order_flag': i,
+            'parent_uid': None,
+            'deleted': False,
+        }
+        for i in range(count)
+    ]
+    return {
+        paprika.Recipe: recipes,
+        paprika.Photo: photos,
+        paprika.Category: categories,
+    }
+
+
+def _best_of(repeat, func):
+    best = float('inf')
+    for __ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _allocated(func):
+    tracemalloc.start()
+    try:
+        # keep the result alive so it is included in the measurement
+        result = func()  # noqa: F841
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(cls, items, repeat):
+    results = []
+    for name, impl in (('dataclasses_json', reference_class(cls)), ('generated', cls)):
+        objs = [impl.from_dict(x) for x in items]
+        assert [o.to_json() for o in objs] == [
+            json.dumps(x, ensure_ascii=True) for x in _normalized(cls, items)
+        ]
+        results.append(
+            {
+                'class': cls.__name__,
+                'impl': name,
+                'decode': _best_of(repeat, lambda: [impl.from_dict(x) for x in items]),
+                'encode': _best_of(repeat, lambda: [o.to_json() for o in objs]),
+                'memory': _allocated(lambda: [impl.from_dict(x) for x in items]),
+            }
+        )
+    return results
+
+
+def _normalized(cls, items):
+    names = [f.name for f in dataclasses.fields(cls)]
+    return [{name: x.get(name) for name in names} for x in items]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for cls, items in make_data(args.count).items():
+        results += bench(cls, items, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{args.count} objects, best of {args.repeat}')
+    print(f'{"class":10}{"impl":18}{"decode":>10}{"encode":>10}{"memory":>12}')
+    for r in results:
+        print(
+            f'{r["class"]:10}{r["impl"]:18}'
+            f'{r["decode"] * 1000:8.1f}ms{r["encode"] * 1000:8.1f}ms'
+            f'{r["memory"] / 1024 / 1024:9.1f} MiB'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Check that quick CLI commands stay quick to start.
+
+Each command is run several times in a fresh interpreter with
+``-X importtime`` and a temporary config directory containing a config
+with some partners.  Reported are the median wall time and the median time
+spent importing modules (excluding what the interpreter itself imports at
+startup).  The benchmark fails if the import time of a command exceeds the
+budget, or if it imports any of the modules that are only needed to talk
+to the Paprika API.
+
+Example::
+
+    python benchmarks/bench_startup.py --budget 100
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+COMMANDS = {
+    'help': ['--help'],
+    'partner list': ['partner', 'list'],
+}
+# none of these are needed unless a command talks to the API
+HEAVY_MODULES = {'requests', 'urllib3', 'dataclasses_json', 'paprikasync.paprika'}
+_RUN_CLI = 'import sys; from paprikasync.cli import cli; cli(sys.argv[1:])'
+
+
+def write_config(config_home):
+    config_dir = Path(config_home) / 'paprikasync'
+    config_dir.mkdir(parents=True)
+    config = {
+        'user_token': 'x' * 64,
+        'partners': [
+            {
+                'name': f'partner{i}',
+                'token': 'x' * 64,
+                'sync_status': {'recipes': i, 'photos': i},
+                'own_sync_status': {'recipes': i, 'photos': i},
+            }
+            for i in range(10)
+        ],
+    }
+    (config_dir / 'config.json').write_text(json.dumps(config))
+
+
+def run_command(args, env, code=_RUN_CLI):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code, *args],
+        env=env,
+        cwd=HERE.parent,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f'{" ".join(args)} failed:\n{proc.stderr}')
+    return elapsed, _parse_importtime(proc.stderr)
+
+
+def _parse_importtime(output):
+    """Get the cumulative import time (in us) of each top-level import."""
+    imports = {}
+    for line in output.splitlines():
+        # "import time: self [us] | cumulative | name", indented by level
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        __, cumulative, name = line.split('|')
+        if not name[1:].startswith(' '):
+            imports[name.strip()] = int(cumulative)
+        else:
+            imports.setdefault(name.strip(), 0)
+    return imports
+
+
+def bench(name, args, env, repeat, startup_modules):
+    runs = []
+    imported = set()
+    for __ in range(repeat):
+        elapsed, imports = run_command(args, env)
+        # the interpreter's own imports are not our business
+        import_time = sum(
+            t for module, t in imports.items() if module not in startup_modules
+        )
+        runs.append((elapsed, import_time / 1e6))
+        imported |= imports.keys()
+    return {
+        'command': name,
+        'wall': statistics.median(r[0] for r in runs),
+        'imports': statistics.median(r[1] for r in runs),
+        'heavy_modules': sorted(HEAVY_MODULES & imported),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=100,
+        help='maximum import time per command in milliseconds',
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as config_home:
+        write_config(config_home)
+        env = {**os.environ, 'XDG_CONFIG_HOME': config_home}
+        __, startup_modules = run_command([], env, code='pass')
+        results = [
+            bench(name, cmd, env, args.repeat, startup_modules.keys())
+            for name, cmd in COMMANDS.items()
+        ]
+
+    failed = False
+    for r in results:
+        r['ok'] = r['imports'] * 1000 <= args.budget and not r['heavy_modules']
+        failed |= not r['ok']
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'median of {args.repeat} runs, import budget {args.budget:.0f}ms')
+        print(f'{"command":15}{"wall":>10}{"imports":>10}  result')
+        for r in results:
+            result = 'ok' if r['ok'] else 'FAIL'
+            if r['heavy_modules']:
+                result += f' (imports {", ".join(r["heavy_modules"])})'
+            print(
+                f'{r["command"]:15}{r["wall"] * 1000:8.1f}ms'
+                f'{r["imports"] * 1000:8.1f}ms  {result}'
+            )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
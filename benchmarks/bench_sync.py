@@ -0,0 +1,255 @@
+"""End-to-end benchmarks of ``paprikasync run`` against a mock server.
+
+The mock server (see ``mock_paprika.py``) runs in a separate process so
+its own CPU time and memory do not end up in the measurements.  For each
+account size a partner account with synthetic recipes and an empty own
+account are created, and then a full sync is run the same way the CLI
+does it.  Reported are the wall time, the number of requests and bytes
+the server saw, and the peak memory allocated by the sync code.
+
+If ``--database-uri`` is given, the web app's refresh-paprika endpoint is
+benchmarked as well using the synced own account.  Use a throwaway
+database for this since the benchmark creates the tables it needs.
+
+Example::
+
+    python benchmarks/bench_sync.py --sizes 100,1000 --latency 0.02
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import requests
+
+HERE = Path(__file__).resolve().parent
+
+
+@contextlib.contextmanager
+def mock_server(photo_size):
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            str(HERE / 'mock_paprika.py'),
+            '--photo-size',
+            str(photo_size),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        api_base = proc.stdout.readline().strip()
+        if not api_base:
+            raise RuntimeError('mock server did not start')
+        yield api_base.rsplit('/api/', 1)[0]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _control(base_url, method, path, **kwargs):
+    resp = requests.request(method, f'{base_url}/_mock/{path}', **kwargs)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _measure(func, *, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        # the sync code is quite chatty
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_cli_sync(base_url, size, args):
+    from paprikasync import paprika
+    from paprikasync.cache import PhotoCache, RecipeCache
+    from paprikasync.config import Partner
+    from paprikasync.sync import sync_partners
+
+    _control(base_url, 'POST', 'reset')
+    _control(base_url, 'PUT', 'faults', json=args.faults)
+    partner_token = _control(
+        base_url,
+        'POST',
+        'accounts',
+        json={
+            'email': 'partner@example.com',
+            'recipes': size,
+            'photos_per_recipe': args.photos_per_recipe,
+            'categories': args.categories,
+            'seed': size,
+        },
+    )['token']
+    own_token = _control(
+        base_url, 'POST', 'accounts', json={'email': 'own@example.com'}
+    )['token']
+    _control(base_url, 'POST', 'reset', params={'stats_only': 1})
+
+    partners = [Partner('partner', partner_token)]
+    pool_size = max(args.jobs, paprika.DEFAULT_POOL_SIZE)
+    limiter = paprika.RateLimiter(args.rate or None, max_concurrency=pool_size)
+
+    def run():
+        with contextlib.ExitStack() as stack:
+            if args.cache:
+                cache_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+                recipe_cache = RecipeCache(cache_dir / 'recipes')
+                photo_cache = PhotoCache(cache_dir / 'photos')
+            else:
+                recipe_cache = photo_cache = None
+            client = stack.enter_context(
+                paprika.PaprikaClient(own_token, pool_size=pool_size, limiter=limiter)
+            )
+            sync_partners(
+                client,
+                partners,
+                jobs=args.jobs,
+                recipe_cache=recipe_cache,
+                photo_cache=photo_cache,
+            )
+
+    elapsed, peak = _measure(run, trace_memory=args.trace_memory)
+    stats = _control(base_url, 'GET', 'stats')
+    return own_token, _result('cli-sync', size, elapsed, peak, stats)
+
+
+def bench_web_refresh(base_url, size, own_token, args):
+    from paprikasync.models import User, db
+    from paprikasync.webapp import app
+
+    # the engine is only created once the database is first used
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database_uri
+    with app.app_context():
+        db.create_all()
+        user = User(
+            name='Benchmark',
+            email=f'bench-{size}-{time.time_ns()}@example.com',
+            password='benchmark',
+            paprika_token=own_token,
+        )
+        db.session.add(user)
+        db.session.commit()
+        user_id, api_token = user.id, user.token
+    _control(base_url, 'POST', 'reset', params={'stats_only': 1})
+
+    def run():
+        resp = app.test_client().post(
+            '/api/user/refresh-paprika',
+            headers={'Authorization': f'Bearer {api_token}'},
+        )
+        assert resp.status_code == 200, resp.data
+
+    try:
+        elapsed, peak = _measure(run, trace_memory=args.trace_memory)
+    finally:
+        with app.app_context():
+            db.session.delete(User.query.get(user_id))
+            db.session.commit()
+    stats = _control(base_url, 'GET', 'stats')
+    return _result('web-refresh', size, elapsed, peak, stats)
+
+
+def _result(name, size, elapsed, peak, stats):
+    return {
+        'benchmark': name,
+        'recipes': size,
+        'seconds': round(elapsed, 3),
+        'requests': stats['requests'],
+        'bytes_in': stats['bytes_in'],
+        'bytes_out': stats['bytes_out'],
+        'errors': stats['errors'],
+        'throttled': stats['throttled'],
+        'peak_memory': peak,
+    }
+
+
+def _print_table(results):
+    columns = list(results[0])
+    rows = [[_format(col, r[col]) for col in columns] for r in results]
+    widths = [
+        max(len(col), *(len(row[i]) for row in rows)) for i, col in enumerate(columns)
+    ]
+    print('  '.join(col.ljust(w) for col, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(value.rjust(w) for value, w in zip(row, widths)))
+
+
+def _format(column, value):
+    if value is None:
+        return '-'
+    if column.startswith('bytes') or column == 'peak_memory':
+        return f'{value / 1024 / 1024:.1f} MiB'
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--sizes',
+        default='100,1000,10000',
+        help='comma-separated numbers of recipes in the partner account',
+    )
+    parser.add_argument('--photos-per-recipe', type=float, default=0.5)
+    parser.add_argument('--photo-size', type=int, default=32768)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--cache', action='store_true', help='use (empty) caches')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float)
+    parser.add_argument(
+        '--database-uri', help='also benchmark refresh-paprika using this database'
+    )
+    parser.add_argument(
+        '--no-trace-memory',
+        dest='trace_memory',
+        action='store_false',
+        help='do not measure peak memory (tracing slows things down a bit)',
+    )
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+    args.faults = {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+    }
+
+    results = []
+    with mock_server(args.photo_size) as base_url:
+        # must be set before anything from paprikasync is imported
+        os.environ['PAPRIKA_API_BASE'] = f'{base_url}/api/v2'
+        sys.path.insert(0, str(HERE.parent))
+        for size in map(int, args.sizes.split(',')):
+            own_token, result = bench_cli_sync(base_url, size, args)
+            results.append(result)
+            if args.database_uri:
+                results.append(bench_web_refresh(base_url, size, own_token, args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_table(results)
+        if not args.database_uri:
+            print('\nweb-refresh skipped, use --database-uri to enable it')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+"""A local stand-in for the Paprika sync API.
+
+It implements the login and ``/api/v2/sync/*`` endpoints used by
+``paprikasync.paprika`` and serves synthetic accounts of any size, plus
+"S3" photo downloads.  Latency, random server errors and throttling can
+be injected to see how the sync code behaves under less ideal conditions.
+
+To use it from the paprikasync code, ``PAPRIKA_API_BASE`` must point to
+the server's ``api_base`` *before* ``paprikasync.paprika`` is imported.
+
+The server can also be run on its own (``python mock_paprika.py``), in
+which case accounts, faults and statistics are managed through the
+``/_mock/*`` endpoints.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+from uuid import UUID, uuid4
+
+from flask import Flask, Response, abort, jsonify, request
+from werkzeug.serving import make_server
+
+
+@dataclass
+class Account:
+    email: str
+    password: str
+    token: str = field(default_factory=lambda: str(uuid4()))
+    recipes: Dict[str, dict] = field(default_factory=dict)
+    photos: Dict[str, dict] = field(default_factory=dict)
+    categories: Dict[str, dict] = field(default_factory=dict)
+    # uploaded images (if kept), generated ones are created on the fly
+    images: Dict[str, bytes] = field(default_factory=dict)
+    status: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def bump(self, key: str) -> None:
+        self.status[key] += 1
+
+
+@dataclass
+class Faults:
+    #: fixed delay added to every request (in seconds)
+    latency: float = 0
+    #: random additional delay of up to this many seconds
+    jitter: float = 0
+    #: fraction of API requests failing with a 503
+    error_rate: float = 0
+    #: maximum API requests per second per account before sending a 429
+    throttle_rate: Optional[float] = None
+    #: value of the Retry-After header sent with a 429
+    retry_after: float = 1
+
+
+@dataclass
+class Stats:
+    requests: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    errors: int = 0
+    throttled: int = 0
+    by_endpoint: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'by_endpoint': dict(self.by_endpoint),
+        }
+
+
+class MockPaprika:
+    """The mock server state and its WSGI application."""
+
+    def __init__(
+        self,
+        faults: Optional[Faults] = None,
+        *,
+        photo_size: int = 32768,
+        keep_uploads: bool = False,
+    ):
+        self.faults = faults or Faults()
+        self.photo_size = photo_size
+        # storing uploaded photos is only needed to download them again
+        # and would inflate the memory usage of large benchmarks
+        self.keep_uploads = keep_uploads
+        self.accounts: Dict[str, Account] = {}
+        self.stats = Stats()
+        self.base_url = None
+        self._lock = threading.Lock()
+        self._throttle = defaultdict(list)
+        self._server = None
+        self.app = self._create_app()
+
+    @property
+    def api_base(self) -> str:
+        return f'{self.base_url}/api/v2'
+
+    def add_account(
+        self,
+        email: str,
+        *,
+        password: str = 'secret',
+        recipes: int = 0,
+        photos_per_recipe: float = 0,
+        categories: int = 0,
+        trashed: float = 0,
+        seed: int = 0,
+    ) -> Account:
+        """Create an account with synthetic data.
+
+        `photos_per_recipe` may be fractional, e.g. 0.5 results in every
+        other recipe having an extra photo.  `trashed` is the fraction of
+        recipes that are in the trash.
+        """
+        rng = random.Random(seed)
+        account = Account(email, password)
+        for i in range(categories):
+            uid = _uid(rng)
+            account.categories[uid] = {
+                'uid': uid,
+                'name': f'Category {i}',
+                'order_flag': i,
+                'parent_uid': None,
+                'deleted': False,
+            }
+        category_uids = list(account.categories)
+        photo_counter = itertools.count()
+        for i in range(recipes):
+            uid = _uid(rng)
+            recipe = _make_recipe(uid, f'Recipe {i} of {email}', rng)
+            recipe['in_trash'] = rng.random() < trashed
+            if category_uids:
+                recipe['categories'] = [rng.choice(category_uids)]
+            account.recipes[uid] = recipe
+            n_photos = int(photos_per_recipe * (i + 1)) - int(photos_per_recipe * i)
+            for j in range(n_photos):
+                photo_uid = _uid(rng)
+                account.photos[photo_uid] = {
+                    'uid': photo_uid,
+                    'filename': f'{photo_uid}.jpg',
+                    'name': f'Photo {next(photo_counter)}',
+                    'order_flag': j,
+                    'recipe_uid': uid,
+                    'hash': _hash(photo_uid),
+                    'deleted': False,
+                }
+        account.status.update(recipes=1, photos=1, categories=1)
+        self.accounts[account.token] = account
+        return account
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> MockPaprika:
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.base_url = f'http://{host}:{self._server.server_port}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = Stats()
+
+    def reset(self) -> None:
+        self.accounts.clear()
+        self._throttle.clear()
+        self.reset_stats()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def image_data(self, account: Account, key: str, hash: str) -> bytes:
+        try:
+            return account.images[key]
+        except KeyError:
+            block = hashlib.sha256(hash.encode()).digest()
+            return (block * (self.photo_size // len(block) + 1))[: self.photo_size]
+
+    def _create_app(self) -> Flask:
+        app = Flask(__name__)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+        def _account() -> Account:
+            auth = request.headers.get('Authorization', '')
+            account = (
+                self.accounts.get(auth[7:]) if auth.startswith('Bearer ') else None
+            )
+            if account is None:
+                abort(_error(401, 'Invalid token'))
+            return account
+
+        @app.route('/api/v2/account/login/', methods=('POST',))
+        def login():
+            email = request.form.get('email')
+            password = request.form.get('password')
+            for account in self.accounts.values():
+                if account.email == email and account.password == password:
+                    return jsonify(result={'token': account.token})
+            return jsonify(error={'message': 'Invalid email or password'})
+
+        @app.route('/api/v2/sync/status/')
+        def status():
+            return jsonify(result=_account().status)
+
+        @app.route('/api/v2/sync/categories/')
+        def categories():
+            return jsonify(result=list(_account().categories.values()))
+
+        @app.route('/api/v2/sync/categories/', methods=('POST',))
+        def save_categories():
+            account = _account()
+            for category in _uploaded_data():
+                account.categories[category['uid']] = category
+            account.bump('categories')
+            return jsonify(result=True)
+
+        @app.route('/api/v2/sync/recipes/')
+        def recipes():
+            return jsonify(
+                result=[
+                    {'uid': r['uid'], 'hash': r['hash']}
+                    for r in _account().recipes.values()
+                ]
+            )
+
+        @app.route('/api/v2/sync/recipe/<uid>/')
+        def recipe(uid):
+            account = _account()
+            try:
+                data = dict(account.recipes[uid])
+            except KeyError:
+                abort(_error(404, 'Recipe not found'))
+            if data['photo']:
+                data['photo_url'] = f'{self.base_url}/s3/{account.token}/recipe/{uid}'
+            return jsonify(result=data)
+
+        @app.route('/api/v2/sync/recipe/<uid>/', methods=('POST',))
+        def save_recipe(uid):
+            account = _account()
+            data = _uploaded_data()
+            data['photo_url'] = None
+            if 'photo_upload' in request.files:
+                image = request.files['photo_upload'].read()
+                if self.keep_uploads:
+                    account.images[f'recipe/{uid}'] = image
+            account.recipes[uid] = data
+            account.bump('recipes')
+            return jsonify(result=True)
+
+        @app.route('/api/v2/sync/photos/')
+        def photos():
+            return jsonify(result=list(_account().photos.values()))
+
+        @app.route('/api/v2/sync/photo/<uid>/')
+        def photo(uid):
+            account = _account()
+            try:
+                data = dict(account.photos[uid])
+            except KeyError:
+                abort(_error(404, 'Photo not found'))
+            data['photo_url'] = f'{self.base_url}/s3/{account.token}/photo/{uid}'
+            return jsonify(result=data)
+
+        @app.route('/api/v2/sync/photo/<uid>/', methods=('POST',))
+        def save_photo(uid):
+            account = _account()
+            data = _uploaded_data()
+            data.pop('photo_url', None)
+            if 'photo_upload' in request.files:
+                image = request.files['photo_upload'].read()
+                if self.keep_uploads:
+                    account.images[f'photo/{uid}'] = image
+            account.photos[uid] = data
+            account.bump('photos')
+            return jsonify(result=True)
+
+        @app.route('/api/v2/sync/notify/', methods=('POST',))
+        def notify():
+            _account()
+            return jsonify(result=True)
+
+        @app.route('/s3/<token>/<kind>/<uid>')
+        def s3(token, kind, uid):
+            account = self.accounts.get(token)
+            items = {'recipe': 'recipes', 'photo': 'photos'}.get(kind)
+            if account is None or items is None:
+                abort(403)
+            try:
+                obj = getattr(account, items)[uid]
+            except KeyError:
+                abort(404)
+            hash = obj['photo_hash'] if kind == 'recipe' else obj['hash']
+            data = self.image_data(account, f'{kind}/{uid}', hash)
+            return Response(data, mimetype='image/jpeg')
+
+        @app.route('/_mock/accounts', methods=('POST',))
+        def mock_add_account():
+            params = request.get_json()
+            account = self.add_account(params.pop('email'), **params)
+            return jsonify(token=account.token)
+
+        @app.route('/_mock/faults', methods=('PUT',))
+        def mock_faults():
+            self.faults = Faults(**request.get_json())
+            return jsonify(asdict(self.faults))
+
+        @app.route('/_mock/stats')
+        def mock_stats():
+            with self._lock:
+                return jsonify(self.stats.to_dict())
+
+        @app.route('/_mock/reset', methods=('POST',))
+        def mock_reset():
+            if request.args.get('stats_only'):
+                self.reset_stats()
+            else:
+                self.reset()
+            return jsonify(result=True)
+
+        return app
+
+    def _before_request(self):
+        if request.path.startswith('/_mock/'):
+            return None
+        faults = self.faults
+        endpoint = request.url_rule.rule if request.url_rule else request.path
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.bytes_in += request.content_length or 0
+            self.stats.by_endpoint[f'{request.method} {endpoint}'] += 1
+        delay = faults.latency + random.uniform(0, faults.jitter)
+        if delay:
+            time.sleep(delay)
+        if not request.path.startswith('/api/'):
+            return None
+        if faults.throttle_rate:
+            key = request.headers.get('Authorization')
+            now = time.monotonic()
+            with self._lock:
+                recent = [t for t in self._throttle[key] if now - t < 1]
+                throttled = len(recent) >= faults.throttle_rate
+                if not throttled:
+                    recent.append(now)
+                self._throttle[key] = recent
+                if throttled:
+                    self.stats.throttled += 1
+            if throttled:
+                resp = _error(429, 'Too many requests')
+                resp.headers['Retry-After'] = str(faults.retry_after)
+                return resp
+        if faults.error_rate and random.random() < faults.error_rate:
+            with self._lock:
+                self.stats.errors += 1
+            return _error(503, 'Service unavailable')
+        return None
+
+    def _after_request(self, response):
+        if request.path.startswith('/_mock/'):
+            return response
+        if response.direct_passthrough:
+            size = response.content_length or 0
+        else:
+            size = len(response.get_data())
+        with self._lock:
+            self.stats.bytes_out += size
+        return response
+
+
+def _error(status: int, message: str) -> Response:
+    resp = jsonify(error={'message': message})
+    resp.status_code = status
+    return resp
+
+
+def _uploaded_data():
+    return json.loads(gzip.decompress(request.files['data'].read()))
+
+
+def _uid(rng: random.Random) -> str:
+    return str(UUID(int=rng.getrandbits(128), version=4)).upper()
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest().upper()
+
+
+def _make_recipe(uid: str, name: str, rng: random.Random) -> dict:
+    text = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(20, 200)))
+    has_photo = rng.random() < 0.8
+    return {
+        'categories': [],
+        'cook_time': '20 min',
+        'created': '2020-01-01 12:00:00',
+        'description': '',
+        'difficulty': '',
+        'directions': text,
+        'hash': _hash(f'{uid}{text}'),
+        'image_url': None,
+        'in_trash': False,
+        'ingredients': '\n'.join(rng.sample(_WORDS, 8)),
+        'is_pinned': False,
+        'name': name,
+        'notes': '',
+        'nutritional_info': '',
+        'on_favorites': False,
+        'on_grocery_list': None,
+        'photo': f'{uid}.jpg' if has_photo else None,
+        'photo_hash': _hash(f'photo-{uid}') if has_photo else None,
+        'photo_large': None,
+        'photo_url': None,
+        'prep_time': '10 min',
+        'rating': rng.randint(0, 5),
+        'scale': None,
+        'servings': '4',
+        'source': '',
+        'source_url': '',
+        'total_time': '30 min',
+        'uid': uid,
+    }
+
+
+_WORDS = (
+    'salt pepper paprika onion garlic butter flour sugar egg milk cream cheese '
+    'tomato basil oregano thyme rosemary chicken beef pork rice pasta potato '
+    'carrot celery lemon lime olive oil vinegar honey mustard ginger chili '
+    'stir bake roast simmer chop slice dice whisk fold knead season serve'
+).split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock Paprika sync server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--photo-size', type=int, default=32768)
+    parser.add_argument('--keep-uploads', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = MockPaprika(photo_size=args.photo_size, keep_uploads=args.keep_uploads)
+    server.start(args.host, args.port)
+    # the first line of output is what scripts starting the server wait for
+    print(server.api_base, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
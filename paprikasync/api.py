@@ -1,16 +1,19 @@
 import mimetypes
+from datetime import datetime
 from functools import wraps
-from io import BytesIO
+from pathlib import Path
 from uuid import UUID
 
-from flask import Blueprint, current_app, g, jsonify, request, send_file
+from flask import Blueprint, current_app, g, jsonify, request
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from webargs import fields
 from werkzeug.exceptions import HTTPException, UnprocessableEntity
 
 from . import paprika
 from .args import use_kwargs
-from .models import Partner, Recipe, User, db
+from .blobs import send_image
+from .models import Partner, Photo, Recipe, User, db
 from .schemas import (
     AllPartnersSchema,
     BasicRecipeSchema,
@@ -20,6 +23,7 @@ from .schemas import (
     RecipeSchema,
     UserSchema,
 )
+from .tracing import Tracer, span
 
 api = Blueprint('api', __name__, url_prefix='/api')
 
@@ -139,23 +143,46 @@ def user_me_update(name=None):
 @api.route('/user/refresh-paprika', methods=('POST',))
 @require_user
 def user_refresh_paprika():
-    new_status = paprika.get_sync_status(g.user.paprika_token)
-    todo = new_status.get_updated(g.user.paprika_sync_status)
+    trace_dir = current_app.config['PAPRIKASYNC_TRACE_DIR']
+    tracer = Tracer() if trace_dir else None
     try:
-        if 'categories' in todo:
-            g.user.sync_categories()
-        if 'recipes' in todo:
-            g.user.sync_recipes()
-        if 'photos' in todo:
-            g.user.sync_photos()
-        db.session.flush()
-    except IntegrityError:
-        return jsonify(error='sync_conflict'), 409
+        with paprika.PaprikaClient(
+            g.user.paprika_token,
+            pool_size=max(
+                current_app.config['PAPRIKASYNC_SYNC_JOBS'], paprika.DEFAULT_POOL_SIZE
+            ),
+            tracer=tracer,
+        ) as client:
+            with span(tracer, 'sync status'):
+                new_status = paprika.get_sync_status(client)
+            todo = new_status.get_updated(g.user.paprika_sync_status)
+            try:
+                if 'categories' in todo:
+                    g.user.sync_categories(client)
+                if 'recipes' in todo:
+                    g.user.sync_recipes(client)
+                if 'photos' in todo:
+                    g.user.sync_photos(client)
+                with span(tracer, 'flush'):
+                    db.session.flush()
+            except IntegrityError:
+                return jsonify(error='sync_conflict'), 409
+    finally:
+        if tracer is not None:
+            _save_trace(tracer, trace_dir, f'refresh-paprika-{g.user.id}')
     g.user.paprika_sync_status = new_status
     db.session.commit()
     return {x: x in todo for x in ('categories', 'recipes', 'photos')}
 
 
+def _save_trace(tracer: Tracer, trace_dir: str, name: str) -> None:
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    path = Path(trace_dir) / f'{name}-{timestamp}.json'
+    with path.open('w') as f:
+        tracer.save(f)
+    current_app.logger.info('Saved trace to %s', path)
+
+
 @api.route('/user/partners/active/')
 @require_user
 def user_partners_active():
@@ -280,7 +307,12 @@ def paprika_recipes(user):
 @require_user
 @allow_partner
 def paprika_recipe(user, id):
-    recipe = Recipe.query.with_parent(user).filter_by(id=id).first()
+    recipe = (
+        Recipe.query.with_parent(user)
+        .filter_by(id=id)
+        .options(joinedload(Recipe.photos))
+        .first()
+    )
     if not recipe:
         return jsonify(error='invalid_recipe'), 404
     return RecipeSchema().jsonify(recipe)
@@ -299,7 +331,10 @@ def paprika_recipe_main_photo(user, id):
     mimetype = (
         mimetypes.guess_type(recipe.data['photo'])[0] or 'application/octet-stream'
     )
-    return send_file(BytesIO(recipe.image_data), mimetype=mimetype)
+    rv = send_image(Recipe, recipe.id, recipe.image_key, mimetype=mimetype)
+    if rv is None:
+        return jsonify(error='no_photo'), 404
+    return rv
 
 
 @api.route('/paprika/recipes/<int:id>/photos/<int:pid>')
@@ -316,4 +351,7 @@ def paprika_recipe_photo(user, id, pid):
     mimetype = (
         mimetypes.guess_type(photo.data['filename'])[0] or 'application/octet-stream'
     )
-    return send_file(BytesIO(photo.image_data), mimetype=mimetype)
+    rv = send_image(Photo, photo.id, photo.image_key, mimetype=mimetype)
+    if rv is None:
+        return jsonify(error='no_photo'), 404
+    return rv
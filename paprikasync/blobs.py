@@ -0,0 +1,251 @@
+"""Storage for the images of recipes and photos.
+
+Images are stored outside the database in a content-addressed blob store,
+using the hash Paprika provides for each image as the key.  Since the
+content of a key never changes, an image only needs to be stored once
+even if several users have the same recipe, and it can be served directly
+from the store without going through the database and Python.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from flask import Response, current_app, redirect, request, send_file
+
+# keys are used as file names (and their first two characters as a directory
+# name), so they must not start with a dot like "." or ".."
+_KEY_RE = re.compile(r'[\w-][\w.-]{0,199}')
+# how long presigned S3 urls used to serve images are valid
+S3_URL_EXPIRY = 3600
+
+
+class BlobStore:
+    """Base class for blob stores."""
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store a blob unless there is already one with this key."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def send(
+        self, key: str, *, mimetype: str, etag: Optional[str] = None
+    ) -> Optional[Response]:
+        """Create a response serving the blob, or None if it does not exist."""
+        raise NotImplementedError
+
+
+class FileBlobStore(BlobStore):
+    """Store blobs as files in a local directory.
+
+    Blobs are served using ``send_file``, so the WSGI server can use
+    ``sendfile`` (and Flask's ``USE_X_SENDFILE`` works as well).  Behind
+    nginx, set `accel_redirect_prefix` to an internal location that maps
+    to the store's directory, and nginx serves the files itself.
+    """
+
+    def __init__(self, path: Path, *, accel_redirect_prefix: Optional[str] = None):
+        self.path = Path(path)
+        self.accel_redirect_prefix = accel_redirect_prefix
+        if accel_redirect_prefix:
+            self.accel_redirect_prefix = accel_redirect_prefix.rstrip('/')
+
+    def __repr__(self):
+        return f'<FileBlobStore({self.path})>'
+
+    def _relpath(self, key: str) -> str:
+        if not _KEY_RE.fullmatch(key):
+            raise ValueError(f'Invalid blob key: {key}')
+        # avoid huge directories
+        key = key.lower()
+        return f'{key[:2]}/{key}'
+
+    def get_path(self, key: str) -> Path:
+        return self.path / self._relpath(key)
+
+    def exists(self, key: str) -> bool:
+        return self.get_path(key).exists()
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.get_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.get_path(key)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{uuid4().hex}.tmp')
+        tmp_path.write_bytes(data)
+        # atomic, so nobody ever sees a partial file
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        self.get_path(key).unlink(missing_ok=True)
+
+    def send(
+        self, key: str, *, mimetype: str, etag: Optional[str] = None
+    ) -> Optional[Response]:
+        path = self.get_path(key)
+        if not path.exists():
+            return None
+        if self.accel_redirect_prefix is None:
+            return send_file(path, mimetype=mimetype, etag=(etag or True))
+        rv = Response(mimetype=mimetype)
+        rv.headers['X-Accel-Redirect'] = (
+            f'{self.accel_redirect_prefix}/{self._relpath(key)}'
+        )
+        if etag:
+            rv.set_etag(etag)
+        return rv.make_conditional(request)
+
+
+class S3BlobStore(BlobStore):
+    """Store blobs in an S3-compatible object store.
+
+    `endpoint_url` can point to any S3-compatible service, e.g. a local
+    MinIO instance for testing.  Blobs are served by redirecting to a
+    presigned url, so they never pass through the web app.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        *,
+        prefix: str = '',
+        endpoint_url: Optional[str] = None,
+        client=None,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        if client is None:
+            import boto3
+
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+
+    def __repr__(self):
+        return f'<S3BlobStore({self.bucket}/{self.prefix})>'
+
+    def _object_key(self, key: str) -> str:
+        if not _KEY_RE.fullmatch(key):
+            raise ValueError(f'Invalid blob key: {key}')
+        key = key.lower()
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def _is_missing(self, exc: Exception) -> bool:
+        code = getattr(exc, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as exc:
+            if self._is_missing(exc):
+                return False
+            raise
+        return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            resp = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as exc:
+            if self._is_missing(exc):
+                return None
+            raise
+        return resp['Body'].read()
+
+    def put(self, key: str, data: bytes) -> None:
+        if self.exists(key):
+            return
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def send(
+        self, key: str, *, mimetype: str, etag: Optional[str] = None
+    ) -> Optional[Response]:
+        if not self.exists(key):
+            return None
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': self._object_key(key),
+                'ResponseContentType': mimetype,
+            },
+            ExpiresIn=S3_URL_EXPIRY,
+        )
+        return redirect(url)
+
+
+def create_blob_store(url: str, **options) -> BlobStore:
+    """Create a blob store from a url.
+
+    Supported are ``file:///path/to/dir`` (or just a path) and
+    ``s3://bucket/prefix``.
+    """
+    parts = urlsplit(url)
+    if parts.scheme == 's3':
+        return S3BlobStore(
+            parts.netloc,
+            prefix=parts.path,
+            endpoint_url=options.get('s3_endpoint_url'),
+        )
+    elif parts.scheme in ('', 'file'):
+        return FileBlobStore(
+            Path(parts.path),
+            accel_redirect_prefix=options.get('accel_redirect_prefix'),
+        )
+    raise ValueError(f'Unsupported blob store: {url}')
+
+
+def get_blob_store() -> BlobStore:
+    """Get the blob store of the current app."""
+    store = current_app.extensions.get('paprikasync_blobs')
+    if store is None:
+        config = current_app.config
+        url = config['PAPRIKASYNC_BLOB_STORE'] or os.path.join(
+            current_app.instance_path, 'blobs'
+        )
+        store = current_app.extensions['paprikasync_blobs'] = create_blob_store(
+            url,
+            accel_redirect_prefix=config['PAPRIKASYNC_BLOB_ACCEL_REDIRECT'],
+            s3_endpoint_url=config['PAPRIKASYNC_S3_ENDPOINT_URL'],
+        )
+    return store
+
+
+def send_image(
+    cls, id: int, key: Optional[str], *, mimetype: str, etag: Optional[str] = None
+) -> Optional[Response]:
+    """Serve the image of a recipe or photo.
+
+    Images that have not been moved to the blob store yet are served from
+    the database.  Returns None if there is no image.
+    """
+    if key:
+        rv = get_blob_store().send(key, mimetype=mimetype, etag=etag)
+        if rv is not None:
+            return rv
+    image_data = cls.query.with_entities(cls.image_data).filter_by(id=id).scalar()
+    if image_data is None:
+        return None
+    return send_file(BytesIO(image_data), mimetype=mimetype, etag=(etag or False))
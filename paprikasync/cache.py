@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import calendar
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+from .constants import CACHE_DIR
+
+DEFAULT_RECIPE_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_PHOTO_CACHE_SIZE = 1024 * 1024 * 1024
+# temp files older than this (in seconds) are left over from crashed writes
+STALE_TMP_AGE = 3600
+_KEY_RE = re.compile(r'[\w.-]{1,200}')
+
+
+class DiskCache:
+    """A size-bounded key/value store of files in a directory.
+
+    Each entry is stored in its own file. Reading an entry updates its
+    modification time, and when the total size exceeds `max_size` the
+    least recently used entries are removed.
+
+    The directory is only scanned once; after that the entries are kept
+    in memory in the order they were used, so adding an entry does not
+    need to look at all the others.
+    """
+
+    def __init__(self, path: Path, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self._lock = Lock()
+        # sizes of all entries, least recently used first
+        self._sizes: Optional[OrderedDict[str, int]] = None
+        self._total = 0
+
+    def __repr__(self):
+        return f'<{type(self).__name__}({self.path}, {self.max_size})>'
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            self._get_sizes()
+            return self._total
+
+    def _get_sizes(self) -> OrderedDict[str, int]:
+        # the directory is only scanned once we actually use the cache
+        if self._sizes is None:
+            self.path.mkdir(0o700, parents=True, exist_ok=True)
+            entries = []
+            stale_before = time.time() - STALE_TMP_AGE
+            for entry in os.scandir(self.path):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if not entry.name.endswith('.tmp'):
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+                elif stat.st_mtime < stale_before:
+                    # recent ones may still be written by another run
+                    os.unlink(entry.path)
+            self._sizes = OrderedDict(
+                (filename, size) for __, filename, size in sorted(entries)
+            )
+            self._total = sum(self._sizes.values())
+        return self._sizes
+
+    def _filename(self, key: str) -> str:
+        # keys that could be mistaken for something else are hashed as well
+        if _KEY_RE.fullmatch(key) and key.strip('.') and not key.endswith('.tmp'):
+            return key
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_path(self, key: str) -> Optional[Path]:
+        """Get the path of a cached entry and mark it as recently used."""
+        filename = self._filename(key)
+        with self._lock:
+            if filename not in self._get_sizes():
+                return None
+            path = self.path / filename
+            try:
+                # so the order is kept for the next run
+                os.utime(path)
+            except FileNotFoundError:
+                self._total -= self._sizes.pop(filename)
+                return None
+            self._sizes.move_to_end(filename)
+            return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_size:
+            return
+        tmp_path = self.temp_path()
+        tmp_path.write_bytes(data)
+        self.commit(key, tmp_path)
+
+    def temp_path(self) -> Path:
+        """Get a path for a new file that can be added using :meth:`commit`."""
+        with self._lock:
+            self._get_sizes()
+        return self.path / f'{uuid4().hex}.tmp'
+
+    def commit(self, key: str, tmp_path: Path) -> None:
+        """Move a file created in :meth:`temp_path` into the cache."""
+        filename = self._filename(key)
+        size = tmp_path.stat().st_size
+        if size > self.max_size:
+            tmp_path.unlink()
+            return
+        with self._lock:
+            sizes = self._get_sizes()
+            os.replace(tmp_path, self.path / filename)
+            self._total += size - sizes.get(filename, 0)
+            sizes[filename] = size
+            sizes.move_to_end(filename)
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        filename = self._filename(key)
+        with self._lock:
+            size = self._get_sizes().pop(filename, None)
+            if size is not None:
+                self._total -= size
+                (self.path / filename).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        while self._total > self.max_size:
+            filename, size = self._sizes.popitem(last=False)
+            self._total -= size
+            (self.path / filename).unlink(missing_ok=True)
+
+
+class RecipeCache:
+    """Full recipe data keyed by the recipe uid and its hash.
+
+    Since the hash changes whenever a recipe is modified, a cached entry
+    never needs to be invalidated - it just stops being used and is evicted
+    eventually.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_DIR / 'recipes',
+        max_size: int = DEFAULT_RECIPE_CACHE_SIZE,
+    ):
+        self.store = DiskCache(path, max_size)
+
+    def __repr__(self):
+        return f'<RecipeCache({self.store.path})>'
+
+    def get(self, uid: str, hash: str) -> Optional[dict]:
+        data = self.store.get(f'{uid}.{hash}')
+        if data is None:
+            return None
+        recipe = json.loads(data)
+        if recipe.get('photo_url') and photo_url_expired(recipe['photo_url']):
+            # the recipe itself is fine, but we need a fresh photo url
+            return None
+        return recipe
+
+    def put(self, uid: str, hash: str, data: dict) -> None:
+        self.store.put(f'{uid}.{hash}', json.dumps(data).encode())
+
+
+class PhotoCache:
+    """Photo files keyed by the photo hash.
+
+    Recipes synced from several partners often share the same photos, so
+    this cache is shared between all partners.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_DIR / 'photos',
+        max_size: int = DEFAULT_PHOTO_CACHE_SIZE,
+    ):
+        self.store = DiskCache(path, max_size)
+
+    def __repr__(self):
+        return f'<PhotoCache({self.store.path})>'
+
+    def get_path(self, hash: str) -> Optional[Path]:
+        return self.store.get_path(hash)
+
+    def temp_path(self) -> Path:
+        return self.store.temp_path()
+
+    def commit(self, hash: str, tmp_path: Path) -> None:
+        self.store.commit(hash, tmp_path)
+
+
+def photo_url_expired(url: str, *, margin: float = 300) -> bool:
+    """Check whether a presigned S3 url has expired (or is about to)."""
+    query = parse_qs(urlsplit(url).query)
+    if 'Expires' in query:
+        # signature v2
+        expires = float(query['Expires'][0])
+    elif 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+        # signature v4
+        signed = calendar.timegm(
+            time.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+        )
+        expires = signed + float(query['X-Amz-Expires'][0])
+    else:
+        return False
+    return time.time() + margin >= expires
@@ -1,11 +1,16 @@
+import json
 import sys
 from functools import wraps
+from typing import Optional, TextIO
 
 import click
 
-from . import paprika
+# Only import what is needed to set up the commands here; the cli is often
+# called from scripts, and commands like `partner list` should not have to
+# wait for requests and the api client to be imported.
 from .config import Config, load_config
-from .sync import do_sync
+from .constants import DEFAULT_JOBS, DEFAULT_POOL_SIZE, DEFAULT_RATE
+from .pipeline import DEFAULT_QUEUE_SIZE
 
 pass_config = click.make_pass_decorator(Config)
 
@@ -22,6 +27,8 @@ def require_login(fn):
 
 
 def _prompt_token():
+    from . import paprika
+
     email = click.prompt('Email')
     password = click.prompt('Password', hide_input=True)
     token, error = paprika.login(email, password)
@@ -61,22 +68,223 @@ def cli(ctx):
     metavar='NAME',
     help='Only sync from the specified partner',
 )
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    metavar='N',
+    help='Number of recipes/photos to transfer concurrently',
+)
+@click.option(
+    '--fetch-jobs',
+    type=click.IntRange(min=1),
+    metavar='N',
+    help='Number of recipes to download concurrently (defaults to --jobs)',
+)
+@click.option(
+    '--transform-jobs',
+    type=click.IntRange(min=1),
+    metavar='N',
+    help='Number of recipes to prepare for uploading concurrently [default: 1]',
+)
+@click.option(
+    '--upload-jobs',
+    type=click.IntRange(min=1),
+    metavar='N',
+    help='Number of recipes to upload concurrently (defaults to --jobs)',
+)
+@click.option(
+    '--photo-jobs',
+    type=click.IntRange(min=1),
+    metavar='N',
+    help='Number of photos to transfer concurrently (defaults to --jobs)',
+)
+@click.option(
+    '--queue-size',
+    type=click.IntRange(min=1),
+    default=DEFAULT_QUEUE_SIZE,
+    show_default=True,
+    metavar='N',
+    help='Number of recipes that may wait between two stages of the sync',
+)
+@click.option(
+    '--parallel',
+    '-P',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    metavar='N',
+    help='Number of partners to sync concurrently',
+)
+@click.option(
+    '--rate',
+    type=click.FloatRange(min=0),
+    default=DEFAULT_RATE,
+    show_default=True,
+    help='Maximum number of API requests per second (0 for no limit)',
+)
+@click.option(
+    '--no-cache',
+    'use_cache',
+    is_flag=True,
+    flag_value=False,
+    default=True,
+    help='Always download recipes and photos instead of using the local cache',
+)
+@click.option(
+    '--update',
+    '-u',
+    is_flag=True,
+    help='Also update recipes that changed since they were synced. This '
+    'overwrites any changes you made to your copy, except for its categories.',
+)
+@click.option(
+    '--full',
+    is_flag=True,
+    help='Sync all partners even if nothing changed since the last sync',
+)
+@click.option(
+    '--resume',
+    is_flag=True,
+    help='Continue an interrupted run without repeating what it already synced',
+)
+@click.option(
+    '--stats', is_flag=True, help='Show pipeline and HTTP request statistics at the end'
+)
+@click.option(
+    '--stats-json',
+    type=click.File('w'),
+    metavar='FILE',
+    help='Write HTTP request statistics as JSON to FILE (- for stdout)',
+)
+@click.option(
+    '--trace',
+    type=click.File('w'),
+    metavar='FILE',
+    help='Write a timeline of the run to FILE (Chrome trace format, see Perfetto)',
+)
 @pass_config
 @require_login
-def run(config: Config, dry_run: bool, only_partner: str):
+def run(
+    config: Config,
+    dry_run: bool,
+    only_partner: str,
+    jobs: int,
+    fetch_jobs: Optional[int],
+    transform_jobs: Optional[int],
+    upload_jobs: Optional[int],
+    photo_jobs: Optional[int],
+    queue_size: int,
+    parallel: int,
+    rate: float,
+    use_cache: bool,
+    update: bool,
+    full: bool,
+    resume: bool,
+    stats: bool,
+    stats_json: Optional[TextIO],
+    trace: Optional[TextIO],
+):
     """Synchronize recipes from your partners."""
+    from . import paprika
+    from .cache import PhotoCache, RecipeCache
+    from .journal import SyncJournal
+    from .metrics import HttpMetrics
+    from .sync import OwnAccount, get_stage_jobs, sync_partners
+    from .tracing import Tracer, span
+
     if not config.partners:
         click.echo('You do not have any partners yet.')
         return
-    found = False
-    for partner in config.partners:
-        if only_partner and partner.name.lower() != only_partner.lower():
-            continue
-        found = True
-        do_sync(config.user_token, partner, dry_run=dry_run)
-    if only_partner and not found:
+    partners = [
+        partner
+        for partner in config.partners
+        if not only_partner or partner.name.lower() == only_partner.lower()
+    ]
+    if not partners:
         click.secho('No such partner', fg='yellow', bold=True)
         sys.exit(1)
+    stage_jobs = get_stage_jobs(
+        jobs,
+        {
+            'fetch': fetch_jobs,
+            'transform': transform_jobs,
+            'upload': upload_jobs,
+            'photos': photo_jobs,
+        },
+    )
+    # the limiter caps the number of requests in flight across all partners
+    pool_size = max(
+        sum(stage_jobs.values()) * min(parallel, len(partners)),
+        DEFAULT_POOL_SIZE,
+    )
+    limiter = paprika.RateLimiter(rate or None, max_concurrency=pool_size)
+    metrics = HttpMetrics(paprika.API_BASE) if stats or stats_json else None
+    tracer = Tracer() if trace else None
+    journal = None
+    if not dry_run:
+        journal = SyncJournal()
+        if journal.exists and not resume:
+            click.secho(
+                'The previous run was interrupted, starting over. '
+                'Use --resume to continue it instead.',
+                fg='yellow',
+            )
+        journal.open(resume=resume)
+    with paprika.PaprikaClient(
+        config.user_token,
+        pool_size=pool_size,
+        limiter=limiter,
+        metrics=metrics,
+        tracer=tracer,
+    ) as client:
+        own_status = None
+        if not full:
+            with span(tracer, 'own status'):
+                own_status = paprika.get_sync_status(client)
+        own = OwnAccount(client, dry_run=dry_run, partners=partners)
+        try:
+            partner_statuses = sync_partners(
+                client,
+                partners,
+                own=own,
+                parallel=parallel,
+                dry_run=dry_run,
+                stage_jobs=stage_jobs,
+                queue_size=queue_size,
+                stats=stats,
+                recipe_cache=(RecipeCache() if use_cache else None),
+                photo_cache=(PhotoCache() if use_cache else None),
+                own_status=own_status,
+                update=update,
+                journal=journal,
+            )
+        finally:
+            # the journal is kept if anything went wrong
+            if journal is not None:
+                journal.close()
+            # a trace is most interesting when something went wrong
+            if tracer is not None:
+                tracer.save(trace)
+        if not dry_run:
+            # our own status only changed if something was saved to it,
+            # possibly during an earlier interrupted run
+            if own_status is None or own.modified or journal.modified:
+                own_status = paprika.get_sync_status(client)
+            for partner in partners:
+                partner.sync_status = partner_statuses[partner.name].to_dict()
+                partner.own_sync_status = own_status.to_dict()
+            config.save()
+            journal.discard()
+    if stats:
+        click.echo()
+        for line in metrics.report():
+            click.echo(line)
+    if stats_json:
+        json.dump(metrics.to_dict(), stats_json, indent=2)
+        stats_json.write('\n')
 
 
 @cli.command()
@@ -157,6 +365,8 @@ def partner_add(config: Config, name: str, credentials: bool):
 
     Your partner can export their token for you using `paprikasync token`.
     """
+    from . import paprika
+
     if not name or any(p.name.lower() == name.lower() for p in config.partners):
         click.secho('Invalid name or already in use', fg='red', bold=True)
         sys.exit(1)
@@ -12,7 +12,7 @@ const RecipeItem = ({recipe, categories, url}) => (
     <Item.Image
       as={Link}
       to={joinPaths(url, `/recipe/${recipe.id}`)}
-      src={recipe.photo_url || placeholder}
+      src={recipe.thumbnail_url || placeholder}
     />
     <Item.Content verticalAlign="middle">
       <Item.Header as={Link} to={joinPaths(url, `/recipe/${recipe.id}`)}>
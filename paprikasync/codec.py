@@ -0,0 +1,161 @@
+"""Fast JSON encoding and decoding of dataclasses.
+
+:func:`json_dataclass` is a drop-in replacement for ``dataclass_json``
+plus ``dataclass`` for the simple classes mirroring Paprika API objects.
+Instead of inspecting the fields and their types every time an object is
+decoded or encoded, a ``from_dict`` and a ``to_dict`` function are
+generated once per class.  The classes also use ``__slots__``, which makes
+them smaller and their attributes faster to access.
+
+Only fields of type ``str``, ``int``, ``float`` and ``bool``, optionally
+wrapped in ``Optional`` and/or ``List``, are supported.  Values are
+converted the same way ``dataclasses_json`` does it: values of the wrong
+type are passed to the type (e.g. ``int('5')``), ``None`` is kept as-is,
+unknown keys are ignored and missing keys get the field's default.  A
+missing key without a default raises a ``KeyError``, unless
+``infer_missing`` is set, in which case it becomes ``None``.
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+from dataclasses import MISSING, Field, dataclass, fields
+from typing import List, Tuple, get_type_hints
+
+_PRIMITIVES = (str, int, float, bool)
+
+
+def json_dataclass(cls):
+    """Turn a class into a dataclass with fast JSON (de)serialization."""
+    cls = _add_slots(dataclass(cls))
+    specs = [_field_spec(cls, f, t) for f, t in _field_types(cls)]
+    cls.from_dict = classmethod(_make_from_dict(cls, specs))
+    cls.to_dict = _make_to_dict(cls, specs)
+    cls.from_json = classmethod(_from_json)
+    cls.to_json = _to_json
+    return cls
+
+
+def _from_json(cls, s, *, infer_missing=False, **kwargs):
+    return cls.from_dict(json.loads(s, **kwargs), infer_missing=infer_missing)
+
+
+def _to_json(self, **kwargs) -> str:
+    return json.dumps(self.to_dict(), **kwargs)
+
+
+def _add_slots(cls):
+    # equivalent to `dataclass(slots=True)`, which needs python 3.10
+    names = tuple(f.name for f in fields(cls))
+    ns = {k: v for k, v in cls.__dict__.items() if k not in names}
+    ns.pop('__dict__', None)
+    ns.pop('__weakref__', None)
+    ns['__slots__'] = names
+    new_cls = type(cls)(cls.__name__, cls.__bases__, ns)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
+def _field_types(cls) -> List[Tuple[Field, type]]:
+    hints = get_type_hints(cls, vars(sys.modules[cls.__module__]))
+    return [(f, hints[f.name]) for f in fields(cls) if f.init]
+
+
+def _field_spec(cls, f: Field, type_) -> Tuple[str, type, bool, Field]:
+    """Get the element type of a field and whether it is a list."""
+    args = getattr(type_, '__args__', ())
+    if getattr(type_, '__origin__', None) is not None and type(None) in args:
+        # Optional[X]
+        (type_,) = [a for a in args if a is not type(None)]
+        args = getattr(type_, '__args__', ())
+    is_list = getattr(type_, '__origin__', None) is list
+    if is_list:
+        (type_,) = args
+    if type_ not in _PRIMITIVES:
+        raise TypeError(f'Unsupported type for {cls.__name__}.{f.name}: {type_}')
+    return f.name, type_, is_list, f
+
+
+def _coerce(type_, value):
+    if value is None or isinstance(value, type_):
+        return value
+    return type_(value)
+
+
+def _coerce_list(type_, value):
+    if value is None:
+        return None
+    return [v if type(v) is type_ else _coerce(type_, v) for v in value]
+
+
+def _make_from_dict(cls, specs):
+    ns = {
+        'cls': cls,
+        'MISSING': MISSING,
+        '_coerce': _coerce,
+        '_coerce_list': _coerce_list,
+        '_decode_missing': _decode_missing,
+    }
+    lines = ['def from_dict(cls, kvs, *, infer_missing=False):', '  try:']
+    for i, (name, type_, is_list, f) in enumerate(specs):
+        ns[f'type_{i}'] = type_
+        if f.default is MISSING and f.default_factory is MISSING:
+            lines.append(f'    v = kvs[{name!r}]')
+        else:
+            ns[f'default_{i}'] = f.default
+            ns[f'factory_{i}'] = f.default_factory
+            lines.append(f'    v = kvs.get({name!r}, MISSING)')
+            lines.append('    if v is MISSING:')
+            if f.default is not MISSING:
+                lines.append(f'      v = default_{i}')
+            else:
+                lines.append(f'      v = factory_{i}()')
+        if is_list:
+            lines.append(f'    f_{i} = _coerce_list(type_{i}, v)')
+        else:
+            # the common case of a correct type needs no function call
+            lines.append(f'    f_{i} = v')
+            lines.append(f'    if type(v) is not type_{i}:')
+            lines.append(f'      f_{i} = _coerce(type_{i}, v)')
+    lines.append('  except KeyError:')
+    lines.append('    return _decode_missing(cls, kvs, infer_missing)')
+    args = ', '.join(f'f_{i}' for i in range(len(specs)))
+    lines.append(f'  return cls({args})')
+    return _compile(cls, 'from_dict', lines, ns)
+
+
+def _decode_missing(cls, kvs, infer_missing):
+    # not performance critical; either fill in None or fail with the same
+    # KeyError as dataclasses_json
+    missing = [
+        f.name
+        for f in fields(cls)
+        if f.name not in kvs and f.default is MISSING and f.default_factory is MISSING
+    ]
+    if not infer_missing:
+        raise KeyError(missing[0])
+    return cls.from_dict({**dict.fromkeys(missing), **kvs})
+
+
+def _make_to_dict(cls, specs):
+    items = []
+    for name, __, is_list, __ in specs:
+        if is_list:
+            items.append(
+                f'{name!r}: None if self.{name} is None else list(self.{name})'
+            )
+        else:
+            items.append(f'{name!r}: self.{name}')
+    lines = [
+        'def to_dict(self, encode_json=False):',
+        '  return {' + ', '.join(items) + '}',
+    ]
+    return _compile(cls, 'to_dict', lines, {})
+
+
+def _compile(cls, name: str, lines: List[str], ns: dict):
+    exec('\n'.join(lines), ns)
+    func = ns[name]
+    func.__qualname__ = f'{cls.__qualname__}.{name}'
+    return func
@@ -0,0 +1,127 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, inspect, select
+
+from .blobs import get_blob_store
+from .models import Category, Photo, Recipe, _chunks, db
+
+
+@click.command('migrate-blobs')
+@click.option(
+    '--batch-size',
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help='Number of images to move before committing',
+)
+@with_appcontext
+def migrate_blobs(batch_size: int):
+    """Move images stored in the database to the blob store.
+
+    This can be run while the app is running, since images are served from
+    the database until they have been moved.
+    """
+    store = get_blob_store()
+    # photos used to require an image in the database
+    db.session.execute('ALTER TABLE photos ALTER COLUMN image_data DROP NOT NULL')
+    db.session.commit()
+    for cls in (Recipe, Photo):
+        ids = [
+            id
+            for id, in db.session.query(cls.id)
+            .filter(cls.image_data.isnot(None))
+            .order_by(cls.id)
+        ]
+        click.echo(f'Moving {len(ids)} {cls.__tablename__} images to {store}')
+        moved = skipped = 0
+        for chunk in _chunks(ids, batch_size):
+            # only load the columns we need, and one batch of images at a time
+            rows = db.session.query(cls.id, cls.image_key, cls.image_data).filter(
+                cls.id.in_(chunk)
+            )
+            done = []
+            for id, key, image_data in rows:
+                if not key:
+                    click.secho(f'{cls.__name__} {id} has no image hash', fg='yellow')
+                    skipped += 1
+                    continue
+                store.put(key, image_data)
+                done.append(id)
+            db.session.query(cls).filter(cls.id.in_(done)).update(
+                {cls.image_data: None}, synchronize_session=False
+            )
+            db.session.commit()
+            moved += len(done)
+            click.echo(f'{moved}/{len(ids)}')
+        click.echo(f'Moved {moved} images, skipped {skipped}')
+
+
+@click.command('migrate-columns')
+@with_appcontext
+def migrate_columns():
+    """Update the database of an existing installation.
+
+    This must be run before using a new version with an existing database.
+    It adds the columns copied from the data of categories, photos and
+    recipes, fills them from the existing data, and replaces the unique
+    indexes on the uid in the data with ones on the columns.  It also
+    allows photos without an image in the database, since new images are
+    only kept in the blob store.
+
+    The digests used to detect changes are filled in as well, so the first
+    refresh after upgrading does not rewrite every row.
+    """
+    conn = db.session.connection()
+    conn.execute('ALTER TABLE photos ALTER COLUMN image_data DROP NOT NULL')
+    for cls in (Category, Photo, Recipe):
+        table = cls.__tablename__
+        copied = ['uid', 'hash']
+        if cls is Photo:
+            copied.append('recipe_uid')
+        click.echo(f'Migrating {table}')
+        for name in ('digest', *copied):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} varchar')
+        values = [f"{name} = data->>'{name}'" for name in copied]
+        if cls is Recipe:
+            # see Recipe._digest
+            values.append("digest = data->>'hash'")
+        result = conn.execute(
+            f'UPDATE {table} SET {", ".join(values)} '
+            'WHERE uid IS NULL OR digest IS NULL'
+        )
+        click.echo(f'Filled {result.rowcount} rows')
+        if cls is not Recipe:
+            click.echo(f'Filled {_fill_digests(conn, cls)} digests')
+        for column in cls.__table__.columns:
+            if column.name in copied and not column.nullable:
+                conn.execute(
+                    f'ALTER TABLE {table} ALTER COLUMN {column.name} SET NOT NULL'
+                )
+        conn.execute(f'DROP INDEX IF EXISTS ix_uq_{table}_user_id_data')
+        existing = {index['name'] for index in inspect(conn).get_indexes(table)}
+        for index in cls.__table__.indexes:
+            if index.name not in existing:
+                click.echo(f'Creating index {index.name}')
+                index.create(conn)
+    db.session.commit()
+
+
+def _fill_digests(conn, cls) -> int:
+    # these digests are hashes of the json data, which we cannot compute
+    # the same way in sql
+    table = cls.__table__
+    query = select([table.c.id]).where(table.c.digest.is_(None))
+    ids = [id for id, in conn.execute(query)]
+    update = (
+        table.update()
+        .where(table.c.id == bindparam('_id'))
+        .values(digest=bindparam('_digest'))
+    )
+    for chunk in _chunks(ids):
+        rows = conn.execute(
+            select([table.c.id, table.c.data]).where(table.c.id.in_(chunk))
+        )
+        conn.execute(
+            update, [{'_id': id, '_digest': cls._digest(data)} for id, data in rows]
+        )
+    return len(ids)
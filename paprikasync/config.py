@@ -1,7 +1,6 @@
-from dataclasses import dataclass, field
-from typing import List, Optional
-
-from dataclasses_json import dataclass_json
+import json
+from dataclasses import asdict, dataclass, field, fields
+from typing import Dict, List, Optional
 
 from .constants import CONFIG_FILE, DATA_DIR
 
@@ -9,15 +8,40 @@ from .constants import CONFIG_FILE, DATA_DIR
 @dataclass
 class Partner:
     name: str
-    token: str
+    token: str = field(repr=False)
+    # sync status of the partner's account and of our own account after
+    # the last successful sync from this partner
+    sync_status: Optional[Dict[str, int]] = None
+    own_sync_status: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Partner':
+        return cls(**_known_fields(cls, data))
 
 
-@dataclass_json()
 @dataclass
 class Config:
-    user_token: Optional[str] = None
+    user_token: Optional[str] = field(default=None, repr=False)
     partners: List[Partner] = field(default_factory=list)
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Config':
+        # the config is loaded on every cli call, so we keep this simple
+        # instead of using a (de)serialization library
+        data = _known_fields(cls, data)
+        data['partners'] = [Partner.from_dict(p) for p in data.get('partners') or ()]
+        return cls(**data)
+
+    @classmethod
+    def from_json(cls, s: str) -> 'Config':
+        return cls.from_dict(json.loads(s))
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
     def add_partner(self, name, token) -> None:
         self.partners.append(Partner(name, token))
 
@@ -26,6 +50,12 @@ class Config:
         CONFIG_FILE.write_text(self.to_json(indent=2) + '\n')
 
 
+def _known_fields(cls, data: dict) -> dict:
+    # like dataclasses_json, ignore anything we do not know about
+    names = {f.name for f in fields(cls)}
+    return {k: v for k, v in data.items() if k in names}
+
+
 def load_config() -> Config:
     try:
         return Config.from_json(CONFIG_FILE.read_text())
@@ -4,3 +4,10 @@ import appdirs
 
 DATA_DIR = Path(appdirs.user_config_dir('paprikasync'))
 CONFIG_FILE: Path = DATA_DIR / 'config.json'
+CACHE_DIR: Path = DATA_DIR / 'cache'
+JOURNAL_FILE: Path = DATA_DIR / 'journal.jsonl'
+
+# these are here so the cli does not need to import anything heavy for them
+DEFAULT_JOBS = 4
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RATE = 20
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from threading import Condition, Event
+from typing import Iterable, Iterator, Optional
+
+import requests
+
+from . import paprika
+from .streaming import CHUNK_SIZE, SPOOL_MAX_SIZE
+from .tracing import span
+
+DEFAULT_JOBS = 8
+# seconds a single photo may take, including fetching its metadata
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_IN_FLIGHT = 64 * 1024 * 1024
+# bytes reserved for images sent without a Content-Length
+UNKNOWN_SIZE = SPOOL_MAX_SIZE
+
+
+class DownloadAborted(Exception):
+    pass
+
+
+class ByteBudget:
+    """Limit the number of bytes held at the same time.
+
+    A single item larger than the whole budget is still allowed once
+    nothing else is held, so nothing can get stuck forever.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._cond = Condition()
+
+    def __repr__(self):
+        return f'<ByteBudget({self.used}/{self.limit})>'
+
+    def acquire(self, size: int, *, abort: Optional[Event] = None) -> None:
+        with self._cond:
+            while self.used and self.used + size > self.limit:
+                if abort is not None and abort.is_set():
+                    raise DownloadAborted
+                self._cond.wait(0.1)
+            self.used += size
+
+    def adjust(self, size: int) -> None:
+        """Account for more (or less) bytes than acquired without waiting."""
+        with self._cond:
+            self.used += size
+            self._cond.notify_all()
+
+    def release(self, size: int) -> None:
+        self.adjust(-size)
+
+
+@dataclass
+class PhotoDownload:
+    uid: str
+    # the photo data without the (short-lived) photo url
+    data: dict
+    image_data: bytes
+
+
+class PhotoDownloader:
+    """Download photos concurrently with limits on time and memory.
+
+    Each photo (its metadata and the image itself) must be downloaded
+    within `timeout` seconds; time spent waiting for the byte budget does
+    not count. The images downloaded but not yet consumed may use at most
+    `max_in_flight` bytes, which are released once the consumer asks for
+    the next download.
+    """
+
+    def __init__(
+        self,
+        client: paprika.PaprikaClient,
+        *,
+        jobs: int = DEFAULT_JOBS,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    ):
+        self.client = client
+        self.jobs = jobs
+        self.timeout = timeout
+        self.budget = ByteBudget(max_in_flight)
+
+    def __repr__(self):
+        return f'<PhotoDownloader({self.jobs} jobs, {self.budget})>'
+
+    def download(self, uids: Iterable[str]) -> Iterator[PhotoDownload]:
+        """Download photos and yield them as they are finished.
+
+        If any download fails, the remaining ones are cancelled and the
+        error is raised.
+        """
+        uids = list(uids)
+        if not uids:
+            return
+        abort = Event()
+        with ThreadPoolExecutor(min(self.jobs, len(uids))) as executor:
+            futures = [executor.submit(self._download, uid, abort) for uid in uids]
+            try:
+                for future in as_completed(futures):
+                    download = future.result()
+                    try:
+                        yield download
+                    finally:
+                        self.budget.release(len(download.image_data))
+            finally:
+                # only does something if we failed or the consumer stopped early
+                abort.set()
+                for future in futures:
+                    future.cancel()
+
+    def _download(self, uid: str, abort: Event) -> PhotoDownload:
+        if abort.is_set():
+            raise DownloadAborted
+        with span(self.client.tracer, 'photo download', uid=uid):
+            deadline = time.monotonic() + self.timeout
+            data = paprika.get_photo_raw(self.client, uid)
+            url = data.pop('photo_url')
+            self._check_deadline(uid, deadline)
+            # photo urls point to S3 which must not receive our paprika token
+            with self.client.get(url, auth=False, stream=True) as resp:
+                resp.raise_for_status()
+                size = int(resp.headers.get('Content-Length', 0)) or UNKNOWN_SIZE
+                waiting_since = time.monotonic()
+                self.budget.acquire(size, abort=abort)
+                deadline += time.monotonic() - waiting_since
+                chunks = []
+                received = 0
+                try:
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        if abort.is_set():
+                            raise DownloadAborted
+                        self._check_deadline(uid, deadline)
+                        chunks.append(chunk)
+                        received += len(chunk)
+                        if received > size:
+                            # more than announced (or reserved): charge the
+                            # budget as the bytes arrive
+                            self.budget.adjust(received - size)
+                            size = received
+                except BaseException:
+                    self.budget.release(size)
+                    raise
+        image_data = b''.join(chunks)
+        self.budget.adjust(len(image_data) - size)
+        return PhotoDownload(uid, data, image_data)
+
+    def _check_deadline(self, uid: str, deadline: float) -> None:
+        if time.monotonic() > deadline:
+            raise requests.Timeout(
+                f'Downloading photo {uid} took more than {self.timeout}s'
+            )
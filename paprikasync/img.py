@@ -1,41 +1,82 @@
 import mimetypes
-from io import BytesIO
 
-from flask import Blueprint, abort, request, send_file
+from flask import Blueprint, Response, abort, request
+from webargs import fields, validate
 
-from .models import Recipe
+from .args import use_kwargs
+from .blobs import get_blob_store, send_image
+from .models import Photo, Recipe, db
+from .thumbnails import FORMATS, SIZES, get_thumbnail_generator, variant_key
 
 # This blueprint serves files using URLs that are less guessable since we don't
 # have an easy way to serve them while requiring authentication.
 img = Blueprint('img', __name__, url_prefix='/image')
 
+# The hash of the image is part of the URL, so whatever is served from a URL
+# never changes and browsers do not even need to revalidate it.
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+_variant_args = {
+    'size': fields.Integer(validate=validate.OneOf(SIZES)),
+    'image_format': fields.String(data_key='format', validate=validate.OneOf(FORMATS)),
+}
+
 
 @img.route('/recipe/<int:id>/photo/<hash>/<name>')
-def paprika_recipe_main_photo(id, hash, name):
-    recipe = Recipe.query.get(id)
-    if not recipe or recipe.data['photo_hash'] != hash or recipe.data['photo'] != name:
-        abort(404)
-    mimetype = (
-        mimetypes.guess_type(recipe.data['photo'])[0] or 'application/octet-stream'
+@use_kwargs(_variant_args, location='query')
+def paprika_recipe_main_photo(id, hash, name, size=None, image_format=None):
+    row = (
+        db.session.query(Recipe.data['photo'].astext, Recipe.data['photo_hash'].astext)
+        .filter(Recipe.id == id)
+        .first()
     )
-    rv = send_file(BytesIO(recipe.image_data), mimetype=mimetype)
-    rv.set_etag(recipe.data['photo_hash'])
-    rv.make_conditional(request)
-    return rv
+    if not row or row != (name, hash):
+        abort(404)
+    return _send_image(Recipe, id, hash, name, size, image_format)
 
 
 @img.route('/recipe/<int:id>/photos/<int:pid>/<hash>/<name>')
-def paprika_recipe_photo(id, pid, hash, name):
-    recipe = Recipe.query.get(id)
-    if not recipe:
+@use_kwargs(_variant_args, location='query')
+def paprika_recipe_photo(id, pid, hash, name, size=None, image_format=None):
+    row = (
+        db.session.query(Photo.data['filename'].astext, Photo.image_key)
+        .join(Photo.recipe)
+        .filter(Recipe.id == id, Photo.id == pid)
+        .first()
+    )
+    if not row or row != (name, hash):
         abort(404)
-    photo = recipe.get_photo(pid)
-    if not photo or photo.data['hash'] != hash or photo.data['filename'] != name:
+    return _send_image(Photo, pid, hash, name, size, image_format)
+
+
+def _send_image(cls, id, hash, name, size=None, image_format=None):
+    original_mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if size is None:
+        key = hash
+    else:
+        key = variant_key(hash, size, image_format)
+    # we already know the url is valid, and the key is the etag
+    if request.if_none_match.contains_weak(key):
+        rv = Response(status=304)
+        rv.set_etag(key)
+    elif size is None:
+        rv = send_image(cls, id, hash, mimetype=original_mimetype, etag=hash)
+    elif get_thumbnail_generator().get(cls, id, hash, size, image_format):
+        mimetype = FORMATS.get(image_format, original_mimetype)
+        rv = get_blob_store().send(key, mimetype=mimetype, etag=key)
+    else:
+        # the variant is not ready (or cannot be created), so send the
+        # original but do not let browsers keep it as the variant
+        rv = send_image(cls, id, hash, mimetype=original_mimetype)
+        if rv is not None:
+            rv.cache_control.no_cache = True
+            return rv
+    if rv is None:
         abort(404)
-    mimetype = (
-        mimetypes.guess_type(photo.data['filename'])[0] or 'application/octet-stream'
-    )
-    rv = send_file(BytesIO(photo.image_data), mimetype=mimetype)
-    rv.set_etag(photo.data['hash'])
-    rv.make_conditional(request)
+    # a redirect (e.g. to a presigned url) is not valid forever
+    if rv.status_code in (200, 206, 304):
+        # send_file marks responses as no-cache by default
+        rv.cache_control.no_cache = None
+        rv.cache_control.max_age = IMAGE_MAX_AGE
+        rv.cache_control.immutable = True
     return rv
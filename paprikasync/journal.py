@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Set, Tuple
+
+from .constants import JOURNAL_FILE
+
+DEFAULT_FSYNC_INTERVAL = 1
+DEFAULT_FSYNC_BATCH = 256
+
+
+class SyncJournal:
+    """An append-only log of the work completed during a sync run.
+
+    Every entry is flushed to the OS right away, so nothing is lost if the
+    process is killed. Syncing it to disk is batched though: it only happens
+    after `fsync_batch` entries or `fsync_interval` seconds, which is plenty
+    to survive a crash of the machine without slowing down the sync.
+
+    Entries are one JSON object per line. If the last line is incomplete
+    because of a crash, it is simply ignored when the journal is loaded.
+    """
+
+    def __init__(
+        self,
+        path: Path = JOURNAL_FILE,
+        *,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+        fsync_batch: int = DEFAULT_FSYNC_BATCH,
+    ):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self._lock = Lock()
+        self._file = None
+        self._pending = 0
+        self._last_fsync = 0
+        self._done: Set[Tuple[str, str, str]] = set()
+        self._interrupted: Set[str] = set()
+        self._partners: Dict[str, dict] = {}
+
+    def __repr__(self):
+        return f'<SyncJournal({self.path})>'
+
+    @property
+    def exists(self) -> bool:
+        """Whether there is a journal left by an interrupted run."""
+        try:
+            return self.path.stat().st_size > 0
+        except FileNotFoundError:
+            return False
+
+    @property
+    def modified(self) -> bool:
+        """Whether the journaled work changed anything in our account."""
+        return bool(self._done or self._interrupted)
+
+    def open(self, *, resume: bool = False) -> SyncJournal:
+        """Open the journal for writing.
+
+        When resuming, the existing journal is loaded and new entries are
+        appended to it, otherwise it is discarded.
+        """
+        self.path.parent.mkdir(0o700, parents=True, exist_ok=True)
+        if resume:
+            self._load()
+        self._file = self.path.open('a' if resume else 'w')
+        self._last_fsync = time.monotonic()
+        return self
+
+    def _load(self) -> None:
+        try:
+            data = self.path.read_text()
+        except FileNotFoundError:
+            return
+        complete, __, partial = data.rpartition('\n')
+        if partial:
+            # cut off the entry being written when we crashed, or the next
+            # one would be appended to it and be lost as well
+            with self.path.open('r+') as f:
+                f.truncate(len((complete + '\n' if complete else '').encode()))
+        started = set()
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            kind = entry['kind']
+            if kind == 'partner':
+                self._partners[entry['name']] = entry['status']
+            elif kind == 'recipe-started':
+                started.add(entry['uid'])
+            else:
+                self._done.add((kind, entry['uid'], entry['hash']))
+        done_recipes = {uid for kind, uid, __ in self._done if kind == 'recipe'}
+        self._interrupted = started - done_recipes
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._fsync()
+                self._file.close()
+                self._file = None
+
+    def discard(self) -> None:
+        """Close and remove the journal after a successful run."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, entry: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._pending += 1
+            if (
+                self._pending >= self.fsync_batch
+                or time.monotonic() - self._last_fsync >= self.fsync_interval
+            ):
+                self._fsync()
+
+    def _fsync(self) -> None:
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_fsync = time.monotonic()
+
+    def recipe_started(self, uid: str) -> None:
+        """Record that a recipe is about to be saved.
+
+        Once the recipe exists in our account it looks like it has been
+        synced completely, so without this we could not tell whether the
+        run was interrupted before its photos were uploaded.
+        """
+        self._write({'kind': 'recipe-started', 'uid': uid})
+
+    def recipe_done(self, uid: str, hash: str) -> None:
+        self._write({'kind': 'recipe', 'uid': uid, 'hash': hash})
+
+    def photo_done(self, uid: str, hash: str) -> None:
+        self._write({'kind': 'photo', 'uid': uid, 'hash': hash})
+
+    def partner_done(self, name: str, status: dict) -> None:
+        self._write({'kind': 'partner', 'name': name, 'status': status})
+
+    def is_recipe_done(self, uid: str, hash: str) -> bool:
+        return ('recipe', uid, hash) in self._done
+
+    def is_recipe_interrupted(self, uid: str) -> bool:
+        """Check whether a previous run may have stopped halfway through a recipe."""
+        return uid in self._interrupted
+
+    def is_photo_done(self, uid: str, hash: str) -> bool:
+        return ('photo', uid, hash) in self._done
+
+    def get_partner_status(self, name: str) -> Optional[dict]:
+        """Get the sync status of a partner that has been synced completely."""
+        return self._partners.get(name)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import bisect
+import re
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+# upper bounds of the latency histogram buckets (in seconds)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_UID_RE = re.compile(
+    r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?=/|$)', re.I
+)
+
+
+def endpoint_name(api_base: str, method: str, url: str) -> str:
+    """Get a name for the endpoint of a request, without any uids in it."""
+    if not url.startswith(api_base):
+        # the only other urls we use are the presigned S3 photo urls
+        return f'{method} photo download ({urlsplit(url).hostname})'
+    path = url.replace(api_base, '', 1).split('?', 1)[0]
+    return f'{method} {_UID_RE.sub("/<uid>", path)}'
+
+
+@dataclass
+class EndpointStats:
+    calls: int = 0
+    retries: int = 0
+    errors: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    total_time: float = 0
+    # one more bucket than LATENCY_BUCKETS for anything slower
+    histogram: List[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Estimate a latency percentile based on the histogram.
+
+        This returns the upper bound of the bucket containing the
+        percentile, or None if it is in the overflow bucket.
+        """
+        total = sum(self.histogram)
+        if not total:
+            return None
+        threshold = total * p / 100
+        count = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.histogram):
+            count += n
+            if count >= threshold:
+                return bound
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'errors': self.errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'total_time': round(self.total_time, 6),
+            'mean_time': round(self.total_time / self.calls, 6) if self.calls else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'histogram': dict(zip([*map(str, LATENCY_BUCKETS), 'inf'], self.histogram)),
+        }
+
+
+class HttpMetrics:
+    """Request statistics per API endpoint.
+
+    Every attempt of a request is counted as a call; attempts after the
+    first one are also counted as retries. Errors are failed connections
+    and responses with an error status.
+    """
+
+    def __init__(self, api_base: str):
+        self.api_base = api_base.rstrip('/')
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f'<HttpMetrics({len(self.endpoints)} endpoints)>'
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        *,
+        elapsed: float,
+        status: Optional[int],
+        retry: bool = False,
+        bytes_in: int = 0,
+        bytes_out: int = 0,
+    ) -> None:
+        name = endpoint_name(self.api_base, method, url)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with self._lock:
+            stats = self.endpoints.get(name)
+            if stats is None:
+                stats = self.endpoints[name] = EndpointStats()
+            stats.calls += 1
+            stats.retries += retry
+            stats.errors += status is None or status >= 400
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.total_time += elapsed
+            stats.histogram[bucket] += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                name: stats.to_dict() for name, stats in sorted(self.endpoints.items())
+            }
+
+    def report(self) -> List[str]:
+        """Get a summary table of all endpoints for humans."""
+        rows = [
+            (
+                'endpoint',
+                'calls',
+                'retries',
+                'errors',
+                'in',
+                'out',
+                'mean',
+                'p50',
+                'p95',
+                'total',
+            )
+        ]
+        with self._lock:
+            items = sorted(self.endpoints.items(), key=lambda x: -x[1].total_time)
+            for name, s in items:
+                rows.append(
+                    (
+                        name,
+                        str(s.calls),
+                        str(s.retries),
+                        str(s.errors),
+                        _format_bytes(s.bytes_in),
+                        _format_bytes(s.bytes_out),
+                        _format_time(s.total_time / s.calls),
+                        _format_time(s.percentile(50), upper_bound=True),
+                        _format_time(s.percentile(95), upper_bound=True),
+                        _format_time(s.total_time),
+                    )
+                )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return [
+            '  '.join(
+                value.ljust(width) if i == 0 else value.rjust(width)
+                for i, (value, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        ]
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GiB'
+
+
+def _format_time(seconds: Optional[float], *, upper_bound: bool = False) -> str:
+    if seconds is None:
+        return f'>{LATENCY_BUCKETS[-1]}s' if upper_bound else '-'
+    prefix = '<' if upper_bound else ''
+    if seconds < 1:
+        return f'{prefix}{seconds * 1000:.0f}ms'
+    return f'{prefix}{seconds:.1f}s'
@@ -1,26 +1,38 @@
 from __future__ import annotations
 
 import dataclasses
+import hashlib
+import itertools
+import json
 import re
-from typing import Callable, Iterable, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional, Tuple
 from uuid import uuid4
 
-import requests
 from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import orm
-from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID, insert
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import column_property, joinedload
 from sqlalchemy.orm.relationships import foreign
-from sqlalchemy.sql import select
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.sql import exists, select
 from sqlalchemy_utils import PasswordType
 
 from . import paprika
+from .blobs import BlobStore, get_blob_store
+from .downloads import PhotoDownload, PhotoDownloader
+from .tracing import span
+
+if TYPE_CHECKING:
+    from logging import Logger
 
 db = SQLAlchemy()
+# number of rows sent to the database in a single statement during a sync
+SYNC_CHUNK_SIZE = 1000
 
 
 db.Model.metadata.naming_convention = {
@@ -87,14 +99,14 @@ class User(db.Model):
             return None
         return user
 
-    def sync_categories(self) -> None:
-        Category.sync(self)
+    def sync_categories(self, client: paprika.PaprikaClient) -> None:
+        Category.sync(self, client)
 
-    def sync_photos(self) -> None:
-        Photo.sync(self)
+    def sync_photos(self, client: paprika.PaprikaClient) -> None:
+        Photo.sync(self, client)
 
-    def sync_recipes(self) -> None:
-        Recipe.sync(self)
+    def sync_recipes(self, client: paprika.PaprikaClient) -> None:
+        Recipe.sync(self, client)
 
     def get_active_partners(self):
         partners = (
@@ -167,19 +179,17 @@ class PaprikaModel(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     data = db.Column('data', JSONB, nullable=False)
+    # used to detect changes without comparing the whole data
+    digest = db.Column(db.String, nullable=True)
+    # copied from the data so they can be indexed and joined on cheaply;
+    # see `_data_columns`
+    uid = db.Column(db.String, nullable=False)
+    hash = db.Column(db.String, nullable=True)
 
     @declared_attr
     def user_id(cls):
         return db.Column(db.ForeignKey(User.id), index=True)
 
-    @hybrid_property
-    def uid(self) -> str:
-        return self.data['uid']
-
-    @uid.expression
-    def uid(cls):
-        return cls.data['uid'].astext
-
     name = data_property('name')
     in_trash = data_property('in_trash')
 
@@ -188,9 +198,14 @@ class PaprikaModel(db.Model):
         return f'<{clsname}({self.id}, {self.uid}): {self.name}>'
 
     @classmethod
-    def sync(cls, user: User) -> Tuple[set, set, set]:
+    def sync(cls, user: User, client: paprika.PaprikaClient) -> Tuple[set, set, set]:
         raise NotImplementedError
 
+    @classmethod
+    def _data_columns(cls, data: dict) -> dict:
+        """Get the values of the columns that are copied from the data."""
+        return {'uid': data['uid'], 'hash': data.get('hash')}
+
     @classmethod
     def _sync(
         cls,
@@ -198,40 +213,140 @@ class PaprikaModel(db.Model):
         collection_name: str,
         new: Iterable[dict],
         get_data: Callable = lambda data: data,
-        compare_objs: Callable = lambda old, new: old.data == new,
+        *,
+        jobs: int = 1,
     ) -> Tuple[set, set, set]:
+        """Sync a user's collection with the data from Paprika.
+
+        This is done with a few set-based queries instead of loading the whole
+        collection: the incoming uids and digests are staged in a temporary
+        table, which is then joined against the collection to find what is
+        new or changed.  Only the new and changed objects are passed through
+        `get_data`, and only once all of them have been fetched the rows that
+        are gone are deleted (using an anti-join against the staged uids) and
+        the new and changed ones are upserted.
+
+        `get_data` is called from up to `jobs` threads at the same time, so
+        it must not use the database or anything else bound to the app
+        context.
+        """
         current_app.logger.info('Running sync (%s)', collection_name)
-        collection = getattr(user, collection_name)
-        current = {obj.uid: obj for obj in collection}
+        # anything pending must be in the database before we bypass the orm
+        db.session.flush()
+        conn = db.session.connection()
+        table = cls.__table__
         new = {data['uid']: data for data in new}
-        current_uids = current.keys()
-        new_uids = new.keys()
-        new_objs = set()
+        incoming = db.Table(
+            f'sync_incoming_{table.name}',
+            db.MetaData(),
+            db.Column('uid', db.String, primary_key=True),
+            db.Column('digest', db.String, nullable=False),
+            prefixes=['TEMPORARY'],
+            postgresql_on_commit='DROP',
+        )
+        incoming.create(conn)
+        try:
+            for chunk in _chunks(new.values()):
+                rows = [{'uid': d['uid'], 'digest': cls._digest(d)} for d in chunk]
+                conn.execute(incoming.insert().values(rows))
+            # new and changed
+            query = (
+                select([incoming.c.uid, cls.id])
+                .select_from(
+                    incoming.outerjoin(
+                        table, (cls.user_id == user.id) & (cls.uid == incoming.c.uid)
+                    )
+                )
+                .where(cls.digest.is_distinct_from(incoming.c.digest))
+            )
+            changed = {uid: id for uid, id in conn.execute(query)}
+            for uid, id in changed.items():
+                if id is None:
+                    current_app.logger.info('Adding %s %s', cls.__name__, uid)
+                else:
+                    current_app.logger.info('Updating %s %s', cls.__name__, uid)
+            # nothing has been written to the collection so far, so no rows
+            # are locked while we wait for the (possibly slow) fetches
+            rows = []
+            changed_data = [new[uid] for uid in changed]
+            for data in _map_concurrently(get_data, changed_data, jobs):
+                rows.append(
+                    {
+                        'user_id': user.id,
+                        'data': data,
+                        'digest': cls._digest(data),
+                        **cls._data_columns(data),
+                    }
+                )
+            # deleted
+            query = (
+                table.delete()
+                .where(cls.user_id == user.id)
+                .where(~exists().where(incoming.c.uid == cls.uid))
+                .returning(cls.id, cls.user_id, cls.data)
+            )
+            deleted_rows = conn.execute(query).fetchall()
+        finally:
+            incoming.drop(conn)
+
+        ids = []
+        for chunk in _chunks(rows):
+            query = insert(table).values(chunk)
+            query = query.on_conflict_do_update(
+                index_elements=[cls.user_id, cls.uid],
+                set_={
+                    name: query.excluded[name]
+                    for name in chunk[0]
+                    if name not in ('user_id', 'uid')
+                },
+            ).returning(cls.id)
+            ids += [id for id, in conn.execute(query)]
+
+        # the orm does not know about any of this, so we reload what we
+        # return and make sure nothing stale is used later on
+        db.session.expire(user, [collection_name])
+        objs = (
+            cls.query.filter(cls.id.in_(ids)).populate_existing().all() if ids else []
+        )
+        new_objs = {obj for obj in objs if changed[obj.uid] is None}
+        updated_objs = set(objs) - new_objs
         deleted_objs = set()
-        updated_objs = set()
-        # deleted
-        for uid in current_uids - new_uids:
-            obj = current[uid]
-            current_app.logger.info('Deleting %r', obj)
-            db.session.delete(obj)
+        for id, user_id, data in deleted_rows:
+            if (obj := db.session.identity_map.get(identity_key(cls, id))) is not None:
+                db.session.expunge(obj)
+            obj = cls(id=id, user_id=user_id, data=data, **cls._data_columns(data))
+            current_app.logger.info('Deleted %r', obj)
             deleted_objs.add(obj)
-        # existing, maybe updated
-        for uid in current_uids & new_uids:
-            obj = current[uid]
-            if compare_objs(obj, new[uid]):
-                # current_app.logger.info('Nothing to do for %r', obj)
-                continue
-            current_app.logger.info('Updating %r', obj)
-            obj.data = get_data(new[uid])
-            updated_objs.add(obj)
-        # new
-        for uid in new_uids - current_uids:
-            obj = cls(data=get_data(new[uid]))
-            current_app.logger.info('Adding %r', obj)
-            collection.append(obj)
-            new_objs.add(obj)
         return new_objs, updated_objs, deleted_objs
 
+    @staticmethod
+    def _digest(data: dict) -> str:
+        """Get a digest of the data to detect changes."""
+        return hashlib.sha1(
+            json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+        ).hexdigest()
+
+
+def _map_concurrently(func: Callable, items: list, jobs: int) -> list:
+    if jobs == 1 or len(items) < 2:
+        return list(map(func, items))
+    with ThreadPoolExecutor(min(jobs, len(items))) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            # no point in fetching the rest if we cannot use it
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _chunks(items: Iterable, size: Optional[int] = None) -> Iterator[list]:
+    size = size or SYNC_CHUNK_SIZE
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
 
 class Category(PaprikaModel):
     __tablename__ = 'categories'
@@ -241,82 +356,145 @@ class Category(PaprikaModel):
         return [c for c in self.user.categories if c.data['parent_uid'] == self.uid]
 
     @classmethod
-    def sync(cls, user: User) -> Tuple[set, set, set]:
-        return cls._sync(
-            user, 'categories', paprika.get_categories_raw(user.paprika_token)
-        )
+    def sync(cls, user: User, client: paprika.PaprikaClient) -> Tuple[set, set, set]:
+        with span(client.tracer, 'list categories'):
+            new = paprika.get_categories_raw(client)
+        with span(client.tracer, 'sync categories'):
+            return cls._sync(user, 'categories', new)
 
 
 class Photo(PaprikaModel):
     __tablename__ = 'photos'
 
-    image_data = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    # images are kept in the blob store; this is only used for images that
+    # have not been moved there yet using `flask migrate-blobs`
+    image_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    recipe_uid = db.Column(db.String, nullable=False)
 
     @classmethod
-    def sync(cls, user: User) -> Tuple[set, set, set]:
-        new = paprika.get_photos_raw(user.paprika_token)
-        added, updated, deleted = cls._sync(user, 'photos', new)
-        for photo in added:
-            photo.download(user.paprika_token)
+    def sync(cls, user: User, client: paprika.PaprikaClient) -> Tuple[set, set, set]:
+        with span(client.tracer, 'list photos'):
+            new = paprika.get_photos_raw(client)
+        with span(client.tracer, 'sync photos'):
+            added, updated, deleted = cls._sync(user, 'photos', new)
+        config = current_app.config
+        downloader = PhotoDownloader(
+            client,
+            jobs=config['PAPRIKASYNC_SYNC_JOBS'],
+            timeout=config['PAPRIKASYNC_PHOTO_TIMEOUT'],
+            max_in_flight=config['PAPRIKASYNC_PHOTO_MAX_IN_FLIGHT'],
+        )
+        store = get_blob_store()
+        # an updated photo may have a new image, and thus a new key
+        photos = {
+            photo.uid: photo
+            for photo in added | updated
+            if not store.exists(photo.image_key)
+        }
+        for download in downloader.download(photos):
+            photo = photos[download.uid]
+            photo._apply_download(download)
+            store.put(photo.image_key, download.image_data)
         return added, updated, deleted
 
-    def download(self, paprika_token: str) -> None:
-        current_app.logger.info('Downloading photo %r', self)
-        data = paprika.get_photo_raw(paprika_token, self.uid)
-        photo_url = data.pop('photo_url')
-        if self.data != data:
+    @hybrid_property
+    def image_key(self) -> str:
+        return self.hash
+
+    @classmethod
+    def _data_columns(cls, data: dict) -> dict:
+        return {**super()._data_columns(data), 'recipe_uid': data['recipe_uid']}
+
+    def _apply_download(self, download: PhotoDownload) -> None:
+        current_app.logger.info('Downloaded photo %r', self)
+        if self.data != download.data:
             current_app.logger.warning(
-                'Photo data changed during sync: %r != %r', self.data, data
+                'Photo data changed during sync: %r != %r', self.data, download.data
             )
-            if 'uid' in data:
-                self.data = data
-        resp = requests.get(photo_url)
-        resp.raise_for_status()
-        self.image_data = resp.content
+            if 'uid' in download.data:
+                self.data = download.data
+                self.digest = self._digest(download.data)
+                for name, value in self._data_columns(download.data).items():
+                    setattr(self, name, value)
+
+
+# the photos of a recipe
+db.Index(None, Photo.user_id, Photo.recipe_uid)
 
 
 class Recipe(PaprikaModel):
     __tablename__ = 'recipes'
 
+    # see Photo.image_data
     image_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
 
     photos = db.relationship(
         'Photo',
         viewonly=True,
-        lazy='joined',
         primaryjoin=lambda: db.and_(
-            db.cast(Recipe.data, JSONB)['uid']
-            == foreign(db.cast(Photo.data, JSONB)['recipe_uid']),
-            Recipe.user_id == Photo.user_id,
+            Recipe.user_id == foreign(Photo.user_id),
+            Recipe.uid == foreign(Photo.recipe_uid),
         ),
         backref='recipe',
         sync_backref=False,
     )
 
     @classmethod
-    def sync(cls, user: User) -> Tuple[set, set, set]:
-        added, updated, deleted = cls._sync(
-            user,
-            'recipes',
-            paprika.get_recipe_list_raw(user.paprika_token),
-            lambda data: paprika.get_recipe_raw(user.paprika_token, data['uid']),
-            lambda old, new: old.hash == new['hash'],
-        )
-        for recipe in added | updated:
-            recipe._download_photo(user.paprika_token)
+    def sync(cls, user: User, client: paprika.PaprikaClient) -> Tuple[set, set, set]:
+        # the details and main photos of all new and changed recipes are
+        # downloaded concurrently before any recipe rows are written, and
+        # each photo goes to the blob store right away instead of memory
+        logger = current_app.logger
+        store = get_blob_store()
+
+        def _get_data(data):
+            uid = data['uid']
+            with span(client.tracer, 'recipe fetch', uid=uid):
+                data = paprika.get_recipe_raw(client, uid)
+            with span(client.tracer, 'recipe photo download', uid=uid):
+                _store_recipe_photo(client, store, data, logger)
+            return data
+
+        with span(client.tracer, 'list recipes'):
+            new = paprika.get_recipe_list_raw(client)
+        with span(client.tracer, 'sync recipes'):
+            added, updated, deleted = cls._sync(
+                user,
+                'recipes',
+                new,
+                _get_data,
+                jobs=current_app.config['PAPRIKASYNC_SYNC_JOBS'],
+            )
         return added, updated, deleted
 
-    hash = data_property('hash')
+    @hybrid_property
+    def image_key(self) -> Optional[str]:
+        return self.data['photo_hash'] if self.data['photo'] else None
+
+    @image_key.expression
+    def image_key(cls):
+        return cls.data['photo_hash'].astext
 
-    def _download_photo(self, paprika_token: str) -> None:
-        current_app.logger.info('Recipe %r has no photo', self)
-        if not self.data['photo'] or not self.data['photo_url']:
-            self.image_data = None
-            return
-        current_app.logger.info('Downloading photo for recipe %r', self)
-        resp = requests.get(self.data['photo_url'])
-        resp.raise_for_status()
-        self.image_data = resp.content
+    @staticmethod
+    def _digest(data: dict) -> str:
+        # paprika already hashes the recipe contents, and unlike our own
+        # digest this also works for the items in the recipe list
+        return data['hash']
 
     def get_photo(self, id):
-        return next((p for p in self.photos if p.id == id), None)
+        return Photo.query.filter_by(
+            id=id, user_id=self.user_id, recipe_uid=self.uid
+        ).first()
+
+
+def _store_recipe_photo(
+    client: paprika.PaprikaClient, store: BlobStore, data: dict, logger: Logger
+) -> None:
+    if not data['photo'] or not data['photo_url']:
+        logger.info('Recipe %s has no photo', data['uid'])
+        return
+    if store.exists(data['photo_hash']):
+        logger.info('Photo for recipe %s is already stored', data['uid'])
+        return
+    logger.info('Downloading photo for recipe %s', data['uid'])
+    store.put(data['photo_hash'], paprika.download_photo(client, data['photo_url']))
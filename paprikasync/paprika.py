@@ -2,15 +2,32 @@ from __future__ import annotations
 
 import gzip
 import itertools
-from dataclasses import asdict, dataclass, field
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, field
+from email.utils import parsedate_to_datetime
 from operator import attrgetter
-from typing import List, Optional
+from typing import TYPE_CHECKING, ContextManager, Dict, List, Optional, Union
 from uuid import uuid4
 
 import requests
-from dataclasses_json import dataclass_json
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
 
-API_BASE = 'https://www.paprikaapp.com/api/v2'
+from .codec import json_dataclass
+from .constants import DEFAULT_POOL_SIZE, DEFAULT_RATE
+from .metrics import HttpMetrics, endpoint_name
+from .streaming import MultipartBody, Part, PhotoSource
+from .tracing import Tracer
+
+if TYPE_CHECKING:
+    from .cache import PhotoCache
+
+# can be overridden to run against a local stand-in server
+API_BASE = os.environ.get('PAPRIKA_API_BASE', 'https://www.paprikaapp.com/api/v2')
 LOGIN_URL = f'{API_BASE}/account/login/'
 SYNC_STATUS_URL = f'{API_BASE}/sync/status/'
 SYNC_CATEGORIES_URL = f'{API_BASE}/sync/categories/'
@@ -21,6 +38,18 @@ SYNC_PHOTO_URL = lambda uid: f'{API_BASE}/sync/photo/{uid}/'  # noqa:E731
 SYNC_NOTIFY_URL = f'{API_BASE}/sync/notify/'
 SYNC_STATUs_URL = f'{API_BASE}/sync/status/'
 
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# a response cut off while reading its body is just as transient as a
+# connection that could not be established
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, ChunkedEncodingError)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+# the longest a `Retry-After` from the server holds back requests, so a
+# bogus value cannot stall a sync run for hours
+RETRY_AFTER_MAX = 120
+
 
 class InvalidToken(Exception):
     pass
@@ -30,8 +59,238 @@ class RequestFailed(Exception):
     pass
 
 
-@dataclass_json()
-@dataclass
+class RateLimiter:
+    """Shared request limiter for one or more clients.
+
+    Requests are paced by a token bucket (`rate` requests per second with
+    bursts of up to `burst`), and the number of concurrent requests adapts
+    to the server: every throttled or failed request halves the limit
+    (at most once per `cooldown` seconds) and every successful one slowly
+    raises it again up to `max_concurrency`.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = DEFAULT_RATE,
+        *,
+        burst: Optional[int] = None,
+        max_concurrency: int = DEFAULT_POOL_SIZE,
+        min_concurrency: int = 1,
+        cooldown: float = 1,
+    ):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.cooldown = cooldown
+        self.limit = float(max_concurrency)
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return f'<RateLimiter({self.rate}/s, {int(self.limit)}/{self.max_concurrency})>'
+
+    def reserve(self) -> float:
+        """Take a token from the bucket and return how long to wait for it."""
+        with self._cond:
+            now = time.monotonic()
+            delay = max(0, self._paused_until - now)
+            if not self.rate:
+                return delay
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens < 0:
+                delay = max(delay, -self._tokens / self.rate)
+            return delay
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all requests for the given time (e.g. from `Retry-After`)."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def release(self, *, failed: bool = False) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self.feedback(failed=failed)
+            self._cond.notify_all()
+
+    def feedback(self, *, failed: bool) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if not failed:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._last_decrease = now
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0, seconds), RETRY_AFTER_MAX)
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    if retry_after is not None:
+        return retry_after
+    # "full jitter" keeps parallel workers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+class PaprikaClient:
+    """A pooled HTTP session for talking to the Paprika API.
+
+    The client keeps connections to paprikaapp.com (and the S3 bucket
+    serving photos) alive between requests, so a whole sync run can reuse
+    a handful of connections instead of opening a new one for each call.
+
+    Requests go through a :class:`RateLimiter`, which should be shared by
+    all clients used in the same run. Throttled (429), failed (5xx) and
+    broken requests are retried with a jittered exponential backoff.
+    This includes POSTs, which may have reached the server before the
+    connection broke; the sync endpoints store objects by uid, so sending
+    an upload again just saves the same object again.
+
+    If `metrics` is set, every request attempt is recorded there, and if
+    `tracer` is set, each attempt also shows up as a span in the trace.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        *,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        limiter: Optional[RateLimiter] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        metrics: Optional[HttpMetrics] = None,
+        tracer: Optional[Tracer] = None,
+    ):
+        self.token = token
+        self.timeout = timeout
+        self.limiter = limiter or RateLimiter(max_concurrency=pool_size)
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.tracer = tracer
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __repr__(self):
+        return f'<PaprikaClient({_mask_token(self.token)})>'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def request(
+        self, method: str, url: str, *, auth: bool = True, **kwargs
+    ) -> requests.Response:
+        headers = kwargs.pop('headers', None) or {}
+        if auth and self.token:
+            headers.update(_auth(self.token))
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            if attempt and hasattr(kwargs.get('data'), 'seek'):
+                # streamed request bodies need to be rewound before retrying
+                kwargs['data'].seek(0)
+            self.limiter.acquire()
+            start = time.perf_counter()
+            resp = None
+            failed = False
+            try:
+                with self._span(method, url, attempt):
+                    resp = self.session.request(method, url, headers=headers, **kwargs)
+            except RETRY_ERRORS:
+                failed = True
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+            else:
+                failed = resp.status_code in RETRY_STATUSES
+                if not failed or attempt >= self.max_retries:
+                    return resp
+                retry_after = _retry_after(resp.headers)
+                if retry_after is not None:
+                    self.limiter.pause(retry_after)
+                resp.close()
+            finally:
+                # whatever happened, the request is no longer in flight
+                self.limiter.release(failed=failed)
+                if self.metrics is not None:
+                    self._record(
+                        method, url, start, attempt, resp, kwargs.get('stream')
+                    )
+            time.sleep(_backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def _span(self, method: str, url: str, attempt: int) -> ContextManager:
+        if self.tracer is None:
+            return nullcontext()
+        name = endpoint_name(API_BASE, method, url)
+        return self.tracer.span(name, cat='http', attempt=attempt)
+
+    def _record(self, method, url, start, attempt, resp, stream=False) -> None:
+        elapsed = time.perf_counter() - start
+        bytes_in = bytes_out = 0
+        if resp is not None:
+            bytes_out = int(resp.request.headers.get('Content-Length', 0))
+            if stream:
+                # the body has not been read yet
+                bytes_in = int(resp.headers.get('Content-Length', 0))
+            else:
+                bytes_in = len(resp.content)
+        self.metrics.record(
+            method,
+            url,
+            elapsed=elapsed,
+            status=(resp.status_code if resp is not None else None),
+            retry=(attempt > 0),
+            bytes_in=bytes_in,
+            bytes_out=bytes_out,
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+ClientOrToken = Union[PaprikaClient, str]
+
+
+@json_dataclass
 class SyncStatus:
     menus: int = 0
     photos: int = 0
@@ -54,8 +313,7 @@ class SyncStatus:
         }
 
 
-@dataclass_json()
-@dataclass
+@json_dataclass
 class Category:
     name: str
     order_flag: int
@@ -63,27 +321,17 @@ class Category:
     parent_uid: Optional[str] = None
     deleted: bool = False
 
-    def save(self, token: str):
-        resp = requests.post(
-            SYNC_CATEGORIES_URL,
-            files={'data': _gzip(self, wrap_list=True)},
-            headers=_auth(token),
-        )
-        resp.raise_for_status()
-        error = resp.json().get('error')
-        if error:
-            raise RequestFailed(error)
+    def save(self, client: ClientOrToken):
+        save_categories(client, [self])
 
 
-@dataclass_json()
-@dataclass
+@json_dataclass
 class RecipeListItem:
     hash: str
     uid: str
 
 
-@dataclass_json()
-@dataclass
+@json_dataclass
 class Photo:
     uid: str
     filename: str
@@ -94,32 +342,27 @@ class Photo:
     photo_url: Optional[str] = None
     deleted: bool = False
 
-    def get_photo_data(self):
+    def get_photo_data(self, client: ClientOrToken = None):
         if not self.photo_url:
             # we only have a url if we loaded this photo specifically using
             # its own dedicated url, not when we got just the whole list
             return None
-        resp = requests.get(self.photo_url)
-        resp.raise_for_status()
-        return resp.content
-
-    def save(self, token: str):
-        files = {'data': _gzip(self)}
-        photo_data = self.get_photo_data()
-        if photo_data:
-            # self.photo is the filename
-            files['photo_upload'] = (self.filename, photo_data)
-        resp = requests.post(
-            SYNC_PHOTO_URL(self.uid), files=files, headers=_auth(token)
-        )
-        resp.raise_for_status()
-        error = resp.json().get('error')
-        if error:
-            raise RequestFailed(error)
-
-
-@dataclass_json()
-@dataclass
+        with _client(client) as client:
+            return _download(client, self.photo_url)
+
+    def save(self, client: ClientOrToken, *, photo_cache: PhotoCache = None):
+        with _client(client) as client:
+            parts = [_data_part(self)]
+            if self.photo_url:
+                # the photo is streamed from the partner's photo url into the upload
+                source = PhotoSource(
+                    client, self.photo_url, cache=photo_cache, hash=self.hash
+                )
+                parts.append(('photo_upload', self.filename, source))
+            _upload(client, SYNC_PHOTO_URL(self.uid), parts)
+
+
+@json_dataclass
 class Recipe:
     categories: List[str]
     cook_time: str
@@ -154,39 +397,89 @@ class Recipe:
         self.categories = []
         self.on_grocery_list = False
 
-    def get_photo_data(self):
+    def get_photo_data(self, client: ClientOrToken = None):
         if not self.photo or not self.photo_url:
             return None
-        resp = requests.get(self.photo_url)
-        resp.raise_for_status()
-        return resp.content
-
-    def save(self, token: str):
-        files = {'data': _gzip(self)}
-        photo_data = self.get_photo_data()
-        if photo_data:
-            # self.photo is the filename
-            files['photo_upload'] = (self.photo, photo_data)
-        resp = requests.post(
-            SYNC_RECIPE_URL(self.uid), files=files, headers=_auth(token)
-        )
-        resp.raise_for_status()
-        error = resp.json().get('error')
-        if error:
-            raise RequestFailed(error)
+        with _client(client) as client:
+            return _download(client, self.photo_url)
+
+    def save(
+        self,
+        client: ClientOrToken,
+        *,
+        photo_cache: PhotoCache = None,
+        include_photo: bool = True,
+    ):
+        with _client(client) as client:
+            parts = [_data_part(self)]
+            if include_photo and self.photo and self.photo_url:
+                # self.photo is the filename
+                source = PhotoSource(
+                    client, self.photo_url, cache=photo_cache, hash=self.photo_hash
+                )
+                parts.append(('photo_upload', self.photo, source))
+            _upload(client, SYNC_RECIPE_URL(self.uid), parts)
 
 
 def _auth(token: str) -> dict:
     return {'Authorization': f'Bearer {token}'}
 
 
+def _client(client: Optional[ClientOrToken]) -> ContextManager[PaprikaClient]:
+    """Use a client, or a temporary one that is closed afterwards for a token."""
+    if isinstance(client, PaprikaClient):
+        return nullcontext(client)
+    return PaprikaClient(client)
+
+
+def _mask_token(token: Optional[str]) -> Optional[str]:
+    # enough to tell tokens apart without leaking them into logs
+    return f'{token[:4]}...' if token else token
+
+
+def _get_result(client: ClientOrToken, url: str):
+    with _client(client) as client:
+        resp = client.get(url)
+    resp.raise_for_status()
+    data = resp.json()
+    return data['result']
+
+
+def _download(client: PaprikaClient, url: str) -> bytes:
+    # photo urls point to S3 which must not receive our paprika token
+    resp = client.get(url, auth=False)
+    resp.raise_for_status()
+    return resp.content
+
+
+def _data_part(obj, *, wrap_list=False) -> Part:
+    return ('data', 'data', _gzip(obj, wrap_list=wrap_list))
+
+
+def _upload(client: PaprikaClient, url: str, parts: List[Part]) -> None:
+    with MultipartBody(parts) as body:
+        resp = client.post(url, data=body, headers={'Content-Type': body.content_type})
+    resp.raise_for_status()
+    error = resp.json().get('error')
+    if error:
+        raise RequestFailed(error)
+
+
 def _gzip(obj, *, wrap_list=False) -> bytes:
-    body = f'[{obj.to_json()}]' if wrap_list else obj.to_json()
+    if wrap_list:
+        obj = [obj]
+    if isinstance(obj, list):
+        body = '[{}]'.format(', '.join(x.to_json() for x in obj))
+    else:
+        body = obj.to_json()
     return gzip.compress(body.encode())
 
 
-def login(email: str, password: str) -> str:
-    resp = requests.post(LOGIN_URL, data={'email': email, 'password': password})
+def login(email: str, password: str, client: PaprikaClient = None) -> str:
+    with _client(client) as client:
+        resp = client.post(
+            LOGIN_URL, data={'email': email, 'password': password}, auth=False
+        )
     resp.raise_for_status()
     data = resp.json()
     try:
@@ -195,69 +488,68 @@ def login(email: str, password: str) -> str:
         return None, data['error']['message']
 
 
-def check_token(token: str) -> None:
-    resp = requests.get(SYNC_STATUS_URL, headers=_auth(token))
+def check_token(client: ClientOrToken) -> None:
+    with _client(client) as client:
+        resp = client.get(SYNC_STATUS_URL)
     if resp.status_code == 401:
         data = resp.json()
         raise InvalidToken(data['error']['message'])
     resp.raise_for_status()
 
 
-def get_categories_raw(token: str) -> list:
-    resp = requests.get(SYNC_CATEGORIES_URL, headers=_auth(token))
-    resp.raise_for_status()
-    data = resp.json()
-    return data['result']
+def get_categories_raw(client: ClientOrToken) -> list:
+    return _get_result(client, SYNC_CATEGORIES_URL)
 
 
-def get_categories(token: str) -> List[Category]:
-    result = get_categories_raw(token)
+def get_categories(client: ClientOrToken) -> List[Category]:
+    return _parse_categories(get_categories_raw(client))
+
+
+def save_categories(client: ClientOrToken, categories: List[Category]) -> None:
+    """Save any number of categories using a single request."""
+    with _client(client) as client:
+        _upload(client, SYNC_CATEGORIES_URL, [_data_part(categories)])
+
+
+def _parse_categories(result: list) -> List[Category]:
     return sorted((Category.from_dict(c) for c in result), key=lambda c: c.order_flag)
 
 
-def get_recipe_list_raw(token: str) -> List[RecipeListItem]:
-    resp = requests.get(SYNC_RECIPES_URL, headers=_auth(token))
-    resp.raise_for_status()
-    data = resp.json()
-    return data['result']
+def get_recipe_list_raw(client: ClientOrToken) -> List[RecipeListItem]:
+    return _get_result(client, SYNC_RECIPES_URL)
 
 
-def get_recipe_list(token: str) -> List[RecipeListItem]:
-    return [RecipeListItem.from_dict(x) for x in get_recipe_list_raw(token)]
+def get_recipe_list(client: ClientOrToken) -> List[RecipeListItem]:
+    return [RecipeListItem.from_dict(x) for x in get_recipe_list_raw(client)]
 
 
-def get_recipe_raw(token: str, uid: str) -> dict:
-    resp = requests.get(SYNC_RECIPE_URL(uid), headers=_auth(token))
-    resp.raise_for_status()
-    data = resp.json()
-    return data['result']
+def get_recipe_raw(client: ClientOrToken, uid: str) -> dict:
+    return _get_result(client, SYNC_RECIPE_URL(uid))
 
 
-def get_recipe(token: str, uid: str) -> Recipe:
-    return Recipe.from_dict(get_recipe_raw(token, uid))
+def get_recipe(client: ClientOrToken, uid: str) -> Recipe:
+    return Recipe.from_dict(get_recipe_raw(client, uid))
 
 
-def get_sync_status(token: str) -> dict:
-    resp = requests.get(SYNC_STATUS_URL, headers=_auth(token))
-    resp.raise_for_status()
-    data = resp.json()
-    return SyncStatus.from_dict(data['result'])
+def get_sync_status(client: ClientOrToken) -> dict:
+    return SyncStatus.from_dict(_get_result(client, SYNC_STATUS_URL))
 
 
-def notify_sync(token: str) -> None:
-    resp = requests.post(SYNC_NOTIFY_URL, headers=_auth(token))
+def notify_sync(client: ClientOrToken) -> None:
+    with _client(client) as client:
+        resp = client.post(SYNC_NOTIFY_URL)
     resp.raise_for_status()
 
 
-def get_photos_raw(token: str) -> list:
-    resp = requests.get(SYNC_PHOTOS_URL, headers=_auth(token))
-    resp.raise_for_status()
-    data = resp.json()
-    return data['result']
+def get_photos_raw(client: ClientOrToken) -> list:
+    return _get_result(client, SYNC_PHOTOS_URL)
 
 
-def get_photos(token: str) -> List[Photo]:
-    result = get_photos_raw(token)
+def get_photos(client: ClientOrToken) -> List[Photo]:
+    return _group_photos(get_photos_raw(client))
+
+
+def _group_photos(result: list) -> Dict[str, List[Photo]]:
     photos = sorted((Photo.from_dict(x) for x in result), key=attrgetter('recipe_uid'))
     photos_by_recipe = {
         recipe_uid: list(recipe_photos)
@@ -268,12 +560,14 @@ def get_photos(token: str) -> List[Photo]:
     return photos_by_recipe
 
 
-def get_photo_raw(token: str, uid: str) -> dict:
-    resp = requests.get(SYNC_PHOTO_URL(uid), headers=_auth(token))
-    resp.raise_for_status()
-    data = resp.json()
-    return data['result']
+def get_photo_raw(client: ClientOrToken, uid: str) -> dict:
+    return _get_result(client, SYNC_PHOTO_URL(uid))
+
+
+def get_photo(client: ClientOrToken, uid: str) -> Photo:
+    return Photo.from_dict(get_photo_raw(client, uid))
 
 
-def get_photo(token: str, uid: str) -> Photo:
-    return Photo.from_dict(get_photo_raw(token, uid))
+def download_photo(client: ClientOrToken, url: str) -> bytes:
+    with _client(client) as client:
+        return _download(client, url)
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .metrics import HttpMetrics
+from .paprika import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_TIMEOUT,
+    LOGIN_URL,
+    RETRY_STATUSES,
+    SYNC_CATEGORIES_URL,
+    SYNC_NOTIFY_URL,
+    SYNC_PHOTO_URL,
+    SYNC_PHOTOS_URL,
+    SYNC_RECIPE_URL,
+    SYNC_RECIPES_URL,
+    SYNC_STATUS_URL,
+    Category,
+    InvalidToken,
+    Photo,
+    RateLimiter,
+    Recipe,
+    RecipeListItem,
+    RequestFailed,
+    SyncStatus,
+    _auth,
+    _backoff_delay,
+    _group_photos,
+    _gzip,
+    _mask_token,
+    _parse_categories,
+    _retry_after,
+)
+
+DEFAULT_CONCURRENCY = 20
+RETRY_ERRORS = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+)
+
+
+class AsyncPaprikaClient:
+    """An asyncio counterpart to :class:`~paprikasync.paprika.PaprikaClient`.
+
+    All requests go through a semaphore, so any number of coroutines may
+    use the client at once while only `concurrency` requests are actually
+    in flight. Pass the same `semaphore` to several clients to share one
+    limit between them.
+
+    Requests are paced by the token bucket of a
+    :class:`~paprikasync.paprika.RateLimiter` (which may be shared with
+    blocking clients) and retried with backoff just like in the blocking
+    client. The concurrency limit itself is fixed by the semaphore.
+
+    If `metrics` is set, every request attempt is recorded there.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        *,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout=DEFAULT_TIMEOUT,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        limiter: Optional[RateLimiter] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        metrics: Optional[HttpMetrics] = None,
+    ):
+        self.token = token
+        self.concurrency = concurrency
+        self.limiter = limiter or RateLimiter(max_concurrency=concurrency)
+        self.max_retries = max_retries
+        self.metrics = metrics
+        connect_timeout, read_timeout = timeout
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self._semaphore = semaphore
+        self._session = None
+
+    def __repr__(self):
+        return f'<AsyncPaprikaClient({_mask_token(self.token)})>'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created on first use since before Python 3.10 it is bound to the
+        # event loop that is current when it is created
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        *,
+        auth: bool = True,
+        raw: bool = False,
+        detect_invalid_token: bool = False,
+        form: Optional[List[Tuple[str, bytes, str]]] = None,
+        **kwargs,
+    ):
+        headers = kwargs.pop('headers', None) or {}
+        if auth and self.token:
+            headers.update(_auth(self.token))
+        attempt = 0
+        while True:
+            delay = self.limiter.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            retry_after = None
+            if form is not None:
+                # a FormData object can only be sent once
+                kwargs['data'] = _make_form(form)
+            resp = None
+            start = time.perf_counter()
+            try:
+                async with self.semaphore:
+                    async with self.session.request(
+                        method, url, headers=headers, **kwargs
+                    ) as resp:
+                        failed = resp.status in RETRY_STATUSES
+                        self.limiter.feedback(failed=failed)
+                        if not failed or attempt >= self.max_retries:
+                            return await self._read_response(
+                                resp, raw, detect_invalid_token
+                            )
+                        retry_after = _retry_after(resp.headers)
+                        if retry_after is not None:
+                            self.limiter.pause(retry_after)
+            except RETRY_ERRORS:
+                resp = None
+                self.limiter.feedback(failed=True)
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                if self.metrics is not None:
+                    self._record(method, url, start, attempt, resp)
+            await asyncio.sleep(_backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def _record(self, method, url, start, attempt, resp) -> None:
+        bytes_in = bytes_out = 0
+        if resp is not None:
+            bytes_in = resp.content_length or 0
+            bytes_out = int(resp.request_info.headers.get('Content-Length', 0))
+        self.metrics.record(
+            method,
+            url,
+            elapsed=(time.perf_counter() - start),
+            status=(resp.status if resp is not None else None),
+            retry=(attempt > 0),
+            bytes_in=bytes_in,
+            bytes_out=bytes_out,
+        )
+
+    async def _read_response(
+        self, resp: aiohttp.ClientResponse, raw: bool, detect_invalid_token: bool
+    ):
+        if resp.status == 401 and detect_invalid_token:
+            data = await resp.json(content_type=None)
+            raise InvalidToken(data['error']['message'])
+        resp.raise_for_status()
+        if raw:
+            return await resp.read()
+        return await resp.json(content_type=None)
+
+    async def _get_result(self, url: str):
+        data = await self._request('GET', url)
+        return data['result']
+
+    async def _upload(self, url: str, form: List[Tuple[str, bytes, str]]) -> None:
+        data = await self._request('POST', url, form=form)
+        error = data.get('error')
+        if error:
+            raise RequestFailed(error)
+
+    async def login(self, email: str, password: str):
+        data = await self._request(
+            'POST', LOGIN_URL, data={'email': email, 'password': password}, auth=False
+        )
+        try:
+            return data['result']['token'], None
+        except KeyError:
+            return None, data['error']['message']
+
+    async def check_token(self) -> None:
+        await self._request('GET', SYNC_STATUS_URL, detect_invalid_token=True)
+
+    async def get_sync_status(self) -> SyncStatus:
+        return SyncStatus.from_dict(await self._get_result(SYNC_STATUS_URL))
+
+    async def notify_sync(self) -> None:
+        await self._request('POST', SYNC_NOTIFY_URL)
+
+    async def get_categories_raw(self) -> list:
+        return await self._get_result(SYNC_CATEGORIES_URL)
+
+    async def get_categories(self) -> List[Category]:
+        return _parse_categories(await self.get_categories_raw())
+
+    async def get_recipe_list_raw(self) -> list:
+        return await self._get_result(SYNC_RECIPES_URL)
+
+    async def get_recipe_list(self) -> List[RecipeListItem]:
+        return [RecipeListItem.from_dict(x) for x in await self.get_recipe_list_raw()]
+
+    async def get_recipe_raw(self, uid: str) -> dict:
+        return await self._get_result(SYNC_RECIPE_URL(uid))
+
+    async def get_recipe(self, uid: str) -> Recipe:
+        return Recipe.from_dict(await self.get_recipe_raw(uid))
+
+    async def get_photos_raw(self) -> list:
+        return await self._get_result(SYNC_PHOTOS_URL)
+
+    async def get_photos(self) -> Dict[str, List[Photo]]:
+        return _group_photos(await self.get_photos_raw())
+
+    async def get_photo_raw(self, uid: str) -> dict:
+        return await self._get_result(SYNC_PHOTO_URL(uid))
+
+    async def get_photo(self, uid: str) -> Photo:
+        return Photo.from_dict(await self.get_photo_raw(uid))
+
+    async def download_photo(self, url: str) -> bytes:
+        # photo urls point to S3 which must not receive our paprika token
+        return await self._request('GET', url, auth=False, raw=True)
+
+    async def save_category(self, category: Category) -> None:
+        await self.save_categories([category])
+
+    async def save_categories(self, categories: List[Category]) -> None:
+        form = [('data', _gzip(categories), 'data')]
+        await self._upload(SYNC_CATEGORIES_URL, form)
+
+    async def save_recipe(self, recipe: Recipe) -> None:
+        form = [('data', _gzip(recipe), 'data')]
+        if recipe.photo and recipe.photo_url:
+            photo_data = await self.download_photo(recipe.photo_url)
+            form.append(('photo_upload', photo_data, recipe.photo))
+        await self._upload(SYNC_RECIPE_URL(recipe.uid), form)
+
+    async def save_photo(self, photo: Photo) -> None:
+        form = [('data', _gzip(photo), 'data')]
+        if photo.photo_url:
+            photo_data = await self.download_photo(photo.photo_url)
+            form.append(('photo_upload', photo_data, photo.filename))
+        await self._upload(SYNC_PHOTO_URL(photo.uid), form)
+
+
+def _make_form(fields: List[Tuple[str, bytes, str]]) -> aiohttp.FormData:
+    form = aiohttp.FormData()
+    for name, value, filename in fields:
+        form.add_field(name, value, filename=filename)
+    return form
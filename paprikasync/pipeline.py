@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+from queue import Full, Queue, SimpleQueue
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Iterable, Iterator, List
+
+DEFAULT_QUEUE_SIZE = 16
+# how often a worker waiting for queue space checks whether we aborted
+_POLL_INTERVAL = 0.1
+_STOP = object()
+
+
+@dataclass
+class Done:
+    """Returned by a stage to skip the remaining stages for an item."""
+
+    result: Any
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items: int = 0
+    # time spent in the stage function, waiting for input and waiting for
+    # space in the next queue (each summed over all workers)
+    busy: float = 0
+    idle: float = 0
+    blocked: float = 0
+    # depth of the stage's input queue whenever an item is added to it
+    max_depth: int = 0
+    depth_total: int = 0
+    depth_samples: int = 0
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    @property
+    def mean_depth(self) -> float:
+        return self.depth_total / self.depth_samples if self.depth_samples else 0
+
+    def add_depth(self, depth: int) -> None:
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_total += depth
+            self.depth_samples += 1
+
+    def add_item(self, idle: float, busy: float, blocked: float) -> None:
+        with self._lock:
+            self.items += 1
+            self.idle += idle
+            self.busy += busy
+            self.blocked += blocked
+
+
+class Pipeline:
+    """A chain of stages connected by bounded queues.
+
+    Each stage has its own worker threads. The return value of a stage's
+    function is passed to the next stage, and whatever the last stage
+    returns becomes the result of the item's future. A stage may return
+    :class:`Done` to finish an item early; an exception finishes the item
+    with that exception.
+
+    Since all queues are bounded, a slow stage eventually blocks the ones
+    before it, so the number of items in flight is limited by the queue
+    sizes and worker counts no matter how many items are fed in.
+    """
+
+    def __init__(self, stages: List[Stage], *, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.stages = stages
+        self.stats = [StageStats(stage.name, stage.workers) for stage in stages]
+        self.elapsed = None
+        self._queues = [Queue(queue_size) for __ in stages]
+        self._running = [stage.workers for stage in stages]
+        self._lock = Lock()
+        self._aborted = Event()
+        self._threads = []
+        self._start_time = None
+
+    def __repr__(self):
+        return f'<Pipeline({", ".join(stage.name for stage in self.stages)})>'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        self.join()
+
+    def start(self) -> None:
+        self._start_time = time.perf_counter()
+        for i, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = Thread(
+                    target=self._worker,
+                    args=(i,),
+                    name=f'{stage.name}-{n}',
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def abort(self) -> None:
+        """Stop processing and cancel all pending items."""
+        self._aborted.set()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+        if self.elapsed is None and self._start_time is not None:
+            self.elapsed = time.perf_counter() - self._start_time
+
+    def map(self, items: Iterable) -> Iterator[Future]:
+        """Feed items into the pipeline and yield their futures in order.
+
+        The items are fed from a separate thread, so the caller can handle
+        results while the pipeline is still being filled.
+        """
+        futures = SimpleQueue()
+
+        def _feed():
+            try:
+                for item in items:
+                    future = Future()
+                    if not self._put(0, item, future):
+                        break
+                    futures.put(future)
+            finally:
+                futures.put(None)
+                self._stop(0)
+
+        Thread(target=_feed, name='feed', daemon=True).start()
+        while (future := futures.get()) is not None:
+            yield future
+
+    def _put(self, index: int, value, future: Future) -> bool:
+        queue = self._queues[index]
+        self.stats[index].add_depth(queue.qsize())
+        while not self._aborted.is_set():
+            try:
+                queue.put((value, future), timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        future.cancel()
+        return False
+
+    def _stop(self, index: int) -> None:
+        # the next stage keeps consuming until it gets these, so this
+        # cannot block forever even when we aborted
+        for __ in range(self.stages[index].workers):
+            self._queues[index].put(_STOP)
+
+    def _worker(self, index: int) -> None:
+        stage = self.stages[index]
+        last = index == len(self.stages) - 1
+        while True:
+            start = time.perf_counter()
+            entry = self._queues[index].get()
+            if entry is _STOP:
+                break
+            value, future = entry
+            if self._aborted.is_set() or future.cancelled():
+                future.cancel()
+                continue
+            got = time.perf_counter()
+            try:
+                result = stage.func(value)
+            except BaseException as exc:
+                _finish(future, exc=exc)
+                result = Done(None)
+            else:
+                if isinstance(result, Done):
+                    _finish(future, result.result)
+                elif last:
+                    _finish(future, result)
+            done = time.perf_counter()
+            if not last and not isinstance(result, Done):
+                self._put(index + 1, result, future)
+            self.stats[index].add_item(
+                idle=(got - start),
+                busy=(done - got),
+                blocked=(time.perf_counter() - done),
+            )
+        with self._lock:
+            self._running[index] -= 1
+            finished = self._running[index] == 0
+        if finished and not last:
+            self._stop(index + 1)
+
+    def report(self) -> List[str]:
+        """Get a summary of the stage statistics for humans."""
+        lines = [
+            f'{"stage":<10} {"workers":>7} {"items":>6} {"busy":>8} {"idle":>8} '
+            f'{"blocked":>8}  queue max/avg'
+        ]
+        for s in self.stats:
+            lines.append(
+                f'{s.name:<10} {s.workers:>7} {s.items:>6} {s.busy:>7.1f}s '
+                f'{s.idle:>7.1f}s {s.blocked:>7.1f}s  {s.max_depth}/{s.mean_depth:.1f}'
+            )
+        if self.elapsed is not None:
+            lines.append(f'total: {self.elapsed:.1f}s')
+        return lines
+
+
+def _finish(future: Future, result=None, *, exc=None) -> None:
+    try:
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        # cancelled in the meantime
+        pass
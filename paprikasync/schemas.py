@@ -4,6 +4,7 @@ from marshmallow import post_dump
 from webargs.fields import Function, Integer, List, Nested, Pluck
 
 from .models import Category, Photo, Recipe, User
+from .thumbnails import THUMBNAIL_SIZE
 
 mm = Marshmallow()
 
@@ -47,7 +48,7 @@ class CategorySchema(mm.SQLAlchemyAutoSchema):
 class BasicRecipeSchema(mm.SQLAlchemyAutoSchema):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'in_trash', 'photo_url', 'categories')
+        fields = ('id', 'name', 'in_trash', 'photo_url', 'thumbnail_url', 'categories')
 
     photo_url = Function(
         lambda r: url_for(
@@ -60,6 +61,18 @@ class BasicRecipeSchema(mm.SQLAlchemyAutoSchema):
         else None
     )
 
+    thumbnail_url = Function(
+        lambda r: url_for(
+            'img.paprika_recipe_main_photo',
+            id=r.id,
+            hash=r.data['photo_hash'],
+            name=r.data['photo'],
+            size=THUMBNAIL_SIZE,
+        )
+        if r.data['photo']
+        else None
+    )
+
     categories = Function(lambda r: r.data['categories'])
 
     @post_dump(pass_many=True)
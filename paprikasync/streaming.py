@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import os
+from io import SEEK_SET
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional, Tuple, Union
+from uuid import uuid4
+
+if TYPE_CHECKING:
+    from .cache import PhotoCache
+    from .paprika import PaprikaClient
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class PhotoSource:
+    """A photo download that can be streamed into an upload.
+
+    If the server tells us the size of the photo, the response body is
+    passed through as-is. Otherwise it is written to a temporary file which
+    only spills to disk once it exceeds :data:`SPOOL_MAX_SIZE`, since we
+    need to know the size before we can start the upload.
+
+    When a :class:`~paprikasync.cache.PhotoCache` and the photo hash are
+    given, a cached copy of the photo is used instead of downloading it,
+    and downloaded photos are added to the cache.
+    """
+
+    def __init__(
+        self,
+        client: PaprikaClient,
+        url: str,
+        *,
+        cache: Optional[PhotoCache] = None,
+        hash: Optional[str] = None,
+    ):
+        self.client = client
+        self.url = url
+        self.cache = cache if hash else None
+        self.hash = hash
+        self._resp = None
+        self._file = None
+
+    def __repr__(self):
+        return f'<PhotoSource({self.url})>'
+
+    def open(self) -> Tuple[int, BinaryIO]:
+        self.close()
+        if self.cache is not None and (rv := self._open_cached()):
+            return rv
+        # photo urls point to S3 which must not receive our paprika token
+        self._resp = resp = self.client.get(self.url, auth=False, stream=True)
+        resp.raise_for_status()
+        length = resp.headers.get('Content-Length')
+        if length is not None and not resp.headers.get('Content-Encoding'):
+            if self.cache is None:
+                return int(length), resp.raw
+            self._file = _CachingReader(resp.raw, self.cache, self.hash, int(length))
+            return int(length), self._file
+        if self.cache is None:
+            self._file = SpooledTemporaryFile(SPOOL_MAX_SIZE)
+        else:
+            tmp_path = self.cache.temp_path()
+            self._file = tmp_path.open('w+b')
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            self._file.write(chunk)
+        size = self._file.tell()
+        self._file.seek(0)
+        self._close_response()
+        if self.cache is not None:
+            # the open file stays readable even once it's been moved or evicted
+            self.cache.commit(self.hash, tmp_path)
+        return size, self._file
+
+    def _open_cached(self) -> Optional[Tuple[int, BinaryIO]]:
+        path = self.cache.get_path(self.hash)
+        if path is None:
+            return None
+        try:
+            self._file = path.open('rb')
+        except FileNotFoundError:
+            # evicted in the meantime
+            return None
+        return os.fstat(self._file.fileno()).st_size, self._file
+
+    def close(self) -> None:
+        self._close_response()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _close_response(self) -> None:
+        if self._resp is not None:
+            self._resp.close()
+            self._resp = None
+
+
+class _CachingReader:
+    """Pass through a file-like object while copying it into the cache."""
+
+    def __init__(self, fileobj: BinaryIO, cache: PhotoCache, hash: str, size: int):
+        self.fileobj = fileobj
+        self.cache = cache
+        self.hash = hash
+        self._remaining = size
+        self._tmp_path: Optional[Path] = cache.temp_path()
+        self._tmp = self._tmp_path.open('wb')
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        if self._tmp is not None:
+            self._tmp.write(data)
+            self._remaining -= len(data)
+            if self._remaining <= 0:
+                self._tmp.close()
+                self._tmp = None
+                if self._remaining == 0:
+                    self.cache.commit(self.hash, self._tmp_path)
+                else:
+                    self._tmp_path.unlink()
+        return data
+
+    def close(self) -> None:
+        self.fileobj.close()
+        if self._tmp is not None:
+            # incomplete download, e.g. because the upload failed
+            self._tmp.close()
+            self._tmp = None
+            self._tmp_path.unlink(missing_ok=True)
+
+
+Part = Tuple[str, str, Union[bytes, PhotoSource]]
+
+
+class MultipartBody:
+    """A ``multipart/form-data`` request body that is generated on the fly.
+
+    This mirrors what requests sends for ``files={name: (filename, data)}``,
+    but photo parts are read from their :class:`PhotoSource` while the body
+    is being sent instead of being loaded into memory first.  Seeking back
+    to the start reopens all sources, so the body can be sent again when a
+    request needs to be retried.
+    """
+
+    def __init__(self, parts: List[Part]):
+        self.parts = parts
+        self.boundary = uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self._chunks: List[Union[bytes, BinaryIO]] = []
+        self._length = 0
+        self._pos = 0
+        self._open()
+
+    def __repr__(self):
+        return f'<MultipartBody({self._length} bytes)>'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        while chunk := self.read(CHUNK_SIZE):
+            yield chunk
+
+    def _open(self) -> None:
+        self.close()
+        chunks = []
+        for name, filename, value in self.parts:
+            filename = filename.replace('"', '%22')
+            chunks.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"; '
+                f'filename="{filename}"\r\n\r\n'.encode()
+            )
+            if isinstance(value, PhotoSource):
+                size, fileobj = value.open()
+                chunks.append(fileobj)
+                self._length += size
+            else:
+                chunks.append(value)
+            chunks.append(b'\r\n')
+        chunks.append(f'--{self.boundary}--\r\n'.encode())
+        self._length += sum(len(c) for c in chunks if isinstance(c, bytes))
+        self._chunks = chunks
+        self._pos = 0
+
+    def close(self) -> None:
+        for _name, _filename, value in self.parts:
+            if isinstance(value, PhotoSource):
+                value.close()
+        self._chunks = []
+        self._length = 0
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        if offset != 0 or whence != SEEK_SET:
+            raise OSError('MultipartBody can only be rewound to the start')
+        if self._pos:
+            self._open()
+        return 0
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        while self._chunks:
+            chunk = self._chunks[0]
+            if isinstance(chunk, bytes) and not chunk:
+                self._chunks.pop(0)
+                continue
+            if isinstance(chunk, bytes):
+                data = chunk[:size]
+                if len(data) == len(chunk):
+                    self._chunks.pop(0)
+                else:
+                    self._chunks[0] = chunk[size:]
+            else:
+                data = chunk.read(size)
+                if not data:
+                    self._chunks.pop(0)
+                    continue
+            self._pos += len(data)
+            return data
+        return b''
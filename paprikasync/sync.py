@@ -1,18 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
 from operator import attrgetter
+from threading import Event, Lock
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import click
 
 from . import paprika
+from .cache import PhotoCache, RecipeCache
 from .config import Partner
+from .constants import DEFAULT_JOBS
+from .journal import SyncJournal
+from .pipeline import DEFAULT_QUEUE_SIZE, Done, Pipeline, Stage
+from .tracing import Tracer, span
+
+if TYPE_CHECKING:
+    from .paprika_async import AsyncPaprikaClient
 
 SYNC_ROOT_NAME = 'Sync'
+# changes in these parts of an account affect what needs to be synced
+PARTNER_STATUS_KEYS = {'recipes', 'photos'}
+OWN_STATUS_KEYS = {'recipes', 'photos', 'categories'}
 
 
-def get_sync_category(token, partner, *, dry_run=False) -> paprika.Category:
-    categories = paprika.get_categories(token)
+def plan_sync_category(
+    categories: List[paprika.Category], partner: Partner
+) -> Tuple[paprika.Category, List[paprika.Category]]:
+    """Find the sync category for a partner.
+
+    Returns the category and a list of categories that need to be created
+    first (the top-level sync category and/or the partner's category).
+    """
     max_order_flag = (
         max(categories, key=attrgetter('order_flag')).order_flag if categories else -1
     )
+    missing = []
 
     sync_root = next(
         (c for c in categories if c.name.lower() == SYNC_ROOT_NAME.lower()), None
@@ -20,9 +56,7 @@ def get_sync_category(token, partner, *, dry_run=False) -> paprika.Category:
     if not sync_root:
         sync_root = paprika.Category(SYNC_ROOT_NAME, order_flag=(max_order_flag + 1))
         max_order_flag += 1
-        click.echo(f'Creating top-level sync category "{sync_root.name}"')
-        if not dry_run:
-            sync_root.save(token)
+        missing.append(sync_root)
 
     sync_cat = next(
         (
@@ -37,40 +71,730 @@ def get_sync_category(token, partner, *, dry_run=False) -> paprika.Category:
             partner.name, order_flag=(max_order_flag + 1), parent_uid=sync_root.uid
         )
         max_order_flag += 1
-        click.echo(f'Creating sync category "{sync_cat.name}"')
-        if not dry_run:
-            sync_cat.save(token)
+        missing.append(sync_cat)
+
+    return sync_cat, missing
+
 
+def plan_sync_categories(
+    categories: List[paprika.Category], partners: List[Partner]
+) -> Tuple[Dict[str, paprika.Category], List[paprika.Category]]:
+    """Find the sync categories for several partners.
+
+    Like :func:`plan_sync_category`, but the missing categories of all
+    partners are returned together so they can be created at once.
+    """
+    categories = list(categories)
+    sync_cats = {}
+    all_missing = []
+    for partner in partners:
+        sync_cats[partner.name], missing = plan_sync_category(categories, partner)
+        # so the next partner uses the same top-level category
+        categories += missing
+        all_missing += missing
+    return sync_cats, all_missing
+
+
+def _category_message(category: paprika.Category) -> str:
+    if category.parent_uid is None:
+        return f'Creating top-level sync category "{category.name}"'
+    return f'Creating sync category "{category.name}"'
+
+
+def get_sync_category(
+    client: paprika.PaprikaClient,
+    partner: Partner,
+    *,
+    dry_run: bool = False,
+    echo: Callable[[str], None] = click.echo,
+) -> paprika.Category:
+    categories = paprika.get_categories(client)
+    sync_cat, missing = plan_sync_category(categories, partner)
+    _echo_all(map(_category_message, missing), echo)
+    if missing and not dry_run:
+        paprika.save_categories(client, missing)
     return sync_cat
 
 
-def do_sync(token: str, partner: Partner, *, dry_run: bool = False) -> None:
-    own_recipes = paprika.get_recipe_list(token)
-    own_uids = {r.uid for r in own_recipes}
-    partner_recipes = paprika.get_recipe_list(partner.token)
-    partner_photos = paprika.get_photos(partner.token)
-    sync_cat = None
-    for item in partner_recipes:
-        if item.uid in own_uids:
-            click.echo(f'Recipe {item.uid} already synced')
-            continue
-        recipe = paprika.get_recipe(partner.token, item.uid)
-        if recipe.in_trash:
-            click.echo(f'Recipe "{recipe.name}" is trashed')
-            continue
-        if sync_cat is None:
-            sync_cat = get_sync_category(token, partner, dry_run=dry_run)
-        recipe.clear_user_data()
-        recipe.categories = [sync_cat.uid]
-        click.echo(f'Creating recipe "{recipe.name}"')
+class OwnAccount:
+    """State of our own account that is shared by all partners in a run.
+
+    The recipe list, the photo list and the categories of our own account
+    are only fetched once, no matter how many partners are synced, and
+    access to them is thread-safe so partners can be synced concurrently.
+    """
+
+    def __init__(
+        self,
+        client: paprika.PaprikaClient,
+        *,
+        dry_run: bool = False,
+        partners: Iterable[Partner] = (),
+    ):
+        self.client = client
+        self.dry_run = dry_run
+        # the sync categories of all these partners are created together
+        self.partners = list(partners)
+        self._lock = Lock()
+        self._recipe_hashes = None
+        self._photos = None
+        self._categories = None
+        self._sync_categories = {}
+        self._claimed = set()
+        # whether anything has been (or in a dry run would have been) saved
+        self.modified = False
+
+    def __repr__(self):
+        return f'<OwnAccount({self.client!r})>'
+
+    def get_recipe_hashes(self) -> Dict[str, str]:
+        with self._lock:
+            if self._recipe_hashes is None:
+                with span(self.client.tracer, 'list own recipes'):
+                    recipes = paprika.get_recipe_list(self.client)
+                self._recipe_hashes = {r.uid: r.hash for r in recipes}
+            return self._recipe_hashes
+
+    def get_photos(self) -> Dict[str, List[paprika.Photo]]:
+        with self._lock:
+            if self._photos is None:
+                with span(self.client.tracer, 'list own photos'):
+                    self._photos = paprika.get_photos(self.client)
+            return self._photos
+
+    def claim_recipe(self, uid: str) -> bool:
+        """Claim a recipe to be synced.
+
+        This returns False if the recipe has already been claimed during
+        this run, which happens when several partners have the same recipe.
+        """
+        with self._lock:
+            if uid in self._claimed:
+                return False
+            self._claimed.add(uid)
+            return True
+
+    def get_sync_category(
+        self, partner: Partner, echo: Callable[[str], None] = click.echo
+    ) -> paprika.Category:
+        """Get the sync category for a partner, creating it if needed.
+
+        Any categories missing for the other partners of this run are
+        created in the same request, since they will most likely be needed
+        as well.
+        """
+        with self._lock:
+            if partner.name in self._sync_categories:
+                return self._sync_categories[partner.name]
+            if self._categories is None:
+                with span(self.client.tracer, 'list own categories'):
+                    self._categories = paprika.get_categories(self.client)
+            partners = [partner] + [
+                p
+                for p in self.partners
+                if p.name != partner.name and p.name not in self._sync_categories
+            ]
+            sync_cats, missing = plan_sync_categories(self._categories, partners)
+            _echo_all(map(_category_message, missing), echo)
+            if missing and not self.dry_run:
+                with span(self.client.tracer, 'create categories', count=len(missing)):
+                    paprika.save_categories(self.client, missing)
+            # the top-level category must not be created again for other partners
+            self._categories += missing
+            self._sync_categories.update(sync_cats)
+            return sync_cats[partner.name]
+
+
+def get_sync_changes(
+    partner: Partner,
+    partner_status: paprika.SyncStatus,
+    own_status: Optional[paprika.SyncStatus],
+    *,
+    update: bool = False,
+) -> set:
+    """Get the parts of the partner's account that need to be synced.
+
+    Without a previous status for the partner, if anything relevant
+    changed in our own account, or when updating recipes (which may have
+    changed before the last sync without being updated), everything needs
+    to be synced.
+    """
+    if (
+        update
+        or own_status is None
+        or partner.sync_status is None
+        or partner.own_sync_status is None
+    ):
+        return set(PARTNER_STATUS_KEYS)
+    prev_own_status = paprika.SyncStatus.from_dict(partner.own_sync_status)
+    if own_status.get_updated(prev_own_status) & OWN_STATUS_KEYS:
+        return set(PARTNER_STATUS_KEYS)
+    prev_partner_status = paprika.SyncStatus.from_dict(partner.sync_status)
+    return partner_status.get_updated(prev_partner_status) & PARTNER_STATUS_KEYS
+
+
+def sync_partners(
+    client: paprika.PaprikaClient,
+    partners: List[Partner],
+    *,
+    parallel: int = 1,
+    dry_run: bool = False,
+    journal: Optional[SyncJournal] = None,
+    own: Optional[OwnAccount] = None,
+    **kwargs,
+) -> Dict[str, paprika.SyncStatus]:
+    """Sync recipes from several partners.
+
+    Our own account's state is only loaded once for all partners, and up
+    to `parallel` partners are synced at the same time. All of them share
+    the rate limiter of `client`. Returns the sync status of each partner.
+
+    Pass `own` to check afterwards whether anything was saved to our own
+    account.
+    """
+    if own is None:
+        own = OwnAccount(client, dry_run=dry_run, partners=partners)
+    if parallel == 1 or len(partners) == 1:
+        statuses = {
+            partner.name: do_sync(
+                client,
+                partner,
+                own=own,
+                dry_run=dry_run,
+                journal=journal,
+                notify=False,
+                **kwargs,
+            )
+            for partner in partners
+        }
+    else:
+        with ThreadPoolExecutor(parallel) as executor:
+            futures = {
+                partner.name: executor.submit(
+                    do_sync,
+                    client,
+                    partner,
+                    own=own,
+                    dry_run=dry_run,
+                    journal=journal,
+                    notify=False,
+                    echo=_prefixed_echo(partner),
+                    **kwargs,
+                )
+                for partner in partners
+            }
+            statuses = {name: future.result() for name, future in futures.items()}
+    # an interrupted run we resumed did not get to notify the clients
+    if own.modified or (journal is not None and journal.modified):
+        click.echo('Triggering client sync')
+        if not dry_run:
+            with span(client.tracer, 'notify'):
+                paprika.notify_sync(client)
+    return statuses
+
+
+def _prefixed_echo(partner: Partner) -> Callable[[str], None]:
+    return lambda msg: click.echo(f'[{partner.name}] {msg}')
+
+
+def do_sync(
+    client: paprika.PaprikaClient,
+    partner: Partner,
+    *,
+    own: Optional[OwnAccount] = None,
+    dry_run: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    stage_jobs: Optional[Dict[str, int]] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    recipe_cache: Optional[RecipeCache] = None,
+    photo_cache: Optional[PhotoCache] = None,
+    own_status: Optional[paprika.SyncStatus] = None,
+    update: bool = False,
+    journal: Optional[SyncJournal] = None,
+    stats: bool = False,
+    notify: bool = True,
+    echo: Callable[[str], None] = click.echo,
+) -> paprika.SyncStatus:
+    """Sync recipes from a partner.
+
+    By default only recipes missing in our own account are synced. With
+    `update` enabled, recipes whose hash differs from our own copy are
+    synced again as well, as are their photos if they changed.
+
+    If `own_status` is set, the partner is skipped in case neither their
+    account nor our own account changed since the last sync, which is
+    determined based on the statuses stored in `partner`. Returns the
+    partner's sync status so it can be stored after a successful run.
+    Without `update`, the returned status keeps the previous value for the
+    parts with changes that were not synced, so later runs do not skip
+    them.
+
+    Completed work is recorded in `journal` (if set). When it was loaded
+    from an interrupted run, anything recorded there is not synced again.
+
+    Recipes are fetched, transformed and uploaded in separate stages with
+    `jobs` workers each, unless `stage_jobs` specifies otherwise for the
+    ``fetch``, ``transform``, ``upload`` or ``photos`` stage. With `stats`
+    enabled, statistics about these stages are shown at the end. If the
+    client has a tracer, spans for all these steps are recorded there.
+    """
+    if journal is not None and (status := journal.get_partner_status(partner.name)):
+        echo(f'Partner "{partner.name}" already synced')
+        return paprika.SyncStatus.from_dict(status)
+    if own is None:
+        own = OwnAccount(client, dry_run=dry_run)
+    stage_jobs = get_stage_jobs(jobs, stage_jobs)
+    with span(client.tracer, f'partner {partner.name}'), paprika.PaprikaClient(
+        partner.token,
+        pool_size=max(sum(stage_jobs.values()), paprika.DEFAULT_POOL_SIZE),
+        limiter=client.limiter,
+        max_retries=client.max_retries,
+        metrics=client.metrics,
+        tracer=client.tracer,
+    ) as partner_client:
+        with span(client.tracer, 'partner status'):
+            partner_status = paprika.get_sync_status(partner_client)
+        changes = get_sync_changes(partner, partner_status, own_status, update=update)
+        if not changes:
+            echo(f'Nothing changed for partner "{partner.name}"')
+            return partner_status
+        pending = _do_sync(
+            own,
+            partner_client,
+            partner,
+            dry_run=dry_run,
+            stage_jobs=stage_jobs,
+            queue_size=queue_size,
+            recipe_cache=recipe_cache,
+            photo_cache=photo_cache,
+            update=update,
+            journal=journal,
+            list_photos=('photos' in changes),
+            stats=stats,
+            echo=echo,
+        )
+    if pending:
+        partner_status = _keep_previous_status(partner, partner_status, pending)
+    if journal is not None:
+        journal.partner_done(partner.name, partner_status.to_dict())
+    if notify and own.modified:
+        echo('Triggering client sync')
         if not dry_run:
-            recipe.save(token)
-        for photo in partner_photos.get(recipe.uid, []):
-            photo = paprika.get_photo(partner.token, photo.uid)
-            click.echo(f'Creating photo "{photo.name}"')
-            if not dry_run:
-                photo.save(token)
+            with span(client.tracer, 'notify'):
+                paprika.notify_sync(client)
+    return partner_status
+
+
+def _keep_previous_status(
+    partner: Partner, status: paprika.SyncStatus, keys: Set[str]
+) -> paprika.SyncStatus:
+    prev = partner.sync_status or {}
+    data = status.to_dict()
+    for key in keys:
+        # an outdated value makes the next run look at this part again
+        data[key] = prev.get(key, 0)
+    return paprika.SyncStatus.from_dict(data)
+
+
+@dataclass
+class _SyncContext:
+    own: OwnAccount
+    partner: Partner
+    partner_client: paprika.PaprikaClient
+    photo_pool: ThreadPoolExecutor
+    recipe_cache: Optional[RecipeCache]
+    photo_cache: Optional[PhotoCache]
+    dry_run: bool
+    update: bool
+    journal: Optional[SyncJournal]
+    own_photos: Dict[str, List[paprika.Photo]]
+    # set when the sync failed, so queued photos are no longer uploaded
+    aborted: Event = field(default_factory=Event)
+    # parts of the partner's account with changes that need `update`
+    pending: Set[str] = field(default_factory=set)
+
+    @property
+    def client(self) -> paprika.PaprikaClient:
+        return self.own.client
+
+
+def get_stage_jobs(jobs: int, stage_jobs: Optional[Dict[str, int]]) -> Dict[str, int]:
+    """Get the number of workers for each stage of the sync pipeline."""
+    rv = {'fetch': jobs, 'transform': 1, 'upload': jobs, 'photos': jobs}
+    if stage_jobs:
+        rv.update({k: v for k, v in stage_jobs.items() if v})
+    return rv
+
+
+def _do_sync(
+    own: OwnAccount,
+    partner_client: paprika.PaprikaClient,
+    partner: Partner,
+    *,
+    dry_run: bool,
+    stage_jobs: Dict[str, int],
+    queue_size: int,
+    recipe_cache: Optional[RecipeCache],
+    photo_cache: Optional[PhotoCache],
+    update: bool = False,
+    journal: Optional[SyncJournal] = None,
+    list_photos: bool = True,
+    stats: bool = False,
+    echo: Callable[[str], None] = click.echo,
+) -> Set[str]:
+    tracer = partner_client.tracer
+    with span(tracer, 'list recipes'):
+        partner_recipes = paprika.get_recipe_list(partner_client)
+    # if no photos changed, there are no photos for new recipes either
+    partner_photos = {}
+    if list_photos:
+        with span(tracer, 'list photos'):
+            partner_photos = paprika.get_photos(partner_client)
+    # also needed without `update` to tell whether photos need updating
+    own_photos = own.get_photos() if list_photos else {}
+
+    # Recipes go through a pipeline of bounded stages, so slow uploads do not
+    # stall downloads (or vice versa) without buffering everything in memory.
+    # Photos use a separate pool: uploaded recipes queue their photos without
+    # waiting for them, so the pipeline can never deadlock on them.
+    # Output is collected per recipe and printed in the original order.
+    with ThreadPoolExecutor(stage_jobs['photos']) as photo_pool:
+        ctx = _SyncContext(
+            own=own,
+            partner=partner,
+            partner_client=partner_client,
+            photo_pool=photo_pool,
+            recipe_cache=recipe_cache,
+            photo_cache=photo_cache,
+            dry_run=dry_run,
+            update=update,
+            journal=journal,
+            own_photos=own_photos,
+        )
+        stage_funcs = {
+            'fetch': partial(_fetch_recipe, ctx),
+            'transform': _transform_recipe,
+            'upload': partial(_upload_recipe, ctx),
+        }
+        stages = [
+            Stage(name, _traced(tracer, name, func), stage_jobs[name])
+            for name, func in stage_funcs.items()
+        ]
+        jobs = (
+            _RecipeJob(item, partner_photos.get(item.uid, []))
+            for item in partner_recipes
+        )
+        try:
+            with Pipeline(stages, queue_size=queue_size) as pipeline:
+                for future in pipeline.map(jobs):
+                    log, photo_futures = future.result()
+                    _echo_all(log, echo)
+                    for photo_future in photo_futures:
+                        _echo_all(photo_future.result(), echo)
+        except BaseException:
+            # leaving the photo pool waits for all queued photos, which must
+            # not keep writing to the account after an error (or Ctrl-C)
+            ctx.aborted.set()
+            raise
+    if stats:
+        _echo_all(pipeline.report(), echo)
+    return ctx.pending
+
+
+def _traced(tracer: Optional[Tracer], name: str, func: Callable) -> Callable:
+    if tracer is None:
+        return func
+
+    def _wrapper(job: _RecipeJob):
+        with tracer.span(name, uid=job.item.uid):
+            return func(job)
+
+    return _wrapper
+
+
+def _echo_all(
+    messages: Iterable[str], echo: Callable[[str], None] = click.echo
+) -> None:
+    for msg in messages:
+        echo(msg)
+
+
+@dataclass
+class _RecipeJob:
+    item: paprika.RecipeListItem
+    photos: List[paprika.Photo]
+    log: List[str] = field(default_factory=list)
+    recipe: Optional[paprika.Recipe] = None
+    # our copy of the recipe in case it is being updated
+    own_recipe: Optional[paprika.Recipe] = None
+    sync_category: Optional[paprika.Category] = None
+    include_photo: bool = True
+
+
+def _fetch_recipe(ctx: _SyncContext, job: _RecipeJob) -> Union[_RecipeJob, Done]:
+    item = job.item
+    journal = ctx.journal
+    if journal is not None and journal.is_recipe_done(item.uid, item.hash):
+        job.log.append(f'Recipe {item.uid} already synced')
+        if not ctx.own.claim_recipe(item.uid):
+            return Done((job.log, []))
+        # the previous run may have been interrupted before all photos were synced
+        return Done((job.log, _queue_photos(ctx, item, job.photos)))
+    own_hash = ctx.own.get_recipe_hashes().get(item.uid)
+    if (
+        own_hash is not None
+        and (not ctx.update or own_hash == item.hash)
+        and not (journal is not None and journal.is_recipe_interrupted(item.uid))
+    ):
+        job.log.append(f'Recipe {item.uid} already synced')
+        if own_hash != item.hash:
+            ctx.pending.add('recipes')
+        # photos can change without changing the recipe's hash
+        return Done((job.log, _queue_existing_photos(ctx, item, job.photos)))
+    if not ctx.own.claim_recipe(item.uid):
+        job.log.append(f'Recipe {item.uid} already synced')
+        return Done((job.log, []))
+    job.recipe = _get_recipe(ctx.partner_client, item, ctx.recipe_cache)
+    if job.recipe.in_trash:
+        job.log.append(f'Recipe "{job.recipe.name}" is trashed')
+        return Done((job.log, []))
+    if own_hash is None:
+        job.sync_category = ctx.own.get_sync_category(ctx.partner, job.log.append)
+    else:
+        job.own_recipe = paprika.get_recipe(ctx.client, item.uid)
+    return job
+
+
+def _transform_recipe(job: _RecipeJob) -> _RecipeJob:
+    recipe = job.recipe
+    if job.own_recipe is None:
+        recipe.clear_user_data()
+        recipe.categories = [job.sync_category.uid]
+        job.log.append(f'Creating recipe "{recipe.name}"')
+    else:
+        # keep whatever the user changed in their copy of the recipe
+        recipe.categories = job.own_recipe.categories
+        recipe.on_grocery_list = job.own_recipe.on_grocery_list
+        job.include_photo = recipe.photo_hash != job.own_recipe.photo_hash
+        job.log.append(f'Updating recipe "{recipe.name}"')
+    return job
+
+
+def _upload_recipe(
+    ctx: _SyncContext, job: _RecipeJob
+) -> Tuple[List[str], List[Future]]:
+    recipe = job.recipe
+    ctx.own.modified = True
+    if not ctx.dry_run:
+        if ctx.journal is not None:
+            ctx.journal.recipe_started(recipe.uid)
+        recipe.save(
+            ctx.client, photo_cache=ctx.photo_cache, include_photo=job.include_photo
+        )
+        if ctx.journal is not None:
+            ctx.journal.recipe_done(recipe.uid, recipe.hash)
+    return job.log, _queue_photos(ctx, job.item, job.photos)
+
+
+def _queue_photos(
+    ctx: _SyncContext, item: paprika.RecipeListItem, photos: List[paprika.Photo]
+) -> List[Future]:
+    own_photo_hashes = {p.uid: p.hash for p in ctx.own_photos.get(item.uid, [])}
+    return [
+        ctx.photo_pool.submit(
+            _sync_photo, ctx, photo.uid, update=(photo.uid in own_photo_hashes)
+        )
+        for photo in photos
+        if own_photo_hashes.get(photo.uid) != photo.hash
+        and not (
+            ctx.journal is not None and ctx.journal.is_photo_done(photo.uid, photo.hash)
+        )
+    ]
+
+
+def _queue_existing_photos(
+    ctx: _SyncContext, item: paprika.RecipeListItem, photos: List[paprika.Photo]
+) -> List[Future]:
+    own_photo_hashes = {p.uid: p.hash for p in ctx.own_photos.get(item.uid, [])}
+    if all(own_photo_hashes.get(p.uid) == p.hash for p in photos):
+        return []
+    if not ctx.update:
+        ctx.pending.add('photos')
+        return []
+    if not ctx.own.claim_recipe(item.uid):
+        return []
+    return _queue_photos(ctx, item, photos)
+
+
+def _get_recipe(
+    client: paprika.PaprikaClient,
+    item: paprika.RecipeListItem,
+    recipe_cache: Optional[RecipeCache],
+) -> paprika.Recipe:
+    if recipe_cache is None:
+        return paprika.get_recipe(client, item.uid)
+    data = recipe_cache.get(item.uid, item.hash)
+    if data is None:
+        data = paprika.get_recipe_raw(client, item.uid)
+        # the list may be outdated by now, so we use the hash of what we got
+        recipe_cache.put(data['uid'], data['hash'], data)
+    return paprika.Recipe.from_dict(data)
+
+
+def _sync_photo(ctx: _SyncContext, uid: str, *, update: bool) -> List[str]:
+    if ctx.aborted.is_set():
+        return []
+    try:
+        return _transfer_photo(ctx, uid, update=update)
+    except BaseException:
+        # the run fails with this error as soon as its result is reached, so
+        # the photos queued after it are not uploaded in the meantime either
+        ctx.aborted.set()
+        raise
+
+
+def _transfer_photo(ctx: _SyncContext, uid: str, *, update: bool) -> List[str]:
+    tracer = ctx.partner_client.tracer
+    with span(tracer, 'photo fetch', uid=uid):
+        photo = paprika.get_photo(ctx.partner_client, uid)
+    verb = 'Updating' if update else 'Creating'
+    log = [f'{verb} photo "{photo.name}"']
+    if ctx.aborted.is_set():
+        return []
+    ctx.own.modified = True
+    if not ctx.dry_run:
+        with span(tracer, 'photo upload', uid=uid):
+            photo.save(ctx.client, photo_cache=ctx.photo_cache)
+        if ctx.journal is not None:
+            ctx.journal.photo_done(photo.uid, photo.hash)
+    return log
+
+
+async def do_sync_async(
+    client: AsyncPaprikaClient,
+    partner: Partner,
+    *,
+    dry_run: bool = False,
+    concurrency: Optional[int] = None,
+) -> None:
+    """Like :func:`do_sync`, but using the asyncio client.
+
+    All recipes are started at once; the number of requests actually in
+    flight is limited by the semaphore of each client.
+    """
+    from .paprika_async import AsyncPaprikaClient
+
+    async with AsyncPaprikaClient(
+        partner.token,
+        concurrency=(concurrency or client.concurrency),
+        limiter=client.limiter,
+        max_retries=client.max_retries,
+        metrics=client.metrics,
+    ) as partner_client:
+        own_recipes, partner_recipes, partner_photos = await asyncio.gather(
+            client.get_recipe_list(),
+            partner_client.get_recipe_list(),
+            partner_client.get_photos(),
+        )
+        own_uids = {r.uid for r in own_recipes}
+        sync_cat = AsyncLazySyncCategory(client, partner, dry_run=dry_run)
+        tasks = [
+            asyncio.ensure_future(
+                _sync_recipe_async(
+                    client,
+                    partner_client,
+                    item,
+                    partner_photos.get(item.uid, []),
+                    own_uids=own_uids,
+                    sync_cat=sync_cat,
+                    dry_run=dry_run,
+                )
+            )
+            for item in partner_recipes
+        ]
+        try:
+            for task in tasks:
+                _echo_all(await task)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
     click.echo('Triggering client sync')
     if not dry_run:
-        paprika.notify_sync(token)
+        await client.notify_sync()
+
+
+class AsyncLazySyncCategory:
+    """The sync category of a partner, created on first use.
+
+    The own account's categories are only loaded (and the missing sync
+    categories created) when the first recipe needs them, and a lock makes
+    sure this happens only once even if many recipes ask at the same time.
+    """
+
+    def __init__(self, client: AsyncPaprikaClient, partner: Partner, *, dry_run):
+        self.client = client
+        self.partner = partner
+        self.dry_run = dry_run
+        self._category = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, echo: Callable[[str], None] = click.echo) -> paprika.Category:
+        async with self._lock:
+            if self._category is None:
+                categories = await self.client.get_categories()
+                sync_cat, missing = plan_sync_category(categories, self.partner)
+                _echo_all(map(_category_message, missing), echo)
+                if missing and not self.dry_run:
+                    await self.client.save_categories(missing)
+                self._category = sync_cat
+            return self._category
+
+
+async def _sync_recipe_async(
+    client: AsyncPaprikaClient,
+    partner_client: AsyncPaprikaClient,
+    item: paprika.RecipeListItem,
+    photos: List[paprika.Photo],
+    *,
+    own_uids: set,
+    sync_cat: AsyncLazySyncCategory,
+    dry_run: bool,
+) -> List[str]:
+    log = []
+    if item.uid in own_uids:
+        log.append(f'Recipe {item.uid} already synced')
+        return log
+    recipe = await partner_client.get_recipe(item.uid)
+    if recipe.in_trash:
+        log.append(f'Recipe "{recipe.name}" is trashed')
+        return log
+    recipe.clear_user_data()
+    recipe.categories = [(await sync_cat.get(log.append)).uid]
+    log.append(f'Creating recipe "{recipe.name}"')
+    if not dry_run:
+        await client.save_recipe(recipe)
+    photo_logs = await asyncio.gather(
+        *(
+            _sync_photo_async(client, partner_client, photo.uid, dry_run=dry_run)
+            for photo in photos
+        )
+    )
+    for photo_log in photo_logs:
+        log += photo_log
+    return log
+
+
+async def _sync_photo_async(
+    client: AsyncPaprikaClient,
+    partner_client: AsyncPaprikaClient,
+    uid: str,
+    *,
+    dry_run: bool,
+) -> List[str]:
+    photo = await partner_client.get_photo(uid)
+    log = [f'Creating photo "{photo.name}"']
+    if not dry_run:
+        await client.save_photo(photo)
+    return log
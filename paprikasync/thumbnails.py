@@ -0,0 +1,191 @@
+"""Resized variants of recipe and photo images.
+
+Variants are generated from the original image the first time they are
+requested and then kept in the blob store, keyed by the hash of the
+original and the size (and format) of the variant.  Generating them is
+done by a small pool of worker threads so a page full of new thumbnails
+cannot keep all request threads busy resizing images.
+
+This requires Pillow (the ``thumbnails`` extra); without it the original
+images are served instead.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from io import BytesIO
+from threading import Lock
+from typing import Dict, Optional
+
+from flask import current_app
+
+from .blobs import BlobStore, get_blob_store
+
+# the largest width/height of each variant; only these sizes are allowed so
+# the number of variants per image is bounded
+SIZES = (160, 320, 640, 1280)
+# the size used for the images in the recipe list
+THUMBNAIL_SIZE = 320
+FORMATS = {'webp': 'image/webp'}
+DEFAULT_JOBS = 2
+# images waiting for a worker; beyond this, originals are served right away
+DEFAULT_MAX_PENDING = 64
+# seconds a request waits for its variant before serving the original
+DEFAULT_TIMEOUT = 10
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+_generator_lock = Lock()
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def variant_key(key: str, size: int, image_format: Optional[str] = None) -> str:
+    """Get the blob key of a variant of the image stored as `key`."""
+    variant = f'{key}-{size}'
+    return f'{variant}.{image_format}' if image_format else variant
+
+
+def resize_image(data: bytes, size: int, image_format: Optional[str] = None) -> bytes:
+    """Scale an image down to fit in a `size` square.
+
+    The variant uses the format of the original unless a different one
+    is requested.  Images smaller than `size` are not scaled up.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(BytesIO(data))
+        original_format = image.format
+        # let the JPEG decoder skip most of the pixels we do not need
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise ThumbnailError(f'Could not resize image: {exc}') from exc
+    save_format = (image_format or original_format or 'jpeg').upper()
+    if save_format == 'JPEG':
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        options = {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+    elif save_format == 'WEBP':
+        options = {'quality': WEBP_QUALITY, 'method': 4}
+    else:
+        options = {}
+    buf = BytesIO()
+    try:
+        image.save(buf, save_format, **options)
+    except (OSError, KeyError) as exc:
+        raise ThumbnailError(f'Could not save {save_format} image: {exc}') from exc
+    return buf.getvalue()
+
+
+class ThumbnailGenerator:
+    """Generate image variants in a bounded pool of worker threads.
+
+    Concurrent requests for the same variant share a single job, and if
+    too many jobs are already waiting for a worker no new ones are
+    started, so a request never waits longer than `timeout` seconds.
+    Jobs that do not finish in time keep running and store their result
+    for the next request.
+    """
+
+    def __init__(
+        self,
+        store: BlobStore,
+        *,
+        jobs: int = DEFAULT_JOBS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.store = store
+        self.jobs = jobs
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.enabled = importlib.util.find_spec('PIL') is not None
+        self._executor = ThreadPoolExecutor(jobs, thread_name_prefix='thumbnails')
+        self._pending: Dict[str, Future] = {}
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f'<ThumbnailGenerator({self.jobs} jobs, {len(self._pending)} pending)>'
+
+    def get(
+        self, cls, id: int, key: str, size: int, image_format: Optional[str] = None
+    ) -> Optional[str]:
+        """Get the blob key of a variant, generating it if needed.
+
+        Returns None if the variant is not available (yet), in which case
+        the original image should be served.
+        """
+        vkey = variant_key(key, size, image_format)
+        if self.store.exists(vkey):
+            return vkey
+        if not self.enabled:
+            return None
+        with self._lock:
+            future = self._pending.get(vkey)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    current_app.logger.warning('Too many pending thumbnails')
+                    return None
+                app = current_app._get_current_object()
+                future = self._executor.submit(
+                    self._generate, app, cls, id, key, vkey, size, image_format
+                )
+                self._pending[vkey] = future
+        # outside the lock since it runs right away if the job already finished
+        future.add_done_callback(lambda f: self._done(vkey))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            return None
+        except ThumbnailError as exc:
+            current_app.logger.warning('Thumbnail %s failed: %s', vkey, exc)
+            return None
+        except Exception:
+            # e.g. the blob store or database failing; the original image
+            # may still be available
+            current_app.logger.exception('Thumbnail %s failed', vkey)
+            return None
+
+    def _done(self, vkey: str) -> None:
+        with self._lock:
+            self._pending.pop(vkey, None)
+
+    def _generate(self, app, cls, id, key, vkey, size, image_format) -> str:
+        with app.app_context():
+            data = self.store.get(key)
+            if data is None:
+                # not moved to the blob store yet
+                query = cls.query.with_entities(cls.image_data).filter_by(id=id)
+                data = query.scalar()
+            if data is None:
+                raise ThumbnailError(f'No image for {cls.__name__} {id}')
+            self.store.put(vkey, resize_image(data, size, image_format))
+        return vkey
+
+
+def get_thumbnail_generator() -> ThumbnailGenerator:
+    """Get the thumbnail generator of the current app."""
+    generator = current_app.extensions.get('paprikasync_thumbnails')
+    if generator is not None:
+        return generator
+    # there must only be one pool, or it would not limit anything
+    with _generator_lock:
+        generator = current_app.extensions.get('paprikasync_thumbnails')
+        if generator is None:
+            config = current_app.config
+            generator = current_app.extensions['paprikasync_thumbnails'] = (
+                ThumbnailGenerator(
+                    get_blob_store(),
+                    jobs=config['PAPRIKASYNC_THUMBNAIL_JOBS'],
+                    max_pending=config['PAPRIKASYNC_THUMBNAIL_MAX_PENDING'],
+                    timeout=config['PAPRIKASYNC_THUMBNAIL_TIMEOUT'],
+                )
+            )
+    return generator
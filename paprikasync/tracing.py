@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, List, Optional, TextIO
+
+
+class Tracer:
+    """Record a timeline of spans in the Chrome Trace Event format.
+
+    The resulting file can be opened in ``chrome://tracing`` or Perfetto,
+    where each thread gets its own row, so it is easy to see what runs
+    concurrently and where everything waits for a single slow step.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: List[dict] = []
+        self._threads: Dict[int, int] = {}
+        self._start = time.perf_counter()
+        self._pid = os.getpid()
+
+    def __repr__(self):
+        return f'<Tracer({len(self._events)} events)>'
+
+    def _now(self) -> float:
+        # microseconds since the tracer was created
+        return (time.perf_counter() - self._start) * 1e6
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        tid = self._threads.get(ident)
+        if tid is None:
+            tid = self._threads[ident] = len(self._threads) + 1
+            self._events.append(
+                {
+                    'ph': 'M',
+                    'name': 'thread_name',
+                    'pid': self._pid,
+                    'tid': tid,
+                    'args': {'name': threading.current_thread().name},
+                }
+            )
+        return tid
+
+    @contextmanager
+    def span(self, name: str, cat: str = 'sync', **args):
+        """Record the time spent in the block as a span."""
+        start = self._now()
+        try:
+            yield
+        finally:
+            end = self._now()
+            with self._lock:
+                self._events.append(
+                    {
+                        'ph': 'X',
+                        'name': name,
+                        'cat': cat,
+                        'ts': round(start, 1),
+                        'dur': round(end - start, 1),
+                        'pid': self._pid,
+                        'tid': self._tid(),
+                        'args': args,
+                    }
+                )
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'traceEvents': list(self._events), 'displayTimeUnit': 'ms'}
+
+    def save(self, file: TextIO) -> None:
+        json.dump(self.to_dict(), file)
+
+
+def span(tracer: Optional[Tracer], name: str, **args) -> ContextManager:
+    """Record a span if tracing is enabled."""
+    if tracer is None:
+        return nullcontext()
+    return tracer.span(name, **args)
@@ -1,6 +1,11 @@
+import os
+
 from flask import Flask
 
+from . import thumbnails
 from .api import api
+from .commands import migrate_blobs, migrate_columns
+from .downloads import DEFAULT_JOBS, DEFAULT_MAX_IN_FLIGHT, DEFAULT_TIMEOUT
 from .img import img
 from .models import db
 from .schemas import mm
@@ -8,8 +13,44 @@ from .schemas import mm
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///paprikasync'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# number of concurrent paprika requests when refreshing a user's data
+app.config['PAPRIKASYNC_SYNC_JOBS'] = int(
+    os.environ.get('PAPRIKASYNC_SYNC_JOBS', DEFAULT_JOBS)
+)
+# limits for downloading the photos of a user
+app.config['PAPRIKASYNC_PHOTO_TIMEOUT'] = float(
+    os.environ.get('PAPRIKASYNC_PHOTO_TIMEOUT', DEFAULT_TIMEOUT)
+)
+app.config['PAPRIKASYNC_PHOTO_MAX_IN_FLIGHT'] = int(
+    os.environ.get('PAPRIKASYNC_PHOTO_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT)
+)
+# where images are stored: a directory (defaults to the instance folder)
+# or an s3://bucket/prefix url
+app.config['PAPRIKASYNC_BLOB_STORE'] = os.environ.get('PAPRIKASYNC_BLOB_STORE')
+# serve images from the blob directory using nginx's X-Accel-Redirect
+app.config['PAPRIKASYNC_BLOB_ACCEL_REDIRECT'] = os.environ.get(
+    'PAPRIKASYNC_BLOB_ACCEL_REDIRECT'
+)
+# for s3-compatible services other than AWS
+app.config['PAPRIKASYNC_S3_ENDPOINT_URL'] = os.environ.get(
+    'PAPRIKASYNC_S3_ENDPOINT_URL'
+)
+# resizing images for thumbnails (requires Pillow)
+app.config['PAPRIKASYNC_THUMBNAIL_JOBS'] = int(
+    os.environ.get('PAPRIKASYNC_THUMBNAIL_JOBS', thumbnails.DEFAULT_JOBS)
+)
+app.config['PAPRIKASYNC_THUMBNAIL_MAX_PENDING'] = int(
+    os.environ.get('PAPRIKASYNC_THUMBNAIL_MAX_PENDING', thumbnails.DEFAULT_MAX_PENDING)
+)
+app.config['PAPRIKASYNC_THUMBNAIL_TIMEOUT'] = float(
+    os.environ.get('PAPRIKASYNC_THUMBNAIL_TIMEOUT', thumbnails.DEFAULT_TIMEOUT)
+)
+# write a Chrome trace of each paprika refresh to this directory
+app.config['PAPRIKASYNC_TRACE_DIR'] = os.environ.get('PAPRIKASYNC_TRACE_DIR')
 db.init_app(app)
 mm.init_app(app)
 
 app.register_blueprint(api)
 app.register_blueprint(img)
+app.cli.add_command(migrate_blobs)
+app.cli.add_command(migrate_columns)
@@ -0,0 +1,115 @@
+import logging
+import os
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS = Path(__file__).resolve().parent.parent / 'benchmarks'
+
+
+def _patch_api_base(mp: pytest.MonkeyPatch, api_base: str) -> None:
+    # the API urls are built when paprikasync.paprika is imported, which
+    # happens long before the server is started
+    from paprikasync import paprika
+
+    modules = [paprika]
+    try:
+        from paprikasync import paprika_async
+    except ImportError:
+        pass
+    else:
+        modules.append(paprika_async)
+    old = paprika.API_BASE
+    mp.setattr(paprika, 'API_BASE', api_base)
+    for module in modules:
+        for name, value in list(vars(module).items()):
+            if name.endswith('_URL') and isinstance(value, str):
+                if value.startswith(old):
+                    mp.setattr(module, name, value.replace(old, api_base, 1))
+
+
+@pytest.fixture(scope='session')
+def mock_server():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.syspath_prepend(str(BENCHMARKS))
+        from mock_paprika import MockPaprika
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        with MockPaprika() as server:
+            _patch_api_base(mp, server.api_base)
+            yield server
+
+
+@pytest.fixture
+def mock_paprika(mock_server):
+    from mock_paprika import Faults
+
+    mock_server.reset()
+    mock_server.faults = Faults()
+    return mock_server
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    from paprikasync import paprika
+
+    monkeypatch.setattr(paprika, 'BACKOFF_BASE', 0)
+
+
+@pytest.fixture(scope='session')
+def database_uri():
+    # the web app relies on PostgreSQL features (JSONB, ON CONFLICT, ...)
+    uri = os.environ.get('PAPRIKASYNC_TEST_DATABASE_URI')
+    if not uri:
+        pytest.skip('PAPRIKASYNC_TEST_DATABASE_URI is not set')
+    return uri
+
+
+@pytest.fixture
+def app(database_uri, tmp_path):
+    from paprikasync.models import db
+    from paprikasync.webapp import app
+
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        PAPRIKASYNC_BLOB_STORE=str(tmp_path / 'blobs'),
+    )
+    app.extensions.pop('paprikasync_blobs', None)
+    app.extensions.pop('paprikasync_thumbnails', None)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        try:
+            yield app
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    from paprikasync.models import User, db
+
+    user = User(
+        name='Alice', email='alice@example.com', password='secret', paprika_token='x'
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def paprika_account(user, mock_paprika):
+    """A Paprika account whose recipes and photos are synced to `user`."""
+    from paprikasync import paprika
+    from paprikasync.models import Photo, Recipe, db
+
+    account = mock_paprika.add_account(
+        'alice@example.com', recipes=4, photos_per_recipe=1
+    )
+    with paprika.PaprikaClient(account.token) as client:
+        Recipe.sync(user, client)
+        Photo.sync(user, client)
+    db.session.commit()
+    return account
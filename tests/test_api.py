@@ -0,0 +1,48 @@
+import pytest
+
+from paprikasync.models import Photo, Recipe
+
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {user.token}'
+    return client
+
+
+def test_recipes(client, user, paprika_account):
+    resp = client.get('/api/paprika/recipes/')
+    assert resp.status_code == 200
+    recipes = resp.json
+    assert len(recipes) == len(paprika_account.recipes)
+    assert [r['name'] for r in recipes] == sorted(r['name'] for r in recipes)
+    for data in recipes:
+        recipe = Recipe.query.get(data['id'])
+        if recipe.data['photo']:
+            assert data['photo_url'].endswith(
+                f'/{recipe.data["photo_hash"]}/{recipe.data["photo"]}'
+            )
+            assert data['thumbnail_url'] == f'{data["photo_url"]}?size=320'
+        else:
+            assert data['photo_url'] is data['thumbnail_url'] is None
+
+
+def test_recipe(client, user, paprika_account):
+    recipe = Recipe.query.filter_by(user=user).first()
+    photo = Photo.query.filter_by(user=user, recipe_uid=recipe.uid).one()
+    resp = client.get(f'/api/paprika/recipes/{recipe.id}/')
+    assert resp.status_code == 200
+    data = resp.json
+    assert data['id'] == recipe.id
+    assert data['name'] == recipe.name
+    assert 'photo_url' not in data['data']
+    assert data['photos'] == [
+        f'/image/recipe/{recipe.id}/photos/{photo.id}/{photo.hash}/'
+        f'{photo.data["filename"]}'
+    ]
+    assert client.get(f'/api/paprika/recipes/{recipe.id}/photos/{photo.id}').data
+
+
+def test_recipe_not_found(app, client, user, paprika_account):
+    assert client.get('/api/paprika/recipes/0/').status_code == 404
+    assert app.test_client().get('/api/paprika/recipes/').status_code == 401
@@ -0,0 +1,46 @@
+import pytest
+
+from paprikasync.blobs import FileBlobStore, S3BlobStore, create_blob_store
+
+
+def test_file_store(tmp_path):
+    store = FileBlobStore(tmp_path)
+    assert not store.exists('ABCDEF')
+    assert store.get('ABCDEF') is None
+    store.put('ABCDEF', b'image')
+    # content-addressed, so existing blobs are never replaced
+    store.put('abcdef', b'other')
+    assert store.get('abcdef') == b'image'
+    assert store.get_path('ABCDEF') == tmp_path / 'ab' / 'abcdef'
+    assert [p.name for p in tmp_path.rglob('*') if p.is_file()] == ['abcdef']
+    store.delete('ABCDEF')
+    store.delete('ABCDEF')
+    assert not store.exists('ABCDEF')
+
+
+@pytest.mark.parametrize(
+    'key', ['', '.', '..', '..x', '.hidden', 'a/b', '../x', 'x' * 201, 'a\\b']
+)
+def test_invalid_keys(tmp_path, key):
+    store = FileBlobStore(tmp_path / 'blobs')
+    with pytest.raises(ValueError):
+        store.put(key, b'data')
+    with pytest.raises(ValueError):
+        store.get(key)
+    with pytest.raises(ValueError):
+        S3BlobStore('bucket', client=object())._object_key(key)
+    assert not list(tmp_path.iterdir())
+
+
+def test_valid_keys(tmp_path):
+    store = FileBlobStore(tmp_path)
+    for key in ('a', 'a.b', 'a..b', '0123abcd-320.webp', 'x' * 200):
+        store.put(key, b'data')
+        assert tmp_path.resolve() in store.get_path(key).resolve().parents
+
+
+def test_create_blob_store(tmp_path):
+    assert create_blob_store(str(tmp_path)).path == tmp_path
+    assert create_blob_store(f'file://{tmp_path}').path == tmp_path
+    with pytest.raises(ValueError):
+        create_blob_store('ftp://example.com/')
@@ -0,0 +1,96 @@
+import os
+import time
+
+from paprikasync.cache import (
+    STALE_TMP_AGE,
+    DiskCache,
+    PhotoCache,
+    RecipeCache,
+    photo_url_expired,
+)
+
+
+def test_eviction(tmp_path):
+    cache = DiskCache(tmp_path, 30)
+    for key in 'abc':
+        cache.put(key, b'x' * 10)
+    cache.get('a')
+    cache.put('d', b'x' * 10)
+    assert cache.get('b') is None
+    assert {p.name for p in tmp_path.iterdir()} == {'a', 'c', 'd'}
+    assert cache.size == 30
+    # too large to ever fit
+    cache.put('e', b'x' * 31)
+    assert cache.get('e') is None
+    assert cache.size == 30
+
+
+def test_recipe_cache(tmp_path):
+    cache = RecipeCache(tmp_path)
+    cache.put('uid', 'hash1', {'uid': 'uid', 'photo_url': None})
+    assert cache.get('uid', 'hash1') == {'uid': 'uid', 'photo_url': None}
+    assert cache.get('uid', 'hash2') is None
+
+
+def test_recipe_cache_expired_photo_url(tmp_path):
+    cache = RecipeCache(tmp_path)
+    fresh = f'https://s3.example.com/photo.jpg?Expires={int(time.time()) + 3600}'
+    stale = f'https://s3.example.com/photo.jpg?Expires={int(time.time()) + 60}'
+    cache.put('a', 'hash', {'uid': 'a', 'photo_url': fresh})
+    cache.put('b', 'hash', {'uid': 'b', 'photo_url': stale})
+    assert cache.get('a', 'hash') is not None
+    assert cache.get('b', 'hash') is None
+
+
+def test_photo_url_expired():
+    now = time.time()
+    assert not photo_url_expired('https://s3.example.com/photo.jpg')
+    assert photo_url_expired(f'https://s3.example.com/x?Expires={int(now) - 1}')
+    v4 = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))
+    url = f'https://s3.example.com/x?X-Amz-Date={v4}&X-Amz-Expires='
+    assert not photo_url_expired(f'{url}3600')
+    assert photo_url_expired(f'{url}60')
+
+
+def test_order_kept_between_runs(tmp_path):
+    cache = DiskCache(tmp_path, 30)
+    for i, key in enumerate('abc'):
+        cache.put(key, b'x' * 10)
+        os.utime(tmp_path / key, (i, i))
+    cache = DiskCache(tmp_path, 30)
+    cache.put('d', b'x' * 10)
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+
+
+def test_stale_temp_files_removed(tmp_path):
+    (tmp_path / 'stale.tmp').write_bytes(b'x')
+    stale = time.time() - STALE_TMP_AGE - 1
+    os.utime(tmp_path / 'stale.tmp', (stale, stale))
+    (tmp_path / 'writing.tmp').write_bytes(b'x')
+    cache = DiskCache(tmp_path, 30)
+    assert cache.size == 0
+    assert {p.name for p in tmp_path.iterdir()} == {'writing.tmp'}
+
+
+def test_unsafe_keys(tmp_path):
+    cache = DiskCache(tmp_path / 'cache', 1000)
+    for key in ('.', '..', 'x.tmp', '../escape', 'a/b'):
+        cache.put(key, key.encode())
+        assert cache.get(key) == key.encode()
+    assert {p.parent for p in tmp_path.rglob('*') if p.is_file()} == {
+        tmp_path / 'cache'
+    }
+    assert not any(p.name.endswith('.tmp') for p in (tmp_path / 'cache').iterdir())
+
+
+def test_photo_cache(tmp_path):
+    cache = PhotoCache(tmp_path)
+    assert cache.get_path('hash') is None
+    tmp = cache.temp_path()
+    tmp.write_bytes(b'photo')
+    # not visible until the download is complete
+    assert cache.get_path('hash') is None
+    cache.commit('hash', tmp)
+    assert cache.get_path('hash').read_bytes() == b'photo'
+    assert not tmp.exists()
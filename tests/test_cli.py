@@ -0,0 +1,155 @@
+import json
+import os
+import subprocess
+import sys
+from functools import partial
+
+import pytest
+from click.testing import CliRunner
+
+from paprikasync import cache, config, journal
+from paprikasync.cli import cli
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DATA_DIR', tmp_path)
+    monkeypatch.setattr(config, 'CONFIG_FILE', tmp_path / 'config.json')
+    monkeypatch.setattr(
+        journal, 'SyncJournal', partial(journal.SyncJournal, tmp_path / 'journal')
+    )
+    monkeypatch.setattr(
+        cache, 'RecipeCache', partial(cache.RecipeCache, tmp_path / 'recipes')
+    )
+    monkeypatch.setattr(
+        cache, 'PhotoCache', partial(cache.PhotoCache, tmp_path / 'photos')
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def accounts(mock_paprika, data_dir):
+    partner = mock_paprika.add_account(
+        'partner@example.com', recipes=3, photos_per_recipe=1, seed=1
+    )
+    own = mock_paprika.add_account('own@example.com')
+    cfg = config.Config(own.token)
+    cfg.add_partner('partner', partner.token)
+    cfg.save()
+    return own, partner
+
+
+def _run(*args):
+    result = CliRunner().invoke(cli, ['run', *args], catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_incremental_run(accounts):
+    own, partner = accounts
+    output = _run()
+    assert output.count('Creating recipe') == 3
+    assert output.count('Creating photo') == 3
+    assert len(own.recipes) == 3
+    assert 'Nothing changed for partner "partner"' in _run()
+    # updating looks at every recipe, but there is nothing to update
+    output = _run('-u')
+    assert output.count('already synced') == 3
+    assert 'Triggering client sync' not in output
+
+
+def test_update_needs_update_flag(accounts):
+    own, partner = accounts
+    _run()
+    recipe = next(iter(partner.recipes.values()))
+    recipe.update(name='Edited', hash='edited')
+    partner.bump('recipes')
+
+    output = _run()
+    assert 'Updating recipe' not in output
+    assert own.recipes[recipe['uid']]['name'] != 'Edited'
+    # the edit is still pending, so neither this nor the next run skips it
+    status = config.load_config().partners[0].sync_status
+    assert status['recipes'] < partner.status['recipes']
+    assert 'Nothing changed' not in _run()
+
+    output = _run('-u')
+    assert 'Updating recipe "Edited"' in output
+    assert own.recipes[recipe['uid']]['name'] == 'Edited'
+    assert 'Nothing changed for partner "partner"' in _run()
+
+
+def test_photo_update_needs_update_flag(accounts):
+    own, partner = accounts
+    _run()
+    photo = next(iter(partner.photos.values()))
+    photo['hash'] = 'edited'
+    partner.bump('photos')
+
+    assert 'Updating photo' not in _run()
+    assert own.photos[photo['uid']]['hash'] != 'edited'
+
+    assert 'Updating photo' in _run('-u')
+    assert own.photos[photo['uid']]['hash'] == 'edited'
+    assert 'Nothing changed for partner "partner"' in _run()
+
+
+def test_stats(accounts, tmp_path):
+    output = _run('--stats', '--stats-json', str(tmp_path / 'stats.json'))
+    stats = json.loads((tmp_path / 'stats.json').read_text())
+    assert stats['POST /sync/recipe/<uid>/']['calls'] == 3
+    assert stats['POST /sync/photo/<uid>/']['calls'] == 3
+    assert 'POST /sync/recipe/<uid>/' in output
+    assert all(name in output for name in ('fetch', 'transform', 'upload'))
+
+
+def test_trace(accounts, tmp_path):
+    _run('--trace', str(tmp_path / 'trace.json'))
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    names = {e['name'] for e in events if e['ph'] == 'X'}
+    assert {'own status', 'partner partner', 'fetch', 'upload', 'notify'} <= names
+    assert 'POST /sync/recipe/<uid>/' in names
+
+
+def test_concurrent_run_output_ordered(mock_paprika, data_dir):
+    partner = mock_paprika.add_account(
+        'partner@example.com', recipes=12, photos_per_recipe=1, seed=1
+    )
+    own = mock_paprika.add_account('own@example.com')
+    cfg = config.Config(own.token)
+    cfg.add_partner('partner', partner.token)
+    cfg.save()
+    mock_paprika.faults.jitter = 0.02
+    output = _run('--jobs', '8')
+    created = [
+        line.split('"')[1] for line in output.splitlines() if 'Creating recipe' in line
+    ]
+    assert created == [r['name'] for r in partner.recipes.values()]
+    assert len(own.recipes) == 12
+    assert len(own.photos) == 12
+    # the sync category is only created once
+    assert mock_paprika.stats.by_endpoint['POST /api/v2/sync/categories/'] == 1
+
+
+@pytest.mark.parametrize('args', [['--help'], ['partner', 'list']])
+def test_startup_imports(tmp_path, args):
+    # quick commands must not import what is only needed to talk to the API
+    code = (
+        'import sys\n'
+        'from paprikasync.cli import cli\n'
+        'try:\n'
+        '    cli(sys.argv[1:])\n'
+        'except SystemExit as exc:\n'
+        '    assert not exc.code, exc.code\n'
+        'heavy = {"requests", "dataclasses_json", "paprikasync.paprika"}\n'
+        'print(sorted(heavy & set(sys.modules)))\n'
+    )
+    env = dict(os.environ, XDG_CONFIG_HOME=str(tmp_path), HOME=str(tmp_path))
+    proc = subprocess.run(
+        [sys.executable, '-c', code, *args],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert proc.stdout.splitlines()[-1] == '[]'
@@ -0,0 +1,104 @@
+import dataclasses
+import warnings
+from dataclasses import field
+from typing import List, Optional
+
+import pytest
+
+from paprikasync import paprika
+from paprikasync.codec import json_dataclass
+
+dataclasses_json = pytest.importorskip('dataclasses_json')
+
+
+@json_dataclass
+class Item:
+    uid: str
+    count: int = 0
+    tags: Optional[List[str]] = None
+    ratio: float = 1.0
+    flags: List[int] = field(default_factory=list)
+
+
+@dataclasses_json.dataclass_json
+@dataclasses.dataclass
+class ReferenceItem:
+    uid: str
+    count: int = 0
+    tags: Optional[List[str]] = None
+    ratio: float = 1.0
+    flags: List[int] = field(default_factory=list)
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        {'uid': 'a'},
+        {'uid': 'a', 'count': 3, 'tags': ['x', 'y'], 'ratio': 0.5, 'flags': [1]},
+        {'uid': 5, 'count': '7', 'ratio': 2, 'flags': ['1', 2], 'unknown': 1},
+        {'uid': None, 'count': None, 'tags': None},
+    ],
+)
+@pytest.mark.parametrize('infer_missing', [False, True])
+def test_same_as_dataclasses_json(data, infer_missing):
+    with warnings.catch_warnings():
+        # dataclasses_json warns about None in non-optional fields
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = ReferenceItem.from_dict(data, infer_missing=infer_missing)
+    item = Item.from_dict(data, infer_missing=infer_missing)
+    assert item.to_dict() == expected.to_dict()
+    assert item.to_json() == expected.to_json()
+    assert Item.from_json(item.to_json()) == item
+
+
+def test_missing_key():
+    with pytest.raises(KeyError, match='uid'):
+        ReferenceItem.from_dict({'count': 1})
+    with pytest.raises(KeyError, match='uid'):
+        Item.from_dict({'count': 1})
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = ReferenceItem.from_dict({'count': 1}, infer_missing=True)
+    assert Item.from_dict({'count': 1}, infer_missing=True).to_dict() == (
+        expected.to_dict()
+    )
+
+
+def test_slots():
+    item = Item('a')
+    assert not hasattr(item, '__dict__')
+    with pytest.raises(AttributeError):
+        item.other = 1
+
+
+def _reference_class(cls):
+    ns = {'__annotations__': {}, '__module__': cls.__module__}
+    for f in dataclasses.fields(cls):
+        ns['__annotations__'][f.name] = f.type
+        if f.default is not dataclasses.MISSING:
+            ns[f.name] = f.default
+        elif f.default_factory is not dataclasses.MISSING:
+            ns[f.name] = field(default_factory=f.default_factory)
+    cls = dataclasses.dataclass(type(cls.__name__, (), ns))
+    return dataclasses_json.dataclass_json(cls)
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [
+        paprika.SyncStatus,
+        paprika.Category,
+        paprika.RecipeListItem,
+        paprika.Photo,
+        paprika.Recipe,
+    ],
+)
+def test_paprika_classes(cls):
+    data = {'uid': 'UID', 'name': 'Name', 'hash': 'abc', 'rating': '4', 'x': 1}
+    data = {k: v for k, v in data.items() if k in cls.__slots__}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = _reference_class(cls).from_dict(data, infer_missing=True)
+    obj = cls.from_dict(data, infer_missing=True)
+    assert obj.to_dict() == expected.to_dict()
+    assert cls.from_json(obj.to_json()) == obj
@@ -0,0 +1,84 @@
+from sqlalchemy import inspect
+
+from paprikasync.commands import migrate_columns
+from paprikasync.models import Category, Photo, Recipe, db
+
+DATA = {
+    Category: [
+        {
+            'uid': 'C1',
+            'name': 'Category',
+            'order_flag': 0,
+            'parent_uid': None,
+            'deleted': False,
+        }
+    ],
+    Photo: [
+        {
+            'uid': 'P1',
+            'name': 'Photo',
+            'filename': 'P1.jpg',
+            'order_flag': 0,
+            'recipe_uid': 'R1',
+            'hash': 'photohash',
+            'deleted': False,
+        }
+    ],
+    Recipe: [
+        {
+            'uid': 'R1',
+            'name': 'Recipe',
+            'hash': 'recipehash',
+            'photo': None,
+            'photo_hash': None,
+            'in_trash': False,
+        }
+    ],
+}
+
+
+def _downgrade():
+    # the schema before the data was copied to columns
+    conn = db.session.connection()
+    conn.execute("UPDATE photos SET image_data = ''")
+    conn.execute('ALTER TABLE photos ALTER COLUMN image_data SET NOT NULL')
+    for cls in DATA:
+        table = cls.__tablename__
+        columns = ['digest', 'uid', 'hash']
+        if cls is Photo:
+            columns.append('recipe_uid')
+        for name in columns:
+            conn.execute(f'ALTER TABLE {table} DROP COLUMN {name}')
+        conn.execute(
+            f'CREATE UNIQUE INDEX ix_uq_{table}_user_id_data '
+            f"ON {table} (user_id, (data->>'uid'))"
+        )
+    db.session.commit()
+
+
+def test_migrate_columns(app, user):
+    for cls, data in DATA.items():
+        cls._sync(user, cls.__tablename__, data)
+    db.session.commit()
+    _downgrade()
+
+    result = app.test_cli_runner().invoke(migrate_columns)
+    assert result.exit_code == 0, result.output
+    # running it again does no harm
+    result = app.test_cli_runner().invoke(migrate_columns)
+    assert result.exit_code == 0, result.output
+
+    inspector = inspect(db.engine)
+    photo_columns = {c['name']: c for c in inspector.get_columns('photos')}
+    assert photo_columns['image_data']['nullable']
+    for cls, data in DATA.items():
+        indexes = {i['name'] for i in inspector.get_indexes(cls.__tablename__)}
+        assert {i.name for i in cls.__table__.indexes} <= indexes
+        assert f'ix_uq_{cls.__tablename__}_user_id_data' not in indexes
+        (obj,) = cls.query.all()
+        assert obj.uid == data[0]['uid']
+        assert obj.hash == data[0].get('hash')
+        assert obj.digest == cls._digest(data[0])
+        # so the first refresh does not see any changes
+        assert cls._sync(user, cls.__tablename__, data) == (set(), set(), set())
+    assert Photo.query.one().recipe_uid == 'R1'
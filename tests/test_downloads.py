@@ -0,0 +1,94 @@
+from threading import Event, Thread
+
+import pytest
+import requests
+
+from paprikasync import downloads, paprika
+from paprikasync.downloads import ByteBudget, DownloadAborted, PhotoDownloader
+from paprikasync.streaming import CHUNK_SIZE
+
+
+def test_byte_budget():
+    budget = ByteBudget(100)
+    budget.acquire(60)
+    acquired = Event()
+    thread = Thread(target=lambda: (budget.acquire(60), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.2)
+    budget.release(60)
+    thread.join(1)
+    assert acquired.is_set()
+    budget.release(60)
+    # larger than the whole budget, but nothing else is held
+    budget.acquire(200)
+    abort = Event()
+    abort.set()
+    with pytest.raises(DownloadAborted):
+        budget.acquire(1, abort=abort)
+    budget.release(200)
+    assert budget.used == 0
+
+
+def _partner(mock_paprika, photos=4):
+    account = mock_paprika.add_account(
+        'partner@example.com', recipes=photos, photos_per_recipe=1
+    )
+    expected = {
+        uid: mock_paprika.image_data(account, f'photo/{uid}', photo['hash'])
+        for uid, photo in account.photos.items()
+    }
+    return account, expected
+
+
+def test_download(mock_paprika):
+    account, expected = _partner(mock_paprika)
+    with paprika.PaprikaClient(account.token) as client:
+        downloader = PhotoDownloader(client, jobs=2)
+        downloaded = {}
+        for download in downloader.download(expected):
+            assert 'photo_url' not in download.data
+            assert downloader.budget.used >= len(download.image_data)
+            downloaded[download.uid] = download.image_data
+    assert downloaded == expected
+    assert downloader.budget.used == 0
+
+
+def test_download_without_length(mock_paprika, monkeypatch):
+    monkeypatch.setattr(mock_paprika, 'photo_size', 3 * CHUNK_SIZE + 1)
+    monkeypatch.setattr(downloads, 'UNKNOWN_SIZE', CHUNK_SIZE)
+    account, expected = _partner(mock_paprika, photos=2)
+    with paprika.PaprikaClient(account.token) as client:
+        downloader = PhotoDownloader(client, jobs=1)
+        get = client.get
+
+        def chunked_get(*args, **kwargs):
+            resp = get(*args, **kwargs)
+            if kwargs.get('stream'):
+                del resp.headers['Content-Length']
+                iter_content = resp.iter_content
+
+                def checked_iter_content(chunk_size):
+                    held = 0
+                    for chunk in iter_content(chunk_size):
+                        # the bytes received so far are charged to the budget
+                        assert downloader.budget.used >= max(held, CHUNK_SIZE)
+                        yield chunk
+                        held += len(chunk)
+                    assert downloader.budget.used >= held
+
+                resp.iter_content = checked_iter_content
+            return resp
+
+        client.get = chunked_get
+        downloaded = {d.uid: d.image_data for d in downloader.download(expected)}
+    assert downloaded == expected
+    assert downloader.budget.used == 0
+
+
+def test_download_failure(mock_paprika):
+    account, expected = _partner(mock_paprika)
+    with paprika.PaprikaClient(account.token) as client:
+        downloader = PhotoDownloader(client, jobs=2)
+        with pytest.raises(requests.HTTPError):
+            list(downloader.download(['missing', *expected]))
+    assert downloader.budget.used == 0
@@ -0,0 +1,130 @@
+from io import BytesIO
+
+import pytest
+
+from paprikasync.blobs import FileBlobStore, get_blob_store
+from paprikasync.img import IMAGE_MAX_AGE
+from paprikasync.models import Photo, Recipe, db
+from paprikasync.thumbnails import ThumbnailGenerator
+
+
+@pytest.fixture
+def images(paprika_account, mock_paprika):
+    account = paprika_account
+    recipe = Recipe.query.filter(Recipe.data['photo'].astext.isnot(None)).first()
+    photo = Photo.query.first()
+    recipe_data = account.recipes[recipe.uid]
+    photo_data = account.photos[photo.uid]
+    return {
+        'recipe': (
+            f'/image/recipe/{recipe.id}/photo/{recipe.image_key}/'
+            f'{recipe.data["photo"]}',
+            recipe.image_key,
+            mock_paprika.image_data(
+                account, f'recipe/{recipe.uid}', recipe_data['photo_hash']
+            ),
+        ),
+        'photo': (
+            f'/image/recipe/{photo.recipe.id}/photos/{photo.id}/{photo.hash}/'
+            f'{photo.data["filename"]}',
+            photo.hash,
+            mock_paprika.image_data(account, f'photo/{photo.uid}', photo_data['hash']),
+        ),
+    }
+
+
+@pytest.mark.parametrize('kind', ['recipe', 'photo'])
+def test_image(app, images, kind):
+    url, key, expected = images[kind]
+    resp = app.test_client().get(url)
+    assert resp.status_code == 200
+    assert resp.data == expected
+    assert resp.mimetype == 'image/jpeg'
+    assert resp.get_etag() == (key, False)
+    assert resp.cache_control.immutable
+    assert resp.cache_control.max_age == IMAGE_MAX_AGE
+    assert not resp.cache_control.no_cache
+
+
+@pytest.mark.parametrize('kind', ['recipe', 'photo'])
+def test_image_not_modified(app, images, kind, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('image loaded')
+
+    monkeypatch.setattr(FileBlobStore, 'get', fail)
+    monkeypatch.setattr(FileBlobStore, 'send', fail)
+    url, key, __ = images[kind]
+    resp = app.test_client().get(url, headers={'If-None-Match': f'"{key}"'})
+    assert resp.status_code == 304
+    assert resp.get_etag() == (key, False)
+    assert resp.cache_control.immutable
+
+
+@pytest.mark.parametrize('kind', ['recipe', 'photo'])
+def test_image_wrong_url(app, images, kind):
+    url, key, __ = images[kind]
+    client = app.test_client()
+    assert client.get(url.replace(key, 'OTHER')).status_code == 404
+    assert client.get(f'{url}x').status_code == 404
+    # the url is checked before the etag
+    resp = client.get(url.replace(key, 'OTHER'), headers={'If-None-Match': '"OTHER"'})
+    assert resp.status_code == 404
+
+
+def test_image_from_database(app, images):
+    url, key, expected = images['photo']
+    photo = Photo.query.filter_by(hash=key).one()
+    photo.image_data = b'from the database'
+    db.session.commit()
+    get_blob_store().delete(key)
+    resp = app.test_client().get(url)
+    assert resp.status_code == 200
+    assert resp.data == b'from the database'
+    assert resp.get_etag() == (key, False)
+
+
+def _jpeg(width, height):
+    Image = pytest.importorskip('PIL.Image')
+    buf = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('kind', ['recipe', 'photo'])
+def test_image_variant(app, images, kind):
+    url, key, __ = images[kind]
+    store = get_blob_store()
+    store.delete(key)
+    store.put(key, _jpeg(800, 600))
+    client = app.test_client()
+    resp = client.get(f'{url}?size=320&format=webp')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/webp'
+    assert resp.get_etag() == (f'{key}-320.webp', False)
+    assert resp.cache_control.immutable
+    assert store.exists(f'{key}-320.webp')
+    resp = client.get(f'{url}?size=160')
+    assert resp.mimetype == 'image/jpeg'
+    assert resp.get_etag() == (f'{key}-160', False)
+    assert resp.data == store.get(f'{key}-160')
+    resp = client.get(f'{url}?size=160', headers={'If-None-Match': f'"{key}-160"'})
+    assert resp.status_code == 304
+
+
+def test_image_variant_unavailable(app, images):
+    url, key, expected = images['recipe']
+    app.extensions['paprikasync_thumbnails'] = ThumbnailGenerator(get_blob_store())
+    app.extensions['paprikasync_thumbnails'].enabled = False
+    resp = app.test_client().get(f'{url}?size=320')
+    assert resp.status_code == 200
+    assert resp.data == expected
+    # the original must not be cached as the variant
+    assert resp.cache_control.no_cache
+    assert not resp.cache_control.immutable
+
+
+def test_image_variant_invalid(app, images):
+    url, __, __ = images['recipe']
+    client = app.test_client()
+    assert client.get(f'{url}?size=321').status_code == 422
+    assert client.get(f'{url}?size=320&format=gif').status_code == 422
@@ -0,0 +1,48 @@
+from paprikasync.journal import SyncJournal
+
+
+def test_resume(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    with SyncJournal(path).open() as journal:
+        journal.recipe_started('r1')
+        journal.recipe_done('r1', 'h1')
+        journal.photo_done('p1', 'ph1')
+        journal.recipe_started('r2')
+        journal.partner_done('alice', {'recipes': 3})
+    # a crash in the middle of writing an entry
+    with path.open('a') as f:
+        f.write('{"kind":"recipe","uid":"r3"')
+
+    journal = SyncJournal(path)
+    assert journal.exists
+    journal.open(resume=True)
+    assert journal.modified
+    assert journal.is_recipe_done('r1', 'h1')
+    assert not journal.is_recipe_done('r1', 'changed')
+    assert not journal.is_recipe_done('r3', 'h3')
+    assert journal.is_photo_done('p1', 'ph1')
+    assert journal.is_recipe_interrupted('r2')
+    assert not journal.is_recipe_interrupted('r1')
+    assert journal.get_partner_status('alice') == {'recipes': 3}
+    assert journal.get_partner_status('bob') is None
+    # new entries are appended to what we loaded
+    journal.recipe_done('r2', 'h2')
+    journal.close()
+
+    journal = SyncJournal(path).open(resume=True)
+    assert journal.is_recipe_done('r1', 'h1')
+    assert journal.is_recipe_done('r2', 'h2')
+    assert not journal.is_recipe_interrupted('r2')
+    journal.discard()
+    assert not path.exists()
+
+
+def test_start_over(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    with SyncJournal(path).open() as journal:
+        journal.recipe_done('r1', 'h1')
+    journal = SyncJournal(path).open(resume=False)
+    assert not journal.modified
+    assert not journal.is_recipe_done('r1', 'h1')
+    journal.close()
+    assert not SyncJournal(path).exists
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from paprikasync import paprika
+from paprikasync.metrics import HttpMetrics, endpoint_name
+
+API_BASE = 'https://www.paprikaapp.com/api/v2'
+UID = '0A1B2C3D-4E5F-6071-8293-A4B5C6D7E8F9'
+
+
+@pytest.mark.parametrize(
+    'url, expected',
+    [
+        (f'{API_BASE}/sync/recipes/', 'GET /sync/recipes/'),
+        (f'{API_BASE}/sync/recipe/{UID}/', 'GET /sync/recipe/<uid>/'),
+        (f'{API_BASE}/sync/photo/{UID.lower()}/?x=1', 'GET /sync/photo/<uid>/'),
+        (
+            f'https://bucket.s3.amazonaws.com/{UID}.jpg',
+            'GET photo download (bucket.s3.amazonaws.com)',
+        ),
+    ],
+)
+def test_endpoint_name(url, expected):
+    assert endpoint_name(API_BASE, 'GET', url) == expected
+
+
+def test_record():
+    metrics = HttpMetrics(API_BASE + '/')
+    url = f'{API_BASE}/sync/recipe/{UID}/'
+    metrics.record('GET', url, elapsed=0.02, status=200, bytes_in=100)
+    metrics.record('GET', url, elapsed=0.2, status=503)
+    metrics.record('GET', url, elapsed=99, status=None, retry=True)
+    metrics.record('POST', url, elapsed=0.001, status=200, bytes_out=5)
+    stats = metrics.to_dict()
+    assert list(stats) == ['GET /sync/recipe/<uid>/', 'POST /sync/recipe/<uid>/']
+    get = stats['GET /sync/recipe/<uid>/']
+    assert (get['calls'], get['retries'], get['errors']) == (3, 1, 2)
+    assert get['bytes_in'] == 100
+    assert get['histogram']['0.025'] == 1
+    assert get['histogram']['0.25'] == 1
+    assert get['histogram']['inf'] == 1
+    assert get['p50'] == 0.25
+    # in the overflow bucket
+    assert get['p95'] is None
+    assert stats['POST /sync/recipe/<uid>/']['bytes_out'] == 5
+    header, *rows = metrics.report()
+    assert header.split()[:2] == ['endpoint', 'calls']
+    # slowest first
+    assert rows[0].startswith('GET /sync/recipe/<uid>/')
+    assert '>60s' in rows[0]
+
+
+def test_client_metrics(mock_paprika):
+    partner = mock_paprika.add_account(
+        'partner@example.com', recipes=1, photos_per_recipe=1
+    )
+    metrics = HttpMetrics(paprika.API_BASE)
+    with paprika.PaprikaClient(partner.token, metrics=metrics) as client:
+        photos = paprika.get_photos(client)
+        (photo,) = [p for recipe_photos in photos.values() for p in recipe_photos]
+        photo = paprika.get_photo(client, photo.uid)
+        data = client.get(photo.photo_url, auth=False).content
+    stats = metrics.to_dict()
+    assert stats['GET /sync/photos/']['calls'] == 1
+    assert stats['GET /sync/photo/<uid>/']['calls'] == 1
+    (download,) = [v for k, v in stats.items() if 'photo download' in k]
+    assert download['bytes_in'] == len(data)
+
+
+def test_async_client_metrics(mock_paprika, no_backoff):
+    aiohttp = pytest.importorskip('aiohttp')
+    from paprikasync.paprika_async import AsyncPaprikaClient
+
+    partner = mock_paprika.add_account('partner@example.com', recipes=2)
+    metrics = HttpMetrics(paprika.API_BASE)
+
+    async def run():
+        async with AsyncPaprikaClient(
+            partner.token, max_retries=1, metrics=metrics
+        ) as client:
+            mock_paprika.faults.error_rate = 1
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.get_recipe_list()
+            mock_paprika.faults.error_rate = 0
+            return await client.get_recipe_list()
+
+    assert len(asyncio.run(run())) == 2
+    stats = metrics.to_dict()['GET /sync/recipes/']
+    assert (stats['calls'], stats['retries'], stats['errors']) == (3, 1, 2)
+    assert stats['bytes_in'] > 0
@@ -0,0 +1,201 @@
+from sqlalchemy import event
+from sqlalchemy.sql.expression import Insert
+
+from paprikasync import paprika
+from paprikasync.blobs import get_blob_store
+from paprikasync.models import Category, Photo, Recipe, User, db
+
+
+def _category(uid, name, order_flag=0):
+    return {
+        'uid': uid,
+        'name': name,
+        'order_flag': order_flag,
+        'parent_uid': None,
+        'deleted': False,
+    }
+
+
+def _names(user):
+    query = Category.query.filter_by(user_id=user.id).order_by(Category.uid)
+    return {c.uid: c.name for c in query}
+
+
+def test_sync(user):
+    other = User(name='Bob', email='bob@example.com', password='x', paprika_token='y')
+    db.session.add(other)
+    Category._sync(other, 'categories', [_category('A', 'Other A')])
+
+    added, updated, deleted = Category._sync(
+        user, 'categories', [_category('A', 'a'), _category('B', 'b')]
+    )
+    assert {c.uid for c in added} == {'A', 'B'}
+    assert not updated and not deleted
+    assert _names(user) == {'A': 'a', 'B': 'b'}
+
+    # unchanged rows are neither fetched nor written
+    fetched = []
+
+    def get_data(data):
+        fetched.append(data['uid'])
+        return data
+
+    new = [_category('A', 'a'), _category('B', 'b2'), _category('C', 'c')]
+    added, updated, deleted = Category._sync(user, 'categories', new, get_data)
+    assert sorted(fetched) == ['B', 'C']
+    assert {c.uid for c in added} == {'C'}
+    assert {(c.uid, c.name) for c in updated} == {('B', 'b2')}
+    assert not deleted
+    assert _names(user) == {'A': 'a', 'B': 'b2', 'C': 'c'}
+
+    added, updated, deleted = Category._sync(user, 'categories', [new[1]])
+    assert not added and not updated
+    assert {(c.uid, c.name) for c in deleted} == {('A', 'a'), ('C', 'c')}
+    assert _names(user) == {'B': 'b2'}
+    # the rows are gone from the session as well
+    assert [c.uid for c in user.categories] == ['B']
+    # other users are not affected
+    assert _names(other) == {'A': 'Other A'}
+    db.session.commit()
+
+
+def test_sync_chunks(user, monkeypatch, request):
+    from paprikasync import models
+
+    monkeypatch.setattr(models, 'SYNC_CHUNK_SIZE', 2)
+    inserts = []
+
+    def before_execute(conn, clauseelement, multiparams, params):
+        if isinstance(clauseelement, Insert):
+            if clauseelement.table is Category.__table__:
+                inserts.append(clauseelement)
+
+    event.listen(db.engine, 'before_execute', before_execute)
+    request.addfinalizer(
+        lambda: event.remove(db.engine, 'before_execute', before_execute)
+    )
+    new = [_category(f'U{i}', f'c{i}', i) for i in range(5)]
+    added, __, __ = Category._sync(user, 'categories', new)
+    assert len(added) == 5
+    assert len(inserts) == 3
+    new[4]['name'] = 'changed'
+    __, updated, deleted = Category._sync(user, 'categories', new[1:])
+    assert [c.name for c in updated] == ['changed']
+    assert [c.uid for c in deleted] == ['U0']
+    assert len(_names(user)) == 4
+
+
+def _recipe_images(mock_paprika, account):
+    return {
+        recipe['photo_hash']: mock_paprika.image_data(
+            account, f'recipe/{uid}', recipe['photo_hash']
+        )
+        for uid, recipe in account.recipes.items()
+        if recipe['photo']
+    }
+
+
+def test_recipe_sync(app, user, mock_paprika, monkeypatch):
+    account = mock_paprika.add_account('alice@example.com', recipes=8)
+    monkeypatch.setitem(app.config, 'PAPRIKASYNC_SYNC_JOBS', 4)
+    mock_paprika.faults.latency = 0.05
+    fetched = []
+    active = []
+    max_active = 0
+    get_recipe_raw = paprika.get_recipe_raw
+
+    def counting_get_recipe_raw(client, uid):
+        nonlocal max_active
+        active.append(uid)
+        max_active = max(max_active, len(active))
+        try:
+            fetched.append(uid)
+            return get_recipe_raw(client, uid)
+        finally:
+            active.remove(uid)
+
+    monkeypatch.setattr(paprika, 'get_recipe_raw', counting_get_recipe_raw)
+    with paprika.PaprikaClient(account.token) as client:
+        added, updated, deleted = Recipe.sync(user, client)
+        assert {r.uid for r in added} == set(account.recipes)
+        assert not updated and not deleted
+        # the details and photos are fetched concurrently
+        assert 1 < max_active <= 4
+        store = get_blob_store()
+        images = _recipe_images(mock_paprika, account)
+        assert images
+        assert {key: store.get(key) for key in images} == images
+        for recipe in added:
+            assert (
+                recipe.data['directions'] == account.recipes[recipe.uid]['directions']
+            )
+        # only changed recipes are fetched again
+        uid, gone = list(account.recipes)[:2]
+        account.recipes[uid] = dict(account.recipes[uid], name='Changed', hash='X')
+        del account.recipes[gone]
+        fetched.clear()
+        added, updated, deleted = Recipe.sync(user, client)
+    assert fetched == [uid]
+    assert not added
+    assert [(r.uid, r.name) for r in updated] == [(uid, 'Changed')]
+    assert [r.uid for r in deleted] == [gone]
+    db.session.commit()
+
+
+def test_photo_sync(app, user, mock_paprika):
+    account = mock_paprika.add_account(
+        'alice@example.com', recipes=3, photos_per_recipe=2
+    )
+    store = get_blob_store()
+    downloads = 'GET /s3/<token>/<kind>/<uid>'
+    with paprika.PaprikaClient(account.token) as client:
+        added, __, __ = Photo.sync(user, client)
+        assert {p.uid for p in added} == set(account.photos)
+        for photo in added:
+            expected = mock_paprika.image_data(
+                account, f'photo/{photo.uid}', photo.hash
+            )
+            assert store.get(photo.image_key) == expected
+        assert mock_paprika.stats.by_endpoint[downloads] == 6
+
+        # a new image has a new hash and is downloaded again
+        uid = next(iter(account.photos))
+        account.photos[uid] = dict(account.photos[uid], hash='NEWHASH')
+        mock_paprika.reset_stats()
+        __, updated, __ = Photo.sync(user, client)
+    assert [p.uid for p in updated] == [uid]
+    assert mock_paprika.stats.by_endpoint[downloads] == 1
+    assert store.get('NEWHASH') == mock_paprika.image_data(
+        account, f'photo/{uid}', 'NEWHASH'
+    )
+    db.session.commit()
+
+
+def test_recipe_photos(user, paprika_account):
+    other = User(name='Bob', email='bob@example.com', password='x', paprika_token='y')
+    db.session.add(other)
+    recipe = Recipe.query.filter_by(user=user).first()
+    # another user with a copy of the same recipe and photo
+    for photo in Photo.query.filter_by(user=user):
+        db.session.add(
+            Photo(user=other, data=photo.data, **Photo._data_columns(photo.data))
+        )
+    db.session.commit()
+    db.session.expire_all()
+
+    recipe = Recipe.query.get(recipe.id)
+    # loaded lazily unless asked for
+    assert 'photos' not in recipe.__dict__
+    expected = {
+        uid
+        for uid, photo in paprika_account.photos.items()
+        if photo['recipe_uid'] == recipe.uid
+    }
+    assert {p.uid for p in recipe.photos} == expected
+    assert all(p.user == user and p.recipe is recipe for p in recipe.photos)
+    # a plain join on the copied columns, not the json data
+    assert 'data' not in str(Recipe.photos.property.primaryjoin)
+    photo = recipe.photos[0]
+    assert recipe.get_photo(photo.id) is photo
+    other_photo = Photo.query.filter_by(user=other, uid=photo.uid).one()
+    assert recipe.get_photo(other_photo.id) is None
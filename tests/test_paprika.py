@@ -0,0 +1,128 @@
+from unittest import mock
+
+import pytest
+import requests
+from requests.exceptions import ChunkedEncodingError, InvalidURL
+
+from paprikasync import paprika
+from paprikasync.metrics import HttpMetrics
+
+
+def _response(status=200, content=b'{}'):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = content
+    resp._content_consumed = True
+    return resp
+
+
+@pytest.mark.parametrize('exc', [ChunkedEncodingError, InvalidURL, RuntimeError])
+def test_limiter_released_after_any_error(mock_paprika, exc):
+    account = mock_paprika.add_account('own@example.com')
+    limiter = paprika.RateLimiter(None, max_concurrency=1)
+    with paprika.PaprikaClient(account.token, limiter=limiter, max_retries=0) as client:
+        with mock.patch.object(client.session, 'request', side_effect=exc):
+            with pytest.raises(exc):
+                paprika.get_sync_status(client)
+        assert limiter._in_flight == 0
+        # with a leaked slot this would block forever
+        assert paprika.get_sync_status(client).recipes == 1
+        assert limiter._in_flight == 0
+
+
+def test_chunked_encoding_error_retried(no_backoff):
+    client = paprika.PaprikaClient('token')
+    side_effect = [ChunkedEncodingError(), _response()]
+    with mock.patch.object(client.session, 'request', side_effect=side_effect) as m:
+        assert client.get('http://example.com/').status_code == 200
+    assert m.call_count == 2
+    assert client.limiter._in_flight == 0
+
+
+def test_server_errors_retried(mock_paprika, no_backoff):
+    account = mock_paprika.add_account('own@example.com')
+    mock_paprika.faults.error_rate = 1
+    metrics = HttpMetrics(paprika.API_BASE)
+    with paprika.PaprikaClient(account.token, max_retries=2, metrics=metrics) as client:
+        resp = client.get(paprika.SYNC_STATUS_URL)
+    assert resp.status_code == 503
+    assert mock_paprika.stats.requests == 3
+    stats = metrics.endpoints['GET /sync/status/']
+    assert (stats.calls, stats.retries, stats.errors) == (3, 2, 3)
+
+
+def test_limiter_aimd():
+    limiter = paprika.RateLimiter(None, max_concurrency=8, cooldown=0)
+    limiter.feedback(failed=True)
+    assert limiter.limit == 4
+    limiter.feedback(failed=True)
+    assert limiter.limit == 2
+    for __ in range(20):
+        limiter.feedback(failed=False)
+    assert 2 < limiter.limit <= 8
+    for __ in range(1000):
+        limiter.feedback(failed=False)
+    assert limiter.limit == 8
+
+
+def test_limiter_cooldown():
+    limiter = paprika.RateLimiter(None, max_concurrency=8, cooldown=60)
+    limiter.feedback(failed=True)
+    limiter.feedback(failed=True)
+    # a burst of failures only counts once
+    assert limiter.limit == 4
+
+
+@pytest.mark.parametrize(
+    'value, expected',
+    [
+        ('3', 3),
+        ('-1', 0),
+        ('86400', paprika.RETRY_AFTER_MAX),
+        ('Wed, 21 Oct 2015 07:28:00 GMT', 0),
+        ('Wed, 21 Oct 2099 07:28:00 GMT', paprika.RETRY_AFTER_MAX),
+        ('soon', None),
+    ],
+)
+def test_retry_after(value, expected):
+    assert paprika._retry_after({'Retry-After': value}) == expected
+
+
+def test_retry_after_capped(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(paprika.time, 'sleep', sleeps.append)
+    client = paprika.PaprikaClient('token', max_retries=1)
+    throttled = _response(429)
+    throttled.headers['Retry-After'] = '86400'
+    side_effect = [throttled, _response()]
+    with mock.patch.object(client.session, 'request', side_effect=side_effect):
+        assert client.get('http://example.com/').status_code == 200
+    assert sleeps and max(sleeps) <= paprika.RETRY_AFTER_MAX
+
+
+def test_client_repr_masks_token():
+    token = 'a1b2c3d4e5f6'
+    assert token not in repr(paprika.PaprikaClient(token))
+
+
+def test_client_reuses_connections(mock_paprika):
+    account = mock_paprika.add_account('own@example.com', recipes=3)
+    with paprika.PaprikaClient(account.token) as client:
+        recipes = paprika.get_recipe_list(client)
+        for item in recipes:
+            assert paprika.get_recipe(client, item.uid).uid == item.uid
+        assert len(client.session.adapters['http://'].poolmanager.pools) == 1
+
+
+def test_token_or_client(mock_paprika):
+    account = mock_paprika.add_account('own@example.com', recipes=1)
+    close = paprika.PaprikaClient.close
+    with mock.patch.object(
+        paprika.PaprikaClient, 'close', autospec=True, side_effect=close
+    ) as m:
+        # a temporary client is closed right away
+        assert paprika.get_sync_status(account.token).recipes == 1
+        assert m.call_count == 1
+        with paprika.PaprikaClient(account.token) as client:
+            assert paprika.get_sync_status(client).recipes == 1
+            assert m.call_count == 1
@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+
+import pytest
+
+from paprikasync.pipeline import Done, Pipeline, Stage
+
+
+def _sleepy(func):
+    def wrapper(value):
+        time.sleep(random.uniform(0, 0.005))
+        return func(value)
+
+    return wrapper
+
+
+def test_results_in_order():
+    stages = [
+        Stage('double', _sleepy(lambda x: x * 2), workers=4),
+        Stage('inc', _sleepy(lambda x: x + 1), workers=3),
+    ]
+    with Pipeline(stages, queue_size=2) as pipeline:
+        results = [f.result() for f in pipeline.map(range(50))]
+    assert results == [x * 2 + 1 for x in range(50)]
+    assert [s.items for s in pipeline.stats] == [50, 50]
+
+
+def test_done_and_errors():
+    def first(x):
+        if x == 1:
+            return Done('skipped')
+        if x == 2:
+            raise ValueError(x)
+        return x
+
+    seen = []
+    stages = [Stage('first', first), Stage('second', seen.append)]
+    with Pipeline(stages) as pipeline:
+        futures = list(pipeline.map(range(4)))
+        assert futures[1].result() == 'skipped'
+        with pytest.raises(ValueError):
+            futures[2].result()
+        futures[3].result()
+    assert seen == [0, 3]
+
+
+def test_abort():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(x):
+        started.set()
+        release.wait(5)
+        return x
+
+    pipeline = Pipeline([Stage('slow', slow)], queue_size=1)
+    with pytest.raises(RuntimeError):
+        with pipeline:
+            futures = pipeline.map(range(1000))
+            first = next(futures)
+            started.wait(5)
+            release.set()
+            raise RuntimeError
+    # the context manager aborted and joined all workers
+    assert not any(t.is_alive() for t in pipeline._threads)
+    assert first.done()
+    rest = list(futures)
+    assert len(rest) < 999
+    assert all(f.cancelled() for f in rest[2:])
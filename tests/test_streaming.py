@@ -0,0 +1,90 @@
+from io import BytesIO
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from paprikasync import paprika
+from paprikasync.cache import PhotoCache
+from paprikasync.streaming import MultipartBody, PhotoSource
+
+
+def _parse(body: MultipartBody, data: bytes) -> Request:
+    builder = EnvironBuilder(
+        method='POST',
+        input_stream=BytesIO(data),
+        content_type=body.content_type,
+        content_length=len(data),
+    )
+    return Request(builder.get_environ())
+
+
+def _partner_photo(mock_paprika):
+    account = mock_paprika.add_account(
+        'partner@example.com', recipes=1, photos_per_recipe=1
+    )
+    uid = next(iter(account.photos))
+    with paprika.PaprikaClient(account.token) as client:
+        photo = paprika.get_photo(client, uid)
+    expected = mock_paprika.image_data(account, f'photo/{uid}', photo.hash)
+    return photo, expected
+
+
+def test_multipart_body():
+    parts = [('data', 'data', b'{"uid": "x"}'), ('photo', 'a "b".jpg', b'\xff' * 10)]
+    with MultipartBody(parts) as body:
+        data = body.read()
+        assert len(body) == len(data)
+        assert body.read() == b''
+    request = _parse(body, data)
+    assert request.files['data'].read() == b'{"uid": "x"}'
+    assert request.files['photo'].read() == b'\xff' * 10
+
+
+def test_photo_source_reopened(mock_paprika):
+    photo, expected = _partner_photo(mock_paprika)
+    mock_paprika.reset_stats()
+    with paprika.PaprikaClient() as client:
+        source = PhotoSource(client, photo.photo_url)
+        with MultipartBody([('photo', 'photo.jpg', source)]) as body:
+            first = body.read(100) + body.read()
+            body.seek(0)
+            second = body.read()
+    assert first == second
+    assert len(body) == 0
+    assert _parse(body, first).files['photo'].read() == expected
+    # every attempt downloads the photo again
+    assert mock_paprika.stats.requests == 2
+
+
+def test_photo_source_cached(mock_paprika, tmp_path):
+    photo, expected = _partner_photo(mock_paprika)
+    cache = PhotoCache(tmp_path)
+    mock_paprika.reset_stats()
+    with paprika.PaprikaClient() as client:
+        for __ in range(2):
+            source = PhotoSource(client, photo.photo_url, cache=cache, hash=photo.hash)
+            size, fileobj = source.open()
+            assert size == len(expected)
+            assert fileobj.read() == expected
+            source.close()
+    assert mock_paprika.stats.requests == 1
+    assert cache.get_path(photo.hash).read_bytes() == expected
+
+
+def test_photo_source_without_length(mock_paprika):
+    photo, expected = _partner_photo(mock_paprika)
+    with paprika.PaprikaClient() as client:
+        get = client.get
+
+        def chunked_get(*args, **kwargs):
+            resp = get(*args, **kwargs)
+            del resp.headers['Content-Length']
+            return resp
+
+        client.get = chunked_get
+        source = PhotoSource(client, photo.photo_url)
+        size, fileobj = source.open()
+        # spooled, so the size is known before the upload starts
+        assert size == len(expected)
+        assert fileobj.read() == expected
+        source.close()
@@ -0,0 +1,120 @@
+from unittest import mock
+
+import pytest
+
+from paprikasync import paprika
+from paprikasync.config import Partner
+from paprikasync.sync import (
+    PARTNER_STATUS_KEYS,
+    OwnAccount,
+    do_sync,
+    get_sync_changes,
+    plan_sync_categories,
+    sync_partners,
+)
+
+
+def test_photos_not_uploaded_after_failure(mock_paprika):
+    partner = mock_paprika.add_account(
+        'partner@example.com', recipes=12, photos_per_recipe=1, seed=1
+    )
+    own = mock_paprika.add_account('own@example.com')
+    save = paprika.Photo.save
+    calls = []
+
+    def failing_save(photo, *args, **kwargs):
+        calls.append(photo.uid)
+        if len(calls) == 3:
+            raise paprika.RequestFailed('injected')
+        return save(photo, *args, **kwargs)
+
+    with paprika.PaprikaClient(own.token) as client, mock.patch.object(
+        paprika.Photo, 'save', failing_save
+    ):
+        with pytest.raises(paprika.RequestFailed):
+            do_sync(
+                client,
+                Partner('partner', partner.token),
+                stage_jobs={'photos': 1},
+                echo=lambda msg: None,
+            )
+    assert len(calls) == 3
+    assert len(own.photos) == 2
+
+
+def _status(**kwargs):
+    return paprika.SyncStatus(**{'recipes': 1, 'photos': 1, 'categories': 1, **kwargs})
+
+
+def test_sync_changes():
+    partner = Partner('partner', 'token')
+    assert get_sync_changes(partner, _status(), _status()) == PARTNER_STATUS_KEYS
+    partner.sync_status = _status().to_dict()
+    partner.own_sync_status = _status().to_dict()
+    assert get_sync_changes(partner, _status(), None) == PARTNER_STATUS_KEYS
+    assert get_sync_changes(partner, _status(), _status()) == set()
+    assert get_sync_changes(partner, _status(photos=2), _status()) == {'photos'}
+    # unrelated parts of the partner's account do not matter
+    assert get_sync_changes(partner, _status(meals=5), _status()) == set()
+    # our own recipes or categories changing may require syncing again
+    own_status = _status(categories=2)
+    assert get_sync_changes(partner, _status(), own_status) == PARTNER_STATUS_KEYS
+    update = get_sync_changes(partner, _status(), _status(), update=True)
+    assert update == PARTNER_STATUS_KEYS
+
+
+def test_parallel_partners(mock_paprika):
+    alice = mock_paprika.add_account(
+        'alice@example.com', recipes=4, photos_per_recipe=1, seed=1
+    )
+    bob = mock_paprika.add_account(
+        'bob@example.com', recipes=4, photos_per_recipe=1, seed=2
+    )
+    # partners sharing a recipe (e.g. synced from each other)
+    shared = next(iter(alice.recipes.values()))
+    bob.recipes[shared['uid']] = dict(shared)
+    own = mock_paprika.add_account('own@example.com')
+    partners = [Partner('alice', alice.token), Partner('bob', bob.token)]
+    with paprika.PaprikaClient(own.token) as client:
+        statuses = sync_partners(client, partners, parallel=2)
+    assert statuses['alice'].recipes == alice.status['recipes']
+    assert statuses['bob'].recipes == bob.status['recipes']
+    assert set(own.recipes) == set(alice.recipes) | set(bob.recipes)
+    assert len(own.photos) == 8
+    requests = mock_paprika.stats.by_endpoint
+    # the shared recipe is only uploaded once, and our own account's
+    # recipes are only listed once
+    assert requests['POST /api/v2/sync/recipe/<uid>/'] == 8
+    assert requests['GET /api/v2/sync/recipes/'] == 3
+    assert requests['POST /api/v2/sync/notify/'] == 1
+
+
+def test_plan_sync_categories():
+    root = paprika.Category('Sync', 0, uid='ROOT')
+    alice = paprika.Category('alice', 0, parent_uid='ROOT', uid='ALICE')
+    other = paprika.Category('alice', 1, uid='OTHER')
+    partners = [Partner('alice', 'a'), Partner('bob', 'b')]
+    sync_cats, missing = plan_sync_categories([root, alice, other], partners)
+    assert sync_cats['alice'] is alice
+    assert [c.name for c in missing] == ['bob']
+    assert sync_cats['bob'] is missing[0]
+    assert missing[0].parent_uid == 'ROOT'
+    assert missing[0].order_flag > other.order_flag
+
+
+def test_categories_created_together(mock_paprika):
+    alice = mock_paprika.add_account('alice@example.com', recipes=1)
+    bob = mock_paprika.add_account('bob@example.com', recipes=1)
+    own = mock_paprika.add_account('own@example.com', categories=2)
+    partners = [Partner('alice', alice.token), Partner('bob', bob.token)]
+    with paprika.PaprikaClient(own.token) as client:
+        sync_partners(client, partners, own=OwnAccount(client, partners=partners))
+    assert mock_paprika.stats.by_endpoint['POST /api/v2/sync/categories/'] == 1
+    categories = {c['uid']: c for c in own.categories.values()}
+    (root,) = [c for c in categories.values() if c['name'] == 'Sync']
+    children = {c['name'] for c in categories.values() if c['parent_uid']}
+    assert children == {'alice', 'bob'}
+    assert root['parent_uid'] is None
+    for recipe in own.recipes.values():
+        (uid,) = recipe['categories']
+        assert categories[uid]['parent_uid'] == root['uid']
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from paprikasync.config import Partner
+
+pytest.importorskip('aiohttp')
+
+from paprikasync.paprika_async import AsyncPaprikaClient  # noqa: E402
+from paprikasync.sync import do_sync_async  # noqa: E402
+
+
+def test_do_sync_async(mock_paprika):
+    partner = mock_paprika.add_account(
+        'partner@example.com', recipes=5, photos_per_recipe=1, trashed=0.2, seed=1
+    )
+    own = mock_paprika.add_account('own@example.com')
+    # created outside of the event loop that uses it
+    client = AsyncPaprikaClient(own.token, concurrency=2)
+
+    async def run():
+        async with client:
+            await do_sync_async(client, Partner('partner', partner.token))
+
+    asyncio.run(run())
+    synced = [r for r in partner.recipes.values() if not r['in_trash']]
+    assert {r['uid'] for r in own.recipes.values()} == {r['uid'] for r in synced}
+    assert {c['name'] for c in own.categories.values()} == {'Sync', 'partner'}
+    synced_uids = {r['uid'] for r in synced}
+    expected_photos = {
+        p['uid'] for p in partner.photos.values() if p['recipe_uid'] in synced_uids
+    }
+    assert set(own.photos) == expected_photos
+    assert own.status['recipes'] > 1
@@ -0,0 +1,101 @@
+from io import BytesIO
+from threading import Event
+
+import pytest
+from flask import Flask
+
+from paprikasync import thumbnails
+from paprikasync.blobs import FileBlobStore
+from paprikasync.thumbnails import (
+    ThumbnailError,
+    ThumbnailGenerator,
+    resize_image,
+    variant_key,
+)
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _image(width=800, height=600, image_format='JPEG'):
+    buf = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buf, image_format)
+    return buf.getvalue()
+
+
+def _open(data):
+    return Image.open(BytesIO(data))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileBlobStore(tmp_path)
+
+
+@pytest.fixture
+def app_context():
+    with Flask(__name__).app_context():
+        yield
+
+
+def test_variant_key():
+    assert variant_key('ABC', 320) == 'ABC-320'
+    assert variant_key('ABC', 320, 'webp') == 'ABC-320.webp'
+
+
+def test_resize_image():
+    image = _open(resize_image(_image(), 320))
+    assert (image.format, image.size) == ('JPEG', (320, 240))
+    image = _open(resize_image(_image(image_format='PNG'), 320, 'webp'))
+    assert (image.format, image.size) == ('WEBP', (320, 240))
+    # never scaled up
+    assert _open(resize_image(_image(100, 50), 320)).size == (100, 50)
+    with pytest.raises(ThumbnailError):
+        resize_image(b'not an image', 320)
+
+
+def test_generator(store, app_context, monkeypatch):
+    store.put('ABC', _image())
+    generator = ThumbnailGenerator(store)
+    assert generator.get(None, 1, 'ABC', 160, 'webp') == 'ABC-160.webp'
+    assert _open(store.get('ABC-160.webp')).size == (160, 120)
+    # existing variants are not generated again
+    monkeypatch.setattr(thumbnails, 'resize_image', None)
+    assert generator.get(None, 1, 'ABC', 160, 'webp') == 'ABC-160.webp'
+
+
+def test_generator_shares_jobs(store, app_context, monkeypatch):
+    store.put('ABC', _image())
+    started = Event()
+    finish = Event()
+    calls = []
+
+    def slow_resize_image(data, size, image_format=None):
+        calls.append(size)
+        started.set()
+        finish.wait(5)
+        return b'variant'
+
+    monkeypatch.setattr(thumbnails, 'resize_image', slow_resize_image)
+    generator = ThumbnailGenerator(store, jobs=1, max_pending=1, timeout=0.05)
+    # the job keeps running after the request gave up waiting for it
+    assert generator.get(None, 1, 'ABC', 320) is None
+    assert started.wait(5)
+    assert generator.get(None, 1, 'ABC', 320) is None
+    # too many pending jobs, so nothing new is started
+    assert generator.get(None, 1, 'ABC', 640) is None
+    finish.set()
+    generator._executor.shutdown(wait=True)
+    assert calls == [320]
+    assert store.get('ABC-320') == b'variant'
+    assert not generator._pending
+
+
+def test_generator_failures(store, app_context):
+    generator = ThumbnailGenerator(store)
+    store.put('BROKEN', b'not an image')
+    assert generator.get(None, 1, 'BROKEN', 320) is None
+    assert not store.exists('BROKEN-320')
+    generator.enabled = False
+    store.put('ABC', _image())
+    assert generator.get(None, 1, 'ABC', 320) is None
+    assert not store.exists('ABC-320')
@@ -0,0 +1,45 @@
+import io
+import json
+import threading
+
+from paprikasync.tracing import Tracer, span
+
+
+def _events(tracer):
+    buf = io.StringIO()
+    tracer.save(buf)
+    return json.loads(buf.getvalue())['traceEvents']
+
+
+def test_nested_spans():
+    tracer = Tracer()
+    with tracer.span('outer', uid='x'):
+        with span(tracer, 'inner'):
+            pass
+    with span(None, 'not traced'):
+        pass
+    spans = {e['name']: e for e in _events(tracer) if e['ph'] == 'X'}
+    assert list(spans) == ['inner', 'outer']
+    inner, outer = spans['inner'], spans['outer']
+    assert outer['args'] == {'uid': 'x'}
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+
+def test_threads():
+    tracer = Tracer()
+
+    def work():
+        with tracer.span('work', cat='http'):
+            pass
+
+    with tracer.span('main'):
+        thread = threading.Thread(target=work, name='worker')
+        thread.start()
+        thread.join()
+    events = _events(tracer)
+    names = {e['tid']: e['args']['name'] for e in events if e['ph'] == 'M'}
+    spans = {e['name']: e for e in events if e['ph'] == 'X'}
+    assert names[spans['work']['tid']] == 'worker'
+    assert spans['work']['tid'] != spans['main']['tid']
+    assert spans['work']['cat'] == 'http'